@@ -0,0 +1,358 @@
+"""
+Xử lý hàng loạt không cần giao diện, chạy tiếp được sau khi bị ngắt
+
+Duyệt cây thư mục, phân tích + tách từng file PDF và ghi trạng thái từng
+bước vào một journal chỉ ghi thêm (JSONL, fsync sau mỗi dòng):
+
+    {"source": "2024/hs_01.pdf", "event": "analyzed", "hash": ..., "analysis": [...]}
+    {"source": "2024/hs_01.pdf", "event": "split", "total_split": 5}
+    {"source": "2024/hs_02.pdf", "event": "failed", "stage": "analyze", "error": "..."}
+
+Kết quả phân tích nằm ngay trong journal, nên khi chạy lại:
+- file đã tách xong (và không đổi) được bỏ qua,
+- file đã phân tích nhưng chưa tách chỉ cần tách lại, không gọi AI,
+- file lỗi hoặc chưa có trong journal mới được xử lý.
+Ctrl+C: không nhận file mới, chờ các file đang chạy ghi xong journal.
+--page-cache dựng cache đặc trưng trang (page_cache.py) một lần cho mỗi file,
+chỉ khi có bước đọc nó (gọi AI hoặc ghi van_ban.jsonl); các lần chạy sau lấy
+profile và chữ từng trang từ cache. Cuối lượt chạy cache cũ được dọn (prune).
+
+    python batch.py run /mnt/ho_so /mnt/ket_qua --threads 4
+    python batch.py status /mnt/ket_qua
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from spool import make_jobs, load_api_key
+from pdf_core import FITZ_LOCK, analyze_pdf, split_pdf, is_quota_error
+from incremental import prepare as prepare_reuse
+from page_cache import open_cache, prune as prune_page_cache
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+JOURNAL_NAME = "journal.jsonl"
+DEFAULT_THREADS = 2
+QUOTA_RETRIES = 3           # Số lần thử lại khi hết quota (429 / RESOURCE_EXHAUSTED)
+QUOTA_BACKOFF = 30          # Giây chờ lần đầu, gấp đôi sau mỗi lần
+
+
+# ===============================
+#  JOURNAL
+# ===============================
+class Journal:
+    """Journal chỉ ghi thêm; trạng thái mỗi file là sự kiện cuối cùng của nó"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.attempts = {}
+        self._replay()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # Dòng cuối bị cắt dở khi máy tắt đột ngột
+                self._apply(entry)
+
+    def _apply(self, entry):
+        source = entry["source"]
+        previous = self.entries.get(source, {})
+        if entry["event"] == "failed":
+            self.attempts[source] = self.attempts.get(source, 0) + 1
+        # Giữ lại kết quả phân tích khi bước tách thất bại
+        if "analysis" not in entry and "analysis" in previous and entry.get("hash") in (None, previous.get("hash")):
+            entry = dict(entry, analysis=previous["analysis"], hash=previous.get("hash"))
+        self.entries[source] = entry
+
+    def append(self, source, event, **fields):
+        entry = {"source": source, "event": event,
+                 "time": datetime.datetime.now().isoformat(timespec="seconds"), **fields}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self.lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._apply(entry)
+        return entry
+
+    def state(self, source):
+        return self.entries.get(source)
+
+    def counts(self):
+        counts = {}
+        for entry in self.entries.values():
+            counts[entry["event"]] = counts.get(entry["event"], 0) + 1
+        return counts
+
+    def close(self):
+        self._file.close()
+
+
+def file_signature(path):
+    """Kích thước + mtime: đủ để biết file có đổi không mà không phải băm lại"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def unchanged(entry, signature):
+    return entry is not None and entry.get("size") == signature["size"] \
+        and entry.get("mtime_ns") == signature["mtime_ns"]
+
+
+def plan(journal, jobs):
+    """Chia job thành (cần chạy, bỏ qua); job cần chạy kèm kết quả phân tích đã có nếu còn dùng được"""
+    todo, skipped = [], 0
+    for job in jobs:
+        entry = journal.state(job["relative"])
+        signature = file_signature(job["source"])
+        if not unchanged(entry, signature):
+            entry = None  # File mới hoặc đã bị sửa: làm lại từ đầu
+        if entry and entry["event"] == "split":
+            skipped += 1
+            continue
+        job = dict(job, signature=signature)
+        if entry and entry.get("analysis") is not None:
+            job["analysis"] = entry["analysis"]
+            job["hash"] = entry.get("hash")
+        todo.append(job)
+    return todo, skipped
+
+
+# ===============================
+#  XỬ LÝ MỘT FILE
+# ===============================
+def analyze_with_retry(api_key, job, plan, page_cache=None, stop=None):
+    """analyze_pdf, thử lại có giãn cách khi hết quota thay vì ghi lỗi ngay"""
+    stop = stop or threading.Event()
+    for attempt in range(QUOTA_RETRIES + 1):
+        error, analysis = analyze_pdf(api_key, job["name"], job["source"], plan=plan, page_cache=page_cache)
+        if not error or not is_quota_error(error) or attempt == QUOTA_RETRIES:
+            return error, analysis
+        delay = QUOTA_BACKOFF * 2 ** attempt
+        log(f"⏳ {job['relative']}: hết quota, thử lại sau {delay} giây ({attempt + 1}/{QUOTA_RETRIES})")
+        if stop.wait(delay):
+            return error, None
+
+
+class LazyPageCache:
+    """Cache trang của một file, chỉ dựng / mở khi có bước thật sự đọc nó
+
+    Dựng cache không giữ FITZ_LOCK cả quá trình: page_cache.build chỉ lấy lock cho
+    phần fitz chạy trong process này, phần song song trong process con chạy tự do.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._cache = None
+        self._opened = False
+
+    def get(self, source_hash=None):
+        if not self._opened:
+            self._opened = True
+            self._cache = open_cache(self.source, source_hash, lock=FITZ_LOCK)
+        return self._cache
+
+    def close(self):
+        if self._cache is not None:
+            self._cache.close()
+            self._cache = None
+
+
+def process(job, journal, api_key, text_sidecar=False, image_profile=None, use_page_cache=False,
+            linearize=False, stop=None):
+    """Như process_file; use_page_cache cho phép dùng cache trang của file"""
+    if not use_page_cache:
+        return process_file(job, journal, api_key, text_sidecar, image_profile, linearize=linearize, stop=stop)
+
+    page_cache = LazyPageCache(job["source"])
+    try:
+        return process_file(job, journal, api_key, text_sidecar, image_profile, page_cache, linearize, stop)
+    finally:
+        page_cache.close()
+
+
+def process_file(job, journal, api_key, text_sidecar=False, image_profile=None, page_cache=None,
+                 linearize=False, stop=None):
+    """Phân tích (nếu chưa có) rồi tách; mỗi bước xong là ghi journal ngay
+
+    page_cache (LazyPageCache): chỉ được mở khi gọi AI hoặc khi ghi van_ban.jsonl.
+    """
+    from doc_index import file_hash, lookup_safely, record_safely
+
+    source, relative = job["source"], job["relative"]
+    signature = job["signature"]
+
+    analysis = job.get("analysis")
+    source_hash = job.get("hash")
+    if analysis is None:
+        source_hash = source_hash or file_hash(source)
+        analysis = lookup_safely(source_hash=source_hash)
+        cached = analysis is not None
+        if not cached:
+            with FITZ_LOCK:
+                page_hashes, plan = prepare_reuse(source)
+            # Dùng lại được toàn bộ kết quả cũ thì không gọi AI, không cần cache
+            needs_ai = plan is None or plan.tail_start is not None
+            cache = page_cache.get(source_hash) if page_cache is not None and needs_ai else None
+            error, analysis = analyze_with_retry(api_key, job, plan, cache, stop)
+            if error:
+                journal.append(relative, "failed", stage="analyze", error=error, hash=source_hash, **signature)
+                return False, error
+            record_safely(source, analysis, source_hash=source_hash, page_hashes=page_hashes)
+        journal.append(relative, "analyzed", hash=source_hash, cached=cached, analysis=analysis, **signature)
+
+    output_dir = job["output_dir"]
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        # Khi tách, cache chỉ dùng để ghi chữ vào van_ban.jsonl
+        cache = page_cache.get(source_hash) if page_cache is not None and text_sidecar else None
+        with FITZ_LOCK:
+            success, results = split_pdf(source, analysis, output_dir, text_sidecar, image_profile,
+                                         page_cache=cache, linearize=linearize)
+        with open(os.path.join(output_dir, "analysis.json"), "w", encoding="utf-8") as f:
+            json.dump(analysis, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        journal.append(relative, "failed", stage="split", error=str(e), hash=source_hash, **signature)
+        return False, str(e)
+
+    errors = [line for line in results if line.startswith("❌ Lỗi")]
+    if errors:
+        journal.append(relative, "failed", stage="split", error=errors[0], hash=source_hash, **signature)
+        return False, errors[0]
+    journal.append(relative, "split", hash=source_hash, total_split=success, output_dir=output_dir, **signature)
+    return True, f"{success} văn bản"
+
+
+def log(message):
+    stamp = datetime.datetime.now().strftime("%H:%M:%S")
+    print(f"[{stamp}] {message}", flush=True)
+
+
+def run(input_dir, output_root, api_key, threads=DEFAULT_THREADS, journal_path=None, recursive=True,
+        text_sidecar=False, image_profile=None, use_page_cache=False, linearize=False):
+    try:
+        jobs = make_jobs(input_dir, output_root, recursive)
+    except ValueError as e:
+        log(str(e))
+        return 2
+    os.makedirs(output_root, exist_ok=True)
+    journal = Journal(journal_path or os.path.join(output_root, JOURNAL_NAME))
+
+    for job in jobs:
+        job["relative"] = os.path.relpath(job["source"], os.path.abspath(input_dir))
+    todo, skipped = plan(journal, jobs)
+    resumed = sum(1 for job in todo if "analysis" in job)
+    log(f"{len(jobs)} file: bỏ qua {skipped} đã xong, {len(todo)} cần xử lý "
+        f"({resumed} đã phân tích, chỉ cần tách)")
+
+    stop = threading.Event()
+    done = {"ok": 0, "failed": 0}
+    done_lock = threading.Lock()
+    started = time.time()
+
+    def worker(index, job):
+        if stop.is_set():
+            return
+        try:
+            ok, message = process(job, journal, api_key, text_sidecar, image_profile, use_page_cache, linearize,
+                                  stop)
+        except Exception as e:
+            # Không có dòng journal thì lần chạy sau vẫn xử lý lại file này
+            ok, message = False, f"Lỗi: {e}"
+        with done_lock:
+            done["ok" if ok else "failed"] += 1
+        mark = "✅" if ok else "❌"
+        log(f"{mark} [{index}/{len(todo)}] {job['relative']}: {message}")
+
+    executor = ThreadPoolExecutor(max_workers=max(1, threads))
+    try:
+        futures = [executor.submit(worker, i + 1, job) for i, job in enumerate(todo)]
+        for future in futures:
+            future.result()
+    except KeyboardInterrupt:
+        stop.set()
+        log("Đang dừng: chờ các file đang xử lý ghi xong journal")
+        executor.shutdown(wait=True, cancel_futures=True)
+        journal.close()
+        return 130
+    executor.shutdown()
+    journal.close()
+    if use_page_cache:
+        removed, _ = prune_page_cache()
+        if removed:
+            log(f"🧹 Đã dọn {removed} file cache trang cũ")
+
+    log(f"Xong trong {time.time() - started:.0f}s: {done['ok']} thành công, {done['failed']} lỗi, "
+        f"{skipped} bỏ qua")
+    return 1 if done["failed"] else 0
+
+
+def print_status(journal_path):
+    if not os.path.exists(journal_path):
+        print(f"Chưa có journal: {journal_path}")
+        return
+    journal = Journal(journal_path)
+    counts = journal.counts()
+    for event in ("split", "analyzed", "failed"):
+        print(f"{event:<9} {counts.get(event, 0)}")
+    for source, entry in sorted(journal.entries.items()):
+        if entry["event"] == "failed":
+            print(f"  ❌ {source} ({entry.get('stage')}, {journal.attempts.get(source, 0)} lần): {entry.get('error')}")
+    journal.close()
+
+
+# ===============================
+#  DÒNG LỆNH
+# ===============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Phân tích + tách hàng loạt, chạy tiếp được sau khi bị ngắt")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="Xử lý mọi PDF trong thư mục (bỏ qua file đã xong)")
+    p_run.add_argument("input_dir")
+    p_run.add_argument("output_dir")
+    p_run.add_argument("--api-key", help="Mặc định: GOOGLE_API_KEY hoặc google_api_key.txt")
+    p_run.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="Số file xử lý song song")
+    p_run.add_argument("--journal", help=f"Mặc định: <output_dir>/{JOURNAL_NAME}")
+    p_run.add_argument("--no-recursive", action="store_true")
+    p_run.add_argument("--text-sidecar", action="store_true", help="Ghi kèm van_ban.jsonl")
+    p_run.add_argument("--image-profile", choices=["gray", "bilevel", "color"], help="Nén ảnh trang scan")
+    p_run.add_argument("--page-cache", action="store_true", help="Dựng / dùng cache đặc trưng trang")
+    p_run.add_argument("--linearize", action="store_true", help="Ghi file output dạng xem nhanh trên web")
+
+    p_status = sub.add_parser("status", help="Thống kê journal")
+    p_status.add_argument("output_dir")
+    p_status.add_argument("--journal")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        api_key = load_api_key(args.api_key)
+        if not api_key:
+            print("Cần API key (--api-key, GOOGLE_API_KEY hoặc google_api_key.txt)")
+            return 1
+        return run(args.input_dir, args.output_dir, api_key, args.threads, args.journal,
+                   not args.no_recursive, args.text_sidecar, args.image_profile, args.page_cache,
+                   args.linearize)
+    if args.command == "status":
+        print_status(args.journal or os.path.join(args.output_dir, JOURNAL_NAME))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,424 @@
+"""
+Chỉ mục SQLite các văn bản đã phân tích
+
+Mỗi lần phân tích xong, kết quả được lưu theo mã băm (sha256) của file gốc.
+Tra cứu "tất cả cáo trạng năm 2024" hay tách lại một file cũ chỉ cần
+tra chỉ mục và tách cục bộ bằng fitz, không phải gọi lại AI.
+
+Dùng từ dòng lệnh:
+    python doc_index.py find --loai cao_trang --nam 2024
+    python doc_index.py show ho_so.pdf
+    python doc_index.py add ho_so.pdf phan_tich.json
+    python doc_index.py resplit ho_so.pdf ket_qua/
+    python doc_index.py stats
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import hashlib
+import datetime
+import argparse
+import unicodedata
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+INDEX_DB = os.environ.get("PDF_INDEX_DB", "pdf_index.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source_hash TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    file_path TEXT,
+    page_count INTEGER,
+    analyzed_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source_hash TEXT NOT NULL REFERENCES sources(source_hash) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    ten_file_goc TEXT NOT NULL,
+    ten_file_output TEXT NOT NULL,
+    loai_van_ban TEXT,
+    loai_key TEXT,
+    so_hieu TEXT,
+    nam_van_ban INTEGER,
+    trang_bat_dau INTEGER NOT NULL,
+    trang_ket_thuc INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS page_hashes (
+    source_hash TEXT NOT NULL REFERENCES sources(source_hash) ON DELETE CASCADE,
+    page INTEGER NOT NULL,
+    page_hash TEXT NOT NULL,
+    PRIMARY KEY (source_hash, page)
+);
+
+CREATE INDEX IF NOT EXISTS idx_page_hashes_hash ON page_hashes(page_hash, page);
+CREATE INDEX IF NOT EXISTS idx_documents_source ON documents(source_hash, position);
+CREATE INDEX IF NOT EXISTS idx_documents_type_year ON documents(loai_key, nam_van_ban);
+CREATE INDEX IF NOT EXISTS idx_documents_year ON documents(nam_van_ban);
+CREATE INDEX IF NOT EXISTS idx_documents_number ON documents(so_hieu);
+CREATE INDEX IF NOT EXISTS idx_sources_name ON sources(file_name);
+"""
+
+# find_prefix: số trang so sánh mỗi lượt truy vấn
+PREFIX_CHUNK = 256
+
+RECORD_KEYS = ["ten_file_goc", "ten_file_output", "trang_bat_dau", "trang_ket_thuc", "nam_van_ban"]
+
+
+# ===============================
+#  TIỆN ÍCH
+# ===============================
+def file_hash(file_path):
+    """sha256 của nội dung file"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalize_key(text):
+    """'Cáo trạng' / 'Cao_Trang' -> 'cao_trang' để tra cứu không dấu"""
+    text = unicodedata.normalize("NFD", str(text or "")).replace("đ", "d").replace("Đ", "D")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return "_".join(text.lower().replace("-", " ").replace("_", " ").split())
+
+
+def split_document_name(ten_file_output):
+    """'Quyet_dinh_16-QD-DTTH.pdf' -> ('Quyet_dinh', '16-QD-DTTH')
+
+    Số hiệu bắt đầu từ phần đầu tiên có chữ số, phần trước đó là loại văn bản.
+    """
+    stem = os.path.splitext(os.path.basename(str(ten_file_output)))[0]
+    parts = stem.split("_")
+    for i, part in enumerate(parts):
+        if any(c.isdigit() for c in part):
+            return "_".join(parts[:i]), "_".join(parts[i:])
+    return stem, ""
+
+
+def escape_like(text):
+    """Giá trị cho LIKE ... ESCAPE '\\': % và _ trong dữ liệu nhập được hiểu đúng nghĩa đen"""
+    return str(text).replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ===============================
+#  CHỈ MỤC
+# ===============================
+class DocumentIndex:
+    def __init__(self, db_path=None):
+        self.db_path = db_path or INDEX_DB
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Mỗi thao tác một kết nối: dùng được từ nhiều luồng / process
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def record(self, file_path, analysis_data, source_hash=None, page_count=None, page_hashes=None,
+               store_path=True):
+        """Lưu (hoặc thay thế) kết quả phân tích của một file gốc
+
+        page_hashes: mã băm nội dung từng trang, để nhận ra bản sau của bộ hồ sơ
+        (cùng phần đầu, thêm trang ở cuối) và chỉ phân tích phần mới.
+        store_path=False cho file upload nằm trong thư mục tạm: chỉ lưu tên file,
+        không ghi đè đường dẫn đã lưu trước đó.
+        """
+        source_hash = source_hash or file_hash(file_path)
+        if page_hashes and page_count is None:
+            page_count = len(page_hashes)
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+
+        rows = []
+        for position, item in enumerate(analysis_data):
+            loai, so_hieu = split_document_name(item["ten_file_output"])
+            rows.append((
+                source_hash, position, item["ten_file_goc"], item["ten_file_output"],
+                loai, normalize_key(loai), so_hieu, _year(item.get("nam_van_ban")),
+                item["trang_bat_dau"], item["trang_ket_thuc"],
+            ))
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO sources (source_hash, file_name, file_path, page_count, analyzed_at) "
+                    "VALUES (?, ?, ?, ?, ?) ON CONFLICT(source_hash) DO UPDATE SET "
+                    "file_name = excluded.file_name, file_path = COALESCE(excluded.file_path, file_path), "
+                    "page_count = COALESCE(excluded.page_count, page_count), analyzed_at = excluded.analyzed_at",
+                    (source_hash, os.path.basename(file_path),
+                     os.path.abspath(file_path) if store_path else None, page_count, now),
+                )
+                conn.execute("DELETE FROM documents WHERE source_hash = ?", (source_hash,))
+                conn.executemany(
+                    "INSERT INTO documents (source_hash, position, ten_file_goc, ten_file_output, loai_van_ban, "
+                    "loai_key, so_hieu, nam_van_ban, trang_bat_dau, trang_ket_thuc) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                if page_hashes:
+                    conn.execute("DELETE FROM page_hashes WHERE source_hash = ?", (source_hash,))
+                    conn.executemany(
+                        "INSERT INTO page_hashes (source_hash, page, page_hash) VALUES (?, ?, ?)",
+                        [(source_hash, page, h) for page, h in enumerate(page_hashes, start=1)],
+                    )
+        finally:
+            conn.close()
+        return source_hash
+
+    def find_prefix(self, page_hashes):
+        """File đã phân tích có phần đầu trùng dài nhất với page_hashes
+
+        Trả về (source_hash, số trang trùng) hoặc None. So từng đoạn
+        PREFIX_CHUNK trang; file nào lệch ở đâu thì dừng đọc file đó ở đó,
+        nên chi phí tỉ lệ với phần trùng chứ không với toàn bộ các file cũ.
+        """
+        if not page_hashes:
+            return None
+        conn = self._connect()
+        try:
+            alive = [row[0] for row in conn.execute(
+                "SELECT source_hash FROM page_hashes WHERE page_hash = ? AND page = 1", (page_hashes[0],)
+            )]
+            if not alive:
+                return None
+            best = (alive[0], 1)
+            first = 2
+            while alive and first <= len(page_hashes):
+                last = min(first + PREFIX_CHUNK - 1, len(page_hashes))
+                wanted = page_hashes[first - 1:last]
+                stored = {}
+                # Giới hạn số tham số của SQLite (999 ở bản cũ)
+                for i in range(0, len(alive), 500):
+                    group = alive[i:i + 500]
+                    for source_hash, page, page_hash in conn.execute(
+                        f"SELECT source_hash, page, page_hash FROM page_hashes "
+                        f"WHERE source_hash IN ({','.join('?' * len(group))}) AND page BETWEEN ? AND ? "
+                        f"ORDER BY page",
+                        (*group, first, last),
+                    ):
+                        stored.setdefault(source_hash, []).append((page, page_hash))
+                survivors = []
+                for candidate in alive:
+                    prefix = first - 1
+                    for (page, old), new in zip(stored.get(candidate, []), wanted):
+                        if page != prefix + 1 or old != new:
+                            break
+                        prefix += 1
+                    if prefix > best[1]:
+                        best = (candidate, prefix)
+                    if prefix == last:
+                        survivors.append(candidate)
+                alive = survivors
+                first = last + 1
+        finally:
+            conn.close()
+        return best
+
+    def lookup(self, file_path=None, source_hash=None):
+        """Kết quả phân tích đã lưu của một file, dạng giống analysis_data; None nếu chưa có"""
+        source_hash = source_hash or file_hash(file_path)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM documents WHERE source_hash = ? ORDER BY position", (source_hash,)
+            ).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return None
+        return [{key: row[key] for key in RECORD_KEYS} for row in rows]
+
+    def find(self, loai=None, nam=None, so_hieu=None, ten_file_goc=None, source_hash=None, limit=None):
+        """Tìm văn bản theo loại, năm, số hiệu, file gốc"""
+        where, params = [], []
+        if loai:
+            where.append("d.loai_key LIKE ? ESCAPE '\\'")
+            params.append(escape_like(normalize_key(loai)) + "%")
+        if nam is not None:
+            where.append("d.nam_van_ban = ?")
+            params.append(int(nam))
+        if so_hieu:
+            where.append("d.so_hieu LIKE ? ESCAPE '\\'")
+            params.append(f"%{escape_like(so_hieu)}%")
+        if ten_file_goc:
+            where.append("d.ten_file_goc = ?")
+            params.append(ten_file_goc)
+        if source_hash:
+            where.append("d.source_hash = ?")
+            params.append(source_hash)
+
+        sql = (
+            "SELECT d.*, s.file_path, s.analyzed_at FROM documents d "
+            "JOIN sources s ON s.source_hash = d.source_hash"
+        )
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY d.nam_van_ban, d.ten_file_goc, d.position"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        conn = self._connect()
+        try:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            sources = conn.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+            documents = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            by_type = conn.execute(
+                "SELECT loai_key, COUNT(*) AS n FROM documents GROUP BY loai_key ORDER BY n DESC"
+            ).fetchall()
+        finally:
+            conn.close()
+        return {
+            "sources": sources,
+            "documents": documents,
+            "by_type": {row["loai_key"]: row["n"] for row in by_type},
+        }
+
+
+_default_index = None
+
+
+def default_index():
+    """Chỉ mục dùng chung trong process (tạo khi dùng lần đầu)"""
+    global _default_index
+    if _default_index is None:
+        _default_index = DocumentIndex()
+    return _default_index
+
+
+def record_safely(file_path, analysis_data, index=None, **kwargs):
+    """Ghi chỉ mục nhưng không làm hỏng job nếu chỉ mục lỗi"""
+    try:
+        (index or default_index()).record(file_path, analysis_data, **kwargs)
+    except Exception as e:
+        print(f"Warning: không ghi được chỉ mục ({e})")
+
+
+def lookup_safely(file_path=None, source_hash=None, index=None):
+    """Tra chỉ mục, trả về None nếu chưa có hoặc chỉ mục lỗi"""
+    try:
+        return (index or default_index()).lookup(file_path, source_hash)
+    except Exception as e:
+        print(f"Warning: không đọc được chỉ mục ({e})")
+        return None
+
+
+# ===============================
+#  TÁCH LẠI TỪ CHỈ MỤC
+# ===============================
+def resplit(file_path, output_dir, index=None):
+    """Tách lại file gốc theo kết quả đã lưu, không gọi AI"""
+    from pdf_core import split_pdf
+
+    records = (index or default_index()).lookup(file_path)
+    if records is None:
+        return 0, ["❌ File chưa có trong chỉ mục"]
+    return split_pdf(file_path, records, output_dir)
+
+
+# ===============================
+#  DÒNG LỆNH
+# ===============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chỉ mục văn bản đã phân tích")
+    parser.add_argument("--db", default=INDEX_DB, help=f"File SQLite (mặc định {INDEX_DB})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_find = sub.add_parser("find", help="Tìm văn bản")
+    p_find.add_argument("--loai", help="Loại văn bản, ví dụ cao_trang")
+    p_find.add_argument("--nam", type=int, help="Năm văn bản")
+    p_find.add_argument("--so-hieu", help="Một phần số hiệu")
+    p_find.add_argument("--file", help="Tên file gốc")
+    p_find.add_argument("--limit", type=int)
+    p_find.add_argument("--json", action="store_true", help="In kết quả dạng JSON")
+
+    p_show = sub.add_parser("show", help="Kết quả phân tích đã lưu của một file PDF")
+    p_show.add_argument("pdf")
+
+    p_add = sub.add_parser("add", help="Nạp file phân tích có sẵn (phan_tich.json, analysis.json...)")
+    p_add.add_argument("pdf")
+    p_add.add_argument("analysis_json")
+
+    p_resplit = sub.add_parser("resplit", help="Tách lại file PDF theo chỉ mục, không gọi AI")
+    p_resplit.add_argument("pdf")
+    p_resplit.add_argument("output_dir")
+
+    sub.add_parser("stats", help="Thống kê chỉ mục")
+
+    args = parser.parse_args(argv)
+    index = DocumentIndex(args.db)
+
+    if args.command == "find":
+        rows = index.find(args.loai, args.nam, args.so_hieu, args.file, limit=args.limit)
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            for row in rows:
+                print(f"{row['nam_van_ban'] or '----'}  {row['ten_file_output']:<40} "
+                      f"{row['ten_file_goc']} (Trang {row['trang_bat_dau']}-{row['trang_ket_thuc']})")
+            print(f"Tìm thấy {len(rows)} văn bản")
+    elif args.command == "show":
+        records = index.lookup(args.pdf)
+        if records is None:
+            print("File chưa có trong chỉ mục")
+            return 1
+        print(json.dumps(records, ensure_ascii=False, indent=2))
+    elif args.command == "add":
+        from model_router import AnalysisValidationError, validate_analysis
+
+        with open(args.analysis_json, encoding="utf-8") as f:
+            data = json.load(f)
+        name = os.path.basename(args.pdf)
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            print(f"❌ {args.analysis_json}: cần một JSON array các văn bản")
+            return 1
+        records = [item for item in data if item.get("ten_file_goc") in (None, name)] or data
+        # Kết quả cũ không ghi file gốc: coi là của file đang nạp
+        records = [dict(item, ten_file_goc=item.get("ten_file_goc") or name) for item in records]
+        try:
+            validate_analysis(records)
+        except AnalysisValidationError as e:
+            print(f"❌ {args.analysis_json}: {e}")
+            return 1
+        index.record(args.pdf, records)
+        print(f"Đã nạp {len(records)} văn bản của {name}")
+    elif args.command == "resplit":
+        success, results = resplit(args.pdf, args.output_dir, index)
+        for line in results:
+            print(line)
+        if not success:
+            return 1
+    elif args.command == "stats":
+        print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
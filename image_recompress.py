@@ -0,0 +1,206 @@
+"""
+Nén lại ảnh trang scan trước khi tách
+
+Bản scan thường nhúng ảnh màu độ phân giải gốc, nên mỗi file tách ra vẫn
+mang nguyên các ảnh đó. Với một profile đầu ra, ảnh trên các trang cần tách
+được giảm về DPI mục tiêu và mã hóa lại (JPEG xám, đen trắng, hoặc JPEG màu)
+song song trên nhiều process. Ảnh được thay ngay trong file gốc đang mở
+(không ghi ra đĩa), nên mỗi ảnh chỉ nén một lần dù nằm trong nhiều văn bản,
+và lớp chữ của trang giữ nguyên.
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+OUTPUT_PROFILES = {
+    "gray": {"mode": "gray", "dpi": 150, "quality": 60},
+    "bilevel": {"mode": "bilevel", "dpi": 200, "threshold": 160},
+    "color": {"mode": "color", "dpi": 150, "quality": 70},
+}
+
+PROFILE_LABELS = {
+    "": "Không nén ảnh",
+    "gray": "Ảnh xám (JPEG 150 DPI)",
+    "bilevel": "Đen trắng (200 DPI)",
+    "color": "Ảnh màu (JPEG 150 DPI)",
+}
+
+MIN_IMAGE_SIDE = 200        # Bỏ qua ảnh nhỏ (logo, chữ ký...)
+MIN_SAVING_RATIO = 0.9      # Chỉ thay ảnh khi nhỏ hơn ít nhất 10%
+INLINE_TASK_LIMIT = 16      # Ít ảnh thì nén luôn, không trả giá khởi động process con
+# Số process nén ảnh tối đa. Mặc định thấp vì split_pdf chạy cả trong request
+# web (máy 512MB); máy xử lý hàng loạt có thể đặt IMAGE_WORKERS cao hơn.
+IMAGE_WORKERS = max(1, int(os.environ.get("IMAGE_WORKERS", 2)))
+
+
+def get_profile(name):
+    """Profile theo tên; None nếu tên rỗng / không bật"""
+    if not name:
+        return None
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f"Profile ảnh không hợp lệ: {name}")
+    return OUTPUT_PROFILES[name]
+
+
+def format_size(size):
+    return f"{size / (1024 * 1024):.1f} MB" if size >= 1024 * 1024 else f"{size / 1024:.0f} KB"
+
+
+# ===============================
+#  LẬP KẾ HOẠCH
+# ===============================
+def plan_images(doc, page_numbers, target_dpi):
+    """Các ảnh cần nén trên page_numbers (đánh số từ 0): [(page, xref, scale)]"""
+    tasks = []
+    seen = set()
+    for pno in sorted(page_numbers):
+        page = doc[pno]
+        for img in page.get_images(full=True):
+            xref, smask, width, height = img[0], img[1], img[2], img[3]
+            if xref in seen:
+                continue
+            seen.add(xref)
+            # Ảnh có mặt nạ trong suốt hoặc quá nhỏ: giữ nguyên
+            if smask or min(width, height) < MIN_IMAGE_SIDE:
+                continue
+
+            rects = page.get_image_rects(xref)
+            if not rects:
+                continue
+            rect = max(rects, key=lambda r: r.width * r.height)
+            if rect.width <= 0 or rect.height <= 0:
+                continue
+
+            dpi = max(width / (rect.width / 72), height / (rect.height / 72))
+            scale = min(1.0, target_dpi / dpi)
+            tasks.append((pno, xref, scale))
+    return tasks
+
+
+# ===============================
+#  NÉN (CHẠY TRONG PROCESS CON)
+# ===============================
+def _encode(pix, profile):
+    import fitz
+
+    if pix.alpha:
+        pix = fitz.Pixmap(pix, 0)
+    if pix.colorspace is None or pix.colorspace.n not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+
+    if profile["mode"] in ("gray", "bilevel") and pix.n > 1:
+        pix = fitz.Pixmap(fitz.csGRAY, pix)
+
+    if profile["mode"] == "bilevel":
+        threshold = profile.get("threshold", 160)
+        table = bytes(0 if i < threshold else 255 for i in range(256))
+        samples = bytes(pix.samples).translate(table)
+        pix = fitz.Pixmap(fitz.csGRAY, pix.width, pix.height, samples, 0)
+        # PNG của ảnh chỉ có 0/255 nén rất tốt, không bị nhòe như JPEG
+        return pix.tobytes("png")
+
+    return pix.tobytes("jpeg", jpg_quality=profile.get("quality", 70))
+
+
+def recompress_chunk(source_path, tasks, profile):
+    """Nén một nhóm ảnh: [(page, xref, scale)] -> [(page, xref, old_size, new_bytes)]"""
+    import fitz
+
+    results = []
+    doc = fitz.open(source_path)
+    try:
+        for pno, xref, scale in tasks:
+            try:
+                old_size = len(doc.xref_stream_raw(xref) or b"")
+                pix = fitz.Pixmap(doc, xref)
+                if scale < 1.0:
+                    width = max(1, int(pix.width * scale))
+                    height = max(1, int(pix.height * scale))
+                    pix = fitz.Pixmap(pix, width, height, None)
+                results.append((pno, xref, old_size, _encode(pix, profile)))
+            except Exception:
+                continue  # Ảnh lạ (JBIG2, mã hóa hỏng...): giữ nguyên
+    finally:
+        doc.close()
+    return results
+
+
+def _chunks(items, count):
+    size = max(1, -(-len(items) // count))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+# ===============================
+#  API
+# ===============================
+def recompress_images(doc, source_path, page_numbers, profile, workers=None):
+    """Nén ảnh trên các trang cần tách của doc (file gốc đang mở)
+
+    Trả về (tổng dung lượng ảnh trước, sau, số ảnh đã thay).
+    """
+    tasks = plan_images(doc, page_numbers, profile["dpi"])
+    if not tasks:
+        return 0, 0, 0
+
+    workers = min(workers or os.cpu_count() or 1, IMAGE_WORKERS)
+    if len(tasks) <= INLINE_TASK_LIMIT or workers == 1:
+        encoded = recompress_chunk(source_path, tasks, profile)
+    else:
+        # spawn: an toàn khi process cha có nhiều luồng (gunicorn, Tk, executor)
+        context = multiprocessing.get_context("spawn")
+        chunks = _chunks(tasks, workers * 4)
+        encoded = []
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as pool:
+            futures = [pool.submit(recompress_chunk, source_path, chunk, profile) for chunk in chunks]
+            for future in futures:
+                encoded.extend(future.result())
+
+    before = after = replaced = 0
+    for pno, xref, old_size, data in encoded:
+        before += old_size
+        if len(data) < old_size * MIN_SAVING_RATIO:
+            doc[pno].replace_image(xref, stream=data)
+            after += len(data)
+            replaced += 1
+        else:
+            after += old_size
+    return before, after, replaced
+
+
+def pages_in_analysis(analysis_data, page_count):
+    """Các trang (đánh số từ 0) thuộc một văn bản hợp lệ nào đó"""
+    pages = set()
+    for item in analysis_data:
+        start, end = item.get("trang_bat_dau", 0), item.get("trang_ket_thuc", 0)
+        if isinstance(start, int) and isinstance(end, int) and 1 <= start <= end <= page_count:
+            pages.update(range(start - 1, end))
+    return pages
+
+
+def apply_profile(doc, source_path, analysis_data, profile_name):
+    """Dùng trong split_pdf: nén ảnh theo profile, trả về số ảnh đã thay (None nếu không bật)"""
+    profile = get_profile(profile_name)
+    if profile is None:
+        return None
+    _, _, replaced = recompress_images(
+        doc, source_path, pages_in_analysis(analysis_data, doc.page_count), profile
+    )
+    return replaced
+
+
+def size_report(profile_name, replaced, source_path, output_paths):
+    """Dòng báo cáo theo dung lượng file thật: file gốc -> tổng các file tách ra"""
+    if not replaced:
+        return "🗜️ Nén ảnh: không có ảnh nào cần nén"
+    output_size = sum(os.path.getsize(path) for path in output_paths if os.path.exists(path))
+    return (f"🗜️ Nén ảnh ({profile_name}, {replaced} ảnh): file gốc {format_size(os.path.getsize(source_path))}"
+            f" → các file tách {format_size(output_size)}")
+
+
+def save_options(profile_name):
+    """Khi đã nén ảnh thì dọn object thừa và nén stream lúc lưu"""
+    return {"garbage": 3, "deflate": True} if profile_name else {}
@@ -0,0 +1,142 @@
+"""
+Đo thời gian import (khởi động lạnh) của các module chính
+
+Mỗi module được import trong một process Python mới, lặp lại vài lần và lấy
+trung vị. Module nào vượt ngân sách thì thoát với mã 1, để chạy trong CI
+hoặc trước khi phát hành:
+
+    python importbench.py
+    python importbench.py --repeat 9 --scale 2          # máy CI chậm hơn
+    python importbench.py pdf_core=0.1 webapp
+
+Ngoài thời gian còn kiểm tra các module không có giao diện (pdf_core, batch,
+spool...) không kéo theo thư viện nặng (fitz, google.genai, tkinter, pandas):
+những thư viện đó phải được nạp lười khi dùng đến.
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+# Ngân sách (giây) cho thời gian import, không tính khởi động trình thông dịch
+BUDGETS = {
+    "pdf_core": 0.15,
+    "batch": 0.2,
+    "spool": 0.2,
+    "web_common": 0.2,
+    "webapp": 0.6,
+    "webapp_async": 1.0,
+}
+
+HEAVY_MODULES = ("fitz", "pymupdf", "google.genai", "google.generativeai", "tkinter", "pandas", "pikepdf")
+# Các module này không được nạp thư viện nặng lúc import
+LAZY_MODULES = ("pdf_core", "batch", "spool", "doc_index", "model_router", "image_recompress", "page_cache",
+                "web_common")
+
+DEFAULT_REPEAT = 5
+
+PROBE = """
+import sys, json, time, importlib
+started = time.perf_counter()
+try:
+    importlib.import_module(sys.argv[1])
+except ImportError as e:
+    print(json.dumps({"missing": str(e)}))
+    sys.exit(0)
+elapsed = time.perf_counter() - started
+heavy = [m for m in sys.argv[2:] if m in sys.modules]
+print(json.dumps({"seconds": elapsed, "heavy": heavy}))
+"""
+
+
+def measure_once(module, cwd):
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE, module, *HEAVY_MODULES],
+        cwd=cwd, capture_output=True, text=True, timeout=120,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def measure(module, repeat=DEFAULT_REPEAT, cwd=None):
+    """Trung vị thời gian import qua `repeat` process mới"""
+    cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+    # Lần đầu có thể phải biên dịch .pyc: chạy bỏ qua
+    first = measure_once(module, cwd)
+    if "missing" in first:
+        return first
+    samples = [measure_once(module, cwd) for _ in range(repeat)]
+    return {
+        "seconds": statistics.median(s["seconds"] for s in samples),
+        "heavy": sorted(set().union(*(s["heavy"] for s in samples))),
+    }
+
+
+def parse_budgets(items):
+    """['pdf_core=0.1', 'webapp'] -> {'pdf_core': 0.1, 'webapp': BUDGETS['webapp']}"""
+    if not items:
+        return dict(BUDGETS)
+    budgets = {}
+    for item in items:
+        name, _, value = item.partition("=")
+        if value:
+            budgets[name] = float(value)
+        elif name in BUDGETS:
+            budgets[name] = BUDGETS[name]
+        else:
+            raise ValueError(f"Chưa có ngân sách cho {name}, dùng {name}=<giây>")
+    return budgets
+
+
+def run(budgets, repeat=DEFAULT_REPEAT, scale=1.0, strict=False):
+    failures = 0
+    print(f"{'module':<15} {'import':>9} {'ngân sách':>10}  kết quả")
+    for module, budget in budgets.items():
+        budget *= scale
+        result = measure(module, repeat)
+        if "missing" in result:
+            status = "❌ thiếu thư viện" if strict else "bỏ qua (thiếu thư viện)"
+            failures += strict
+            print(f"{module:<15} {'-':>9} {budget:>9.3f}s  {status}: {result['missing']}")
+            continue
+
+        problems = []
+        if result["seconds"] > budget:
+            problems.append("vượt ngân sách")
+        if module in LAZY_MODULES and result["heavy"]:
+            problems.append("nạp sớm " + ", ".join(result["heavy"]))
+        failures += bool(problems)
+        status = "❌ " + "; ".join(problems) if problems else "✅"
+        print(f"{module:<15} {result['seconds']:>8.3f}s {budget:>9.3f}s  {status}")
+    return 1 if failures else 0
+
+
+# ===============================
+#  DÒNG LỆNH
+# ===============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Kiểm tra thời gian import so với ngân sách")
+    parser.add_argument("budget", nargs="*", help="module hoặc module=giây (mặc định: tất cả trong BUDGETS)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Số lần đo mỗi module")
+    parser.add_argument("--scale", type=float, default=float(os.environ.get("IMPORT_BUDGET_SCALE", 1.0)),
+                        help="Nhân ngân sách (máy chậm)")
+    parser.add_argument("--strict", action="store_true", help="Thiếu thư viện cũng tính là lỗi")
+    args = parser.parse_args(argv)
+
+    try:
+        budgets = parse_budgets(args.budget)
+    except ValueError as e:
+        print(e)
+        return 2
+    return run(budgets, max(1, args.repeat), args.scale, args.strict)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Chỉ phân tích phần mới thêm vào cuối bộ hồ sơ
+
+Hồ sơ vụ án thường lớn dần: bản upload hôm nay là bản tuần trước cộng thêm
+vài văn bản ở cuối. Mỗi trang được băm theo nội dung (lệnh vẽ + ảnh), lưu
+trong chỉ mục cùng kết quả phân tích. Khi một file mới có phần đầu trùng với
+một file đã phân tích:
+- các văn bản nằm trọn trong phần trùng được dùng lại,
+- văn bản cuối cùng đã biết cùng các trang sau nó được gửi cho AI
+  (để AI nối tiếp văn bản đó nếu nó dài thêm),
+- số trang AI trả về được cộng thêm độ lệch để khớp với file đầy đủ.
+Chi phí phân tích vì thế tỉ lệ với số trang thêm vào, không với cả bộ hồ sơ.
+"""
+
+import hashlib
+from collections import namedtuple
+
+from doc_index import default_index
+
+INCREMENTAL_PROMPT = """
+File PDF đính kèm là phần cuối của bộ hồ sơ {filename}: trang {first_page}-{last_page} của file gốc.
+Các trang trước đó đã được phân tích.
+
+Trang 1-{known_pages} của file đính kèm là văn bản đã biết "{known_document}".
+Văn bản này có thể kéo dài thêm sang các trang sau: hãy xác định lại trang kết thúc của nó.
+
+Xác định CHÍNH XÁC mọi văn bản trong file đính kèm (kể cả văn bản đã biết ở trên):
+- Ranh giới từng văn bản (trang bắt đầu, trang kết thúc)
+- Loại văn bản (Quyết định, Lệnh, Cáo trạng, Bản án...)
+- Số hiệu và năm văn bản
+
+ĐÁNH SỐ TRANG THEO FILE ĐÍNH KÈM (trang đầu tiên là 1).
+
+Trả về JSON array:
+[
+  {{"ten_file_goc": "{filename}", "ten_file_output": "Loai_So.pdf", "trang_bat_dau": 1, "trang_ket_thuc": 2, "nam_van_ban": 2024}}
+]
+
+CHỈ TRẢ VỀ JSON, KHÔNG GIẢI THÍCH.
+"""
+
+# kept: văn bản dùng lại; known: văn bản cuối đã biết (gửi lại cho AI);
+# tail_start: trang đầu của phần gửi AI (None nếu dùng lại được toàn bộ)
+ReusePlan = namedtuple("ReusePlan", ["source_hash", "prefix_pages", "page_count", "kept", "known", "tail_start"])
+
+
+def page_hashes(file_path):
+    """sha1 nội dung từng trang: kích thước, lệnh vẽ và dữ liệu ảnh. [] nếu không đọc được"""
+    try:
+        import fitz
+    except ImportError:
+        return []
+
+    try:
+        doc = fitz.open(file_path)
+    except Exception:
+        return []
+
+    hashes = []
+    image_digests = {}
+    try:
+        for page in doc:
+            digest = hashlib.sha1()
+            digest.update(repr(tuple(page.rect)).encode())
+            digest.update(page.read_contents())
+            for img in page.get_images(full=True):
+                xref = img[0]
+                if xref not in image_digests:
+                    image_digests[xref] = hashlib.sha1(doc.xref_stream_raw(xref) or b"").digest()
+                digest.update(image_digests[xref])
+            hashes.append(digest.hexdigest())
+    except Exception:
+        return []
+    finally:
+        doc.close()
+    return hashes
+
+
+def make_plan(records, source_hash, prefix_pages, page_count):
+    """Kế hoạch dùng lại từ kết quả cũ; None nếu không tiết kiệm được gì"""
+    inside = sorted(
+        (r for r in records if r["trang_ket_thuc"] <= prefix_pages),
+        key=lambda r: (r["trang_bat_dau"], r["trang_ket_thuc"]),
+    )
+    if not inside:
+        return None
+
+    # File mới trùng toàn bộ với file cũ (chỉ khác metadata...): không cần gọi AI
+    if prefix_pages == page_count and len(inside) == len(records):
+        return ReusePlan(source_hash, prefix_pages, page_count, inside, None, None)
+
+    known = inside[-1]
+    if known["trang_bat_dau"] <= 1:
+        return None
+    return ReusePlan(source_hash, prefix_pages, page_count, inside[:-1], known, known["trang_bat_dau"])
+
+
+def plan_reuse(hashes, index=None):
+    """Tìm file đã phân tích có cùng phần đầu. Trả về ReusePlan hoặc None"""
+    index = index or default_index()
+    match = index.find_prefix(hashes)
+    if not match or match[1] == 0:
+        return None
+    source_hash, prefix_pages = match
+    records = index.lookup(source_hash=source_hash)
+    if not records:
+        return None
+    return make_plan(records, source_hash, prefix_pages, len(hashes))
+
+
+def prepare(file_path, index=None, reuse=True):
+    """Băm từng trang và tìm kế hoạch dùng lại: (page_hashes, plan). Không bao giờ ném lỗi
+
+    reuse=False (phân tích lại theo yêu cầu): chỉ băm, không dùng kết quả cũ.
+    """
+    hashes = page_hashes(file_path)
+    if not hashes or not reuse:
+        return hashes, None
+    try:
+        return hashes, plan_reuse(hashes, index)
+    except Exception as e:
+        print(f"Warning: không tra được chỉ mục trang ({e})")
+        return hashes, None
+
+
+def reused_analysis(plan, filename):
+    """Kết quả khi dùng lại được toàn bộ (plan.tail_start là None)"""
+    return [dict(r, ten_file_goc=filename) for r in plan.kept]
+
+
+def tail_pdf_bytes(file_path, first_page):
+    """Các trang từ first_page (đánh số từ 1) đến hết, dạng PDF trong bộ nhớ"""
+    import fitz
+
+    doc = fitz.open(file_path)
+    try:
+        tail = fitz.open()
+        tail.insert_pdf(doc, from_page=first_page - 1)
+        data = tail.tobytes(garbage=1, deflate=True)
+        tail.close()
+    finally:
+        doc.close()
+    return data
+
+
+def tail_prompt(plan, filename):
+    known = plan.known
+    return INCREMENTAL_PROMPT.format(
+        filename=filename,
+        first_page=plan.tail_start,
+        last_page=plan.page_count,
+        known_pages=known["trang_ket_thuc"] - plan.tail_start + 1,
+        known_document=known["ten_file_output"],
+    )
+
+
+def merge(plan, tail_data, filename):
+    """Ghép văn bản dùng lại với kết quả phần cuối (đã cộng độ lệch trang)"""
+    offset = plan.tail_start - 1
+    shifted = [
+        dict(item, ten_file_goc=filename,
+             trang_bat_dau=item["trang_bat_dau"] + offset,
+             trang_ket_thuc=item["trang_ket_thuc"] + offset)
+        for item in tail_data
+    ]
+    return reused_analysis(plan, filename) + shifted
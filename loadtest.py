@@ -0,0 +1,434 @@
+"""
+Load test cho web app với server Gemini giả lập
+
+Chạy một server HTTP nội bộ giả API generateContent của Gemini (độ trễ,
+tỉ lệ 429 và tỉ lệ JSON hỏng tùy chỉnh), khởi động webapp trỏ vào server đó
+qua GEMINI_BASE_URL, rồi gửi upload đồng thời các file PDF tổng hợp.
+Với mỗi mức đồng thời, in throughput, độ trễ p50/p95/p99, tỉ lệ lỗi và RSS
+của server.
+
+Ví dụ:
+    python loadtest.py --concurrency 1,4,16 --requests 40 --latency 2 --rate-429 0.05
+    python loadtest.py --server asgi --concurrency 8,32,64
+    python loadtest.py --server gunicorn --workers 4 --timeout 120
+    python loadtest.py --url http://127.0.0.1:8080 --pid 12345   # server đang chạy sẵn
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import shutil
+import socket
+import base64
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+PAGE_PATTERN = re.compile(rb"/Type\s*/Page(?!s)")
+
+
+# ===============================
+#  SERVER GEMINI GIẢ LẬP
+# ===============================
+class FakeGeminiConfig:
+    def __init__(self, latency=1.0, jitter=0.2, rate_429=0.0, rate_malformed=0.0, doc_pages=3):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_malformed = rate_malformed
+        self.doc_pages = doc_pages
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+
+def fake_analysis(page_count, doc_pages, filename="bundle.pdf"):
+    """Bản ghi hợp lệ chia file thành các văn bản doc_pages trang"""
+    records = []
+    for number, start in enumerate(range(1, page_count + 1, doc_pages), 1):
+        records.append({
+            "ten_file_goc": filename,
+            "ten_file_output": f"Quyet_dinh_{number}-QD-LT.pdf",
+            "trang_bat_dau": start,
+            "trang_ket_thuc": min(start + doc_pages - 1, page_count),
+            "nam_van_ban": 2024,
+        })
+    return records
+
+
+def count_pdf_pages(body):
+    """Đếm trang từ PDF inline trong request (đủ cho file tổng hợp không nén)"""
+    for content in body.get("contents", []):
+        for part in content.get("parts", []):
+            inline = part.get("inlineData") or part.get("inline_data")
+            if inline:
+                pdf_bytes = base64.b64decode(inline.get("data", ""))
+                return max(1, len(PAGE_PATTERN.findall(pdf_bytes)))
+    return 1
+
+
+def make_fake_handler(config):
+    class FakeGeminiHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            data = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            config.count("requests")
+
+            if not self.path.endswith(":generateContent"):
+                config.count("not_found")
+                self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+                return
+
+            time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+            roll = random.random()
+            if roll < config.rate_429:
+                config.count("429")
+                self.send_json(429, {"error": {
+                    "code": 429,
+                    "message": "Resource has been exhausted (e.g. check quota).",
+                    "status": "RESOURCE_EXHAUSTED",
+                }})
+                return
+
+            try:
+                page_count = count_pdf_pages(json.loads(raw))
+            except (ValueError, TypeError):
+                page_count = 1
+
+            if roll < config.rate_429 + config.rate_malformed:
+                config.count("malformed")
+                text = '[{"ten_file_goc": "bundle.pdf", "trang_bat_dau": 1,'
+            else:
+                config.count("ok")
+                text = json.dumps(fake_analysis(page_count, config.doc_pages))
+
+            self.send_json(200, {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP",
+                    "index": 0,
+                }],
+                "usageMetadata": {"promptTokenCount": 258 * page_count, "candidatesTokenCount": len(text) // 4},
+            })
+
+    return FakeGeminiHandler
+
+
+def start_fake_gemini(config, port=0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_fake_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ===============================
+#  FILE PDF TỔNG HỢP
+# ===============================
+def make_bundle(pages, nonce=None):
+    """PDF nhiều trang có lớp chữ, như một tập hồ sơ nhỏ
+
+    nonce được in lên trang 1: đổi cả mã băm trang, nên chỉ mục không dùng lại được
+    kết quả của upload trước (incremental.prepare tìm theo phần đầu trùng).
+    """
+    import fitz
+
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"QUYET DINH so {i // 3 + 1}/QD-LT", fontsize=16)
+        page.insert_text((72, 110), f"Trang {i + 1} - noi dung tong hop de kiem thu tai.", fontsize=11)
+        if i == 0 and nonce:
+            page.insert_text((72, 760), f"loadtest {nonce}", fontsize=6)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def unique_bundles(pages, count):
+    """count file khác nhau từ trang đầu; dựng trước khi đo vì fitz không an toàn đa luồng"""
+    return [make_bundle(pages, uuid.uuid4().hex) for _ in range(count)]
+
+
+# ===============================
+#  SERVER CẦN ĐO
+# ===============================
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_webapp(kind, port, workers, timeout, env, log_path):
+    bind = f"127.0.0.1:{port}"
+    if kind == "gunicorn":
+        cmd = ["gunicorn", "webapp:app", "--bind", bind, "--workers", str(workers), "--timeout", str(timeout)]
+    elif kind == "asgi":
+        cmd = ["gunicorn", "webapp_async:app", "-k", "uvicorn.workers.UvicornWorker",
+               "--bind", bind, "--workers", str(workers), "--timeout", str(timeout)]
+    else:
+        cmd = [sys.executable, "webapp.py"]
+        env = dict(env, PORT=str(port))
+    here = os.path.dirname(os.path.abspath(__file__))
+    log = open(log_path, "wb")
+    return subprocess.Popen(cmd, cwd=here, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_healthy(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url + "/health", timeout=2).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.3)
+    return False
+
+
+def process_tree_rss(pid):
+    """Tổng RSS (MB) của process và các process con, đọc từ /proc"""
+    children = {}
+    try:
+        for entry in os.listdir("/proc"):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    except OSError:
+        return None
+
+    total_kb = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+class RssSampler:
+    """Lấy mẫu RSS định kỳ trong một mức tải, giữ giá trị lớn nhất"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        if self.pid:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.peak = rss if self.peak is None else max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+# ===============================
+#  TẠO TẢI
+# ===============================
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def upload_once(url, bundle, timeout):
+    started = time.perf_counter()
+    try:
+        response = requests.post(
+            url + "/upload",
+            files={"files[]": ("bundle.pdf", bundle, "application/pdf")},
+            data={"api_key": "loadtest-key"},
+            timeout=timeout,
+        )
+        elapsed = time.perf_counter() - started
+        if response.status_code == 200:
+            return elapsed, "ok"
+        try:
+            message = response.json().get("error", "")
+        except ValueError:
+            message = ""
+        if "Quota" in message:
+            return elapsed, f"http_{response.status_code}_quota"
+        if "JSON" in message or "không hợp lệ" in message or "thiếu" in message:
+            return elapsed, f"http_{response.status_code}_invalid_ai"
+        return elapsed, f"http_{response.status_code}"
+    except requests.Timeout:
+        return time.perf_counter() - started, "timeout"
+    except requests.RequestException:
+        return time.perf_counter() - started, "connection_error"
+
+
+def run_level(url, bundles, concurrency, timeout, pid):
+    total = len(bundles)
+    with RssSampler(pid) as sampler, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        outcomes = list(pool.map(lambda bundle: upload_once(url, bundle, timeout), bundles))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed for elapsed, status in outcomes if status == "ok")
+    statuses = Counter(status for _, status in outcomes)
+    errors = total - statuses.get("ok", 0)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "wall_s": round(wall, 2),
+        "throughput_rps": round(statuses.get("ok", 0) / wall, 3) if wall else 0,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "error_rate": round(errors / total, 3),
+        "errors": {k: v for k, v in statuses.items() if k != "ok"},
+        "peak_rss_mb": round(sampler.peak, 1) if sampler.peak is not None else None,
+    }
+
+
+def print_report(rows):
+    def fmt(value):
+        return "-" if value is None else f"{value:.2f}"
+
+    print(f"{'conc':>5} {'req':>5} {'rps':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'err%':>6} {'rss MB':>8}  errors")
+    for row in rows:
+        print(f"{row['concurrency']:>5} {row['requests']:>5} {row['throughput_rps']:>7.2f} "
+              f"{fmt(row['p50_s']):>7} {fmt(row['p95_s']):>7} {fmt(row['p99_s']):>7} "
+              f"{row['error_rate'] * 100:>5.1f}% {fmt(row['peak_rss_mb']):>8}  {row['errors'] or ''}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test webapp với server Gemini giả lập")
+    parser.add_argument("--server", choices=["gunicorn", "asgi", "flask"], default="gunicorn",
+                        help="Cách khởi động webapp (bỏ qua nếu dùng --url)")
+    parser.add_argument("--url", help="Đo server đang chạy sẵn (server đó phải đặt GEMINI_BASE_URL)")
+    parser.add_argument("--pid", type=int, help="PID server đang chạy sẵn để đo RSS")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--timeout", type=int, default=300, help="--timeout của gunicorn")
+    parser.add_argument("--concurrency", default="1,4,16", help="Các mức đồng thời, ví dụ 1,4,16")
+    parser.add_argument("--requests", type=int, default=0, help="Số request mỗi mức (mặc định 5 x concurrency)")
+    parser.add_argument("--pages", type=int, default=12, help="Số trang mỗi file tổng hợp")
+    parser.add_argument("--latency", type=float, default=1.0, help="Độ trễ Gemini giả lập (giây)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-malformed", type=float, default=0.0)
+    parser.add_argument("--fake-port", type=int, default=0, help="Cổng server Gemini giả lập (0 = tự chọn)")
+    parser.add_argument("--client-timeout", type=float, default=600)
+    parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--keep", action="store_true", help="Giữ thư mục tạm (upload, output, index, log)")
+    args = parser.parse_args(argv)
+
+    config = FakeGeminiConfig(args.latency, args.jitter, args.rate_429, args.rate_malformed)
+    fake_server, fake_url = start_fake_gemini(config, args.fake_port)
+    print(f"Gemini giả lập: {fake_url}")
+
+    process = None
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    url, pid = args.url, args.pid
+    try:
+        if not url:
+            port = free_port()
+            env = dict(
+                os.environ,
+                GEMINI_BASE_URL=fake_url,
+                PDF_INDEX_DB=os.path.join(workdir, "index.db"),
+                TMPDIR=workdir,
+            )
+            log_path = os.path.join(workdir, "webapp.log")
+            process = start_webapp(args.server, port, args.workers, args.timeout, env, log_path)
+            url, pid = f"http://127.0.0.1:{port}", process.pid
+            if not wait_healthy(url):
+                process.terminate()
+                print("Webapp không khởi động được:")
+                with open(log_path, encoding="utf-8", errors="replace") as f:
+                    print(f.read()[-2000:])
+                return 1
+            print(f"Webapp ({args.server}, workers={args.workers}, timeout={args.timeout}): {url}")
+
+        rows = []
+        for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+            total = args.requests or concurrency * 5
+            print(f"Mức {concurrency}: {total} request...")
+            bundles = unique_bundles(args.pages, total)
+            calls_before = config.counts["requests"]
+            row = run_level(url, bundles, concurrency, args.client_timeout, pid)
+            # Mỗi upload phải tới được Gemini giả lập, nếu không là đang đo chỉ mục chứ không đo AI
+            row["ai_calls"] = config.counts["requests"] - calls_before
+            if row["ai_calls"] < total:
+                print(f"⚠️ Chỉ {row['ai_calls']}/{total} upload gọi Gemini giả lập "
+                      f"(server không trỏ GEMINI_BASE_URL vào {fake_url}, hoặc dùng lại kết quả đã lưu)")
+            rows.append(row)
+
+        print()
+        print_report(rows)
+        print(f"\nGemini giả lập: {dict(config.counts)}")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"args": vars(args), "levels": rows, "fake_gemini": dict(config.counts)}, f, indent=2)
+        return 0
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        fake_server.shutdown()
+        if args.keep:
+            print(f"Thư mục tạm: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
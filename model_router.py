@@ -0,0 +1,284 @@
+"""
+Chọn model Gemini theo độ khó của file PDF
+
+- File ngắn hoặc có sẵn lớp chữ  -> model nhanh, rẻ
+- File scan dài                  -> model mạnh
+- Còn lại                        -> model mặc định
+
+Chỉ nâng lên model mạnh hơn khi phản hồi không qua kiểm tra
+(thiếu trường bắt buộc, phạm vi trang sai, JSON hỏng).
+RouteStats ghi tỉ lệ nâng cấp theo tuyến ban đầu và thời gian theo tuyến được gọi.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+MODEL_TIERS = [
+    ("fast", os.environ.get("GEMINI_MODEL_FAST", "gemini-2.5-flash-lite")),
+    ("default", os.environ.get("GEMINI_MODEL_DEFAULT", "gemini-2.5-flash")),
+    ("strong", os.environ.get("GEMINI_MODEL_STRONG", "gemini-2.5-pro")),
+]
+
+SHORT_DOC_PAGES = 10        # File ngắn: dùng model nhanh
+LONG_DOC_PAGES = 60         # File dài hơn mức này và là bản scan: dùng model mạnh
+TEXT_LAYER_RATIO = 0.9      # Tỉ lệ trang có chữ để coi là "có lớp chữ"
+SCANNED_RATIO = 0.5         # Dưới tỉ lệ này coi là bản scan
+PROFILE_SAMPLE_PAGES = 30   # Số trang lấy mẫu để đo lớp chữ
+MIN_TEXT_CHARS = 50         # Số ký tự tối thiểu để coi trang có chữ
+
+REQUIRED_KEYS = ["ten_file_goc", "ten_file_output", "trang_bat_dau", "trang_ket_thuc", "nam_van_ban"]
+
+
+class AnalysisValidationError(ValueError):
+    """Phản hồi AI không qua kiểm tra"""
+
+
+DocumentProfile = namedtuple("DocumentProfile", ["page_count", "sampled_pages", "text_pages"])
+
+
+def text_ratio(profile):
+    if not profile.sampled_pages:
+        return 0.0
+    return profile.text_pages / profile.sampled_pages
+
+
+# ===============================
+#  ĐO ĐỘ KHÓ CỦA FILE
+# ===============================
+def profile_pdf(file_path):
+    """Đếm số trang và tỉ lệ trang có lớp chữ. Trả về None nếu không đọc được"""
+    try:
+        import fitz
+    except ImportError:
+        return None
+
+    try:
+        doc = fitz.open(file_path)
+    except Exception:
+        return None
+
+    try:
+        page_count = doc.page_count
+        step = max(1, page_count // PROFILE_SAMPLE_PAGES)
+        sampled = range(0, page_count, step)
+        text_pages = sum(
+            1 for i in sampled if len(doc[i].get_text("text").strip()) >= MIN_TEXT_CHARS
+        )
+        return DocumentProfile(page_count, len(sampled), text_pages)
+    finally:
+        doc.close()
+
+
+def combine_profiles(profiles):
+    """Gộp nhiều file (gửi chung một request) thành một profile"""
+    profiles = [p for p in profiles if p is not None]
+    if not profiles:
+        return None
+    return DocumentProfile(
+        sum(p.page_count for p in profiles),
+        sum(p.sampled_pages for p in profiles),
+        sum(p.text_pages for p in profiles),
+    )
+
+
+# ===============================
+#  KIỂM TRA PHẢN HỒI
+# ===============================
+def parse_analysis(text):
+    """Tách JSON array từ phản hồi AI"""
+    text = (text or "").strip()
+    if "```json" in text:
+        text = text.split("```json")[1].split("```")[0]
+    elif "```" in text:
+        text = text.split("```")[1].split("```")[0]
+
+    try:
+        data = json.loads(text.strip())
+    except json.JSONDecodeError as e:
+        raise AnalysisValidationError(f"Lỗi phân tích JSON: {e}")
+
+    if not isinstance(data, list):
+        raise AnalysisValidationError("AI trả về dữ liệu không hợp lệ")
+    if len(data) == 0:
+        raise AnalysisValidationError("AI không tìm thấy văn bản nào")
+    return data
+
+
+def validate_analysis(data, page_counts=None):
+    """Kiểm tra trường bắt buộc và phạm vi trang
+
+    page_counts: {ten_file_goc: so_trang}. Với một file duy nhất,
+    mọi bản ghi được so với số trang của file đó.
+    """
+    single_count = None
+    if page_counts and len(page_counts) == 1:
+        single_count = next(iter(page_counts.values()))
+
+    for item in data:
+        if not isinstance(item, dict) or not all(key in item for key in REQUIRED_KEYS):
+            raise AnalysisValidationError(f"Dữ liệu thiếu trường: {item}")
+
+        start, end = item["trang_bat_dau"], item["trang_ket_thuc"]
+        if not (isinstance(start, int) and isinstance(end, int) and 1 <= start <= end):
+            raise AnalysisValidationError(f"Phạm vi trang không hợp lệ: {item}")
+
+        if page_counts:
+            page_count = page_counts.get(item["ten_file_goc"], single_count)
+            if page_count is None:
+                raise AnalysisValidationError(f"Không rõ file gốc: {item['ten_file_goc']}")
+            if end > page_count:
+                raise AnalysisValidationError(f"Trang vượt quá {page_count}: {item}")
+
+
+# ===============================
+#  THỐNG KÊ
+# ===============================
+class RouteStats:
+    """Theo tuyến (tier): số job bắt đầu ở tuyến đó và tỉ lệ nâng cấp,
+    cùng số lần gọi và thời gian của các lần gọi thực sự chạy trên tuyến đó"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def _route(self, route):
+        return self._routes.setdefault(route, {
+            "jobs": 0, "escalated_jobs": 0, "escalations": 0, "failed_jobs": 0,
+            "calls": 0, "failed_calls": 0, "total_latency": 0.0, "max_latency": 0.0,
+        })
+
+    def record_job(self, route, escalations, ok):
+        """Một job, tính cho tuyến ban đầu"""
+        with self._lock:
+            stats = self._route(route)
+            stats["jobs"] += 1
+            stats["escalations"] += escalations
+            stats["escalated_jobs"] += 1 if escalations else 0
+            stats["failed_jobs"] += 0 if ok else 1
+
+    def record_call(self, route, latency, ok):
+        """Một lần gọi model, tính cho tuyến được gọi"""
+        with self._lock:
+            stats = self._route(route)
+            stats["calls"] += 1
+            stats["failed_calls"] += 0 if ok else 1
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for route, stats in self._routes.items():
+                jobs, calls = stats["jobs"], stats["calls"]
+                result[route] = {
+                    "jobs": jobs,
+                    "escalation_rate": round(stats["escalated_jobs"] / jobs, 3) if jobs else 0.0,
+                    "escalations": stats["escalations"],
+                    "failed_jobs": stats["failed_jobs"],
+                    "calls": calls,
+                    "failed_calls": stats["failed_calls"],
+                    "avg_latency_s": round(stats["total_latency"] / calls, 3) if calls else 0.0,
+                    "max_latency_s": round(stats["max_latency"], 3),
+                }
+            return result
+
+
+# ===============================
+#  ROUTER
+# ===============================
+class ModelRouter:
+    def __init__(self, tiers=None, stats=None):
+        self.tiers = tiers or MODEL_TIERS
+        self.stats = stats or RouteStats()
+
+    def choose_tier(self, profile):
+        """Chỉ số tuyến ban đầu cho một file"""
+        if profile is None:
+            return 1
+        ratio = text_ratio(profile)
+        if profile.page_count <= SHORT_DOC_PAGES or ratio >= TEXT_LAYER_RATIO:
+            return 0
+        if profile.page_count > LONG_DOC_PAGES and ratio < SCANNED_RATIO:
+            return len(self.tiers) - 1
+        return 1
+
+    def _check(self, text, page_counts):
+        data = parse_analysis(text)
+        validate_analysis(data, page_counts)
+        return data
+
+    def _escalation(self, profile, page_counts, on_route):
+        """Logic chọn tuyến và nâng cấp, dùng chung cho analyze và analyze_async
+
+        Generator: yield model cần gọi, nhận lại text qua send() (hoặc lỗi gọi
+        API qua throw()). Kết thúc bằng return (data, model) hoặc ném
+        AnalysisValidationError khi model cuối vẫn không qua kiểm tra.
+        """
+        first = self.choose_tier(profile)
+        route = self.tiers[first][0]
+        last_error = None
+
+        for index in range(first, len(self.tiers)):
+            tier, model = self.tiers[index]
+            if on_route:
+                on_route(model)
+            started = time.monotonic()
+            try:
+                text = yield model
+            except Exception:
+                self.stats.record_call(tier, time.monotonic() - started, False)
+                self.stats.record_job(route, index - first, False)
+                raise
+            self.stats.record_call(tier, time.monotonic() - started, True)
+            try:
+                data = self._check(text, page_counts)
+            except AnalysisValidationError as e:
+                last_error = e
+                continue
+            self.stats.record_job(route, index - first, True)
+            return data, model
+
+        self.stats.record_job(route, len(self.tiers) - 1 - first, False)
+        raise last_error
+
+    def analyze(self, generate, profile=None, page_counts=None, on_route=None):
+        """Gọi generate(model) -> text, nâng model khi phản hồi không hợp lệ
+
+        Trả về (data, model). Lỗi gọi API (quota, mạng...) được ném ra nguyên vẹn
+        để nơi gọi tự xử lý; lỗi kiểm tra ở model cuối ném AnalysisValidationError.
+        """
+        steps = self._escalation(profile, page_counts, on_route)
+        model = next(steps)
+        while True:
+            try:
+                text = generate(model)
+            except Exception as e:
+                steps.throw(e)
+            try:
+                model = steps.send(text)
+            except StopIteration as done:
+                return done.value
+
+    async def analyze_async(self, agenerate, profile=None, page_counts=None, on_route=None):
+        """Giống analyze() nhưng agenerate(model) là coroutine"""
+        steps = self._escalation(profile, page_counts, on_route)
+        model = next(steps)
+        while True:
+            try:
+                text = await agenerate(model)
+            except Exception as e:
+                steps.throw(e)
+            try:
+                model = steps.send(text)
+            except StopIteration as done:
+                return done.value
+
+
+# Router dùng chung trong một process
+router = ModelRouter()
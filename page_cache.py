@@ -0,0 +1,542 @@
+"""
+Cache đặc trưng từng trang của file gốc (chữ, tiêu đề, loại trang, ảnh nhỏ)
+
+Nhiều bước cần cùng thông tin của từng trang: tìm ranh giới văn bản, kiểm
+tra, đặt tên, xem trước. Thay vì mỗi bước mở lại PDF và gọi fitz, cache được
+dựng một lần (song song trên nhiều process) và lưu thành một file nhị phân
+theo mã băm nội dung file gốc: PAGE_CACHE_DIR/<sha256>.pgc (mặc định trong
+thư mục cache của người dùng, ~/.cache/pdf_splitter/page_cache). File hỏng
+hoặc khác phiên bản định dạng được dựng lại; `prune` xoá file lâu không dùng.
+
+Định dạng (little-endian), mọi phần căn lề 8 byte:
+    header   magic "PGC1", version, số trang, offset của từng cột và từng blob
+    cột      mảng cố định theo trang: offset/độ dài chữ, tiêu đề, ảnh nhỏ,
+             số ký tự, tỉ lệ diện tích ảnh, kích thước trang, loại trang
+    blob     chữ (UTF-8), tiêu đề (UTF-8, mỗi dòng một tiêu đề), ảnh nhỏ (JPEG;
+             rỗng nếu dựng không kèm ảnh nhỏ, xem PAGE_CACHE_THUMBNAILS)
+
+Đọc bằng mmap: mở file chỉ đọc header, mỗi lần truy cập một trang chỉ chạm
+đúng vài byte cần thiết.
+
+    python page_cache.py build ho_so.pdf
+    python page_cache.py show ho_so.pdf --page 3
+    python page_cache.py thumb ho_so.pdf 3 trang_3.jpg
+    python page_cache.py prune --max-age-days 30 --max-mb 2048
+"""
+
+import os
+import sys
+import mmap
+import time
+import struct
+import argparse
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from doc_index import file_hash
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "pdf_splitter", "page_cache",
+)
+CACHE_SUFFIX = ".pgc"
+# prune: giới hạn mặc định của thư mục cache (0 = không giới hạn)
+PAGE_CACHE_MAX_MB = int(os.environ.get("PAGE_CACHE_MAX_MB", 2048))
+PAGE_CACHE_MAX_AGE_DAYS = int(os.environ.get("PAGE_CACHE_MAX_AGE_DAYS", 90))
+# Số process dựng cache tối đa cho mỗi file. batch dựng song song nhiều file,
+# nên mặc định thấp như IMAGE_WORKERS; máy riêng cho xử lý hàng loạt có thể tăng.
+PAGE_CACHE_WORKERS = max(1, int(os.environ.get("PAGE_CACHE_WORKERS", 2)))
+# Ảnh nhỏ tốn một lần render cả trang và không bước nào của pipeline đọc:
+# mặc định không lưu, `thumb` tự render từ PDF khi cache không có.
+PAGE_CACHE_THUMBNAILS = os.environ.get("PAGE_CACHE_THUMBNAILS", "").lower() in ("1", "true", "yes")
+
+MAGIC = b"PGC1"
+VERSION = 1
+
+THUMB_WIDTH = 160           # Chiều rộng ảnh nhỏ (px)
+THUMB_QUALITY = 60
+MIN_TEXT_CHARS = 50         # Ít hơn mức này coi như trang không có lớp chữ
+SCAN_IMAGE_RATIO = 0.5      # Ảnh phủ từ mức này trở lên coi là trang scan
+HEADING_SIZE_RATIO = 1.2    # Cỡ chữ lớn hơn trung vị bao nhiêu lần thì coi là tiêu đề
+MAX_HEADINGS = 8
+PAGES_PER_TASK = 16
+INLINE_PAGE_LIMIT = 24      # File ít trang thì dựng luôn, không mở process pool
+
+KINDS = ["text", "scan", "scan_ocr", "blank"]
+
+# Cột cố định theo trang: (tên, kiểu struct)
+COLUMNS = [
+    ("text_off", "Q"), ("text_len", "I"),
+    ("head_off", "Q"), ("head_len", "I"),
+    ("thumb_off", "Q"), ("thumb_len", "I"),
+    ("chars", "I"), ("image_ratio", "f"),
+    ("width", "f"), ("height", "f"),
+    ("kind", "B"),
+]
+BLOBS = ["text", "head", "thumb"]
+
+HEADER = struct.Struct("<4sII" + "Q" * len(COLUMNS) + "QQ" * len(BLOBS))
+
+
+def cache_path(source_hash, cache_dir=None):
+    return os.path.join(cache_dir or PAGE_CACHE_DIR, source_hash + CACHE_SUFFIX)
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+# ===============================
+#  TRÍCH ĐẶC TRƯNG (CHẠY TRONG PROCESS CON)
+# ===============================
+def heading_candidates(page):
+    """Các dòng trông như tiêu đề: in hoa, chữ lớn, hoặc in đậm ở nửa trên trang"""
+    lines = []
+    for block in page.get_text("dict")["blocks"]:
+        for line in block.get("lines", []):
+            spans = [s for s in line["spans"] if s["text"].strip()]
+            if not spans:
+                continue
+            text = " ".join(s["text"].strip() for s in spans)
+            size = max(s["size"] for s in spans)
+            bold = any(s["flags"] & 16 for s in spans)
+            lines.append((text, size, bold, line["bbox"][1]))
+    if not lines:
+        return []
+
+    sizes = sorted(size for _, size, _, _ in lines)
+    median = sizes[len(sizes) // 2]
+    half = page.rect.height / 2
+    headings = []
+    for text, size, bold, top in lines:
+        letters = [c for c in text if c.isalpha()]
+        upper = len(letters) >= 4 and sum(c.isupper() for c in letters) >= 0.8 * len(letters)
+        if upper or size >= median * HEADING_SIZE_RATIO or (bold and top < half):
+            headings.append(text[:200])
+            if len(headings) >= MAX_HEADINGS:
+                break
+    return headings
+
+
+def classify(chars, image_ratio):
+    if chars < MIN_TEXT_CHARS:
+        if image_ratio >= SCAN_IMAGE_RATIO:
+            return "scan"
+        return "blank" if image_ratio < 0.05 and chars == 0 else "text"
+    return "scan_ocr" if image_ratio >= SCAN_IMAGE_RATIO else "text"
+
+
+def render_thumbnail(page):
+    """Ảnh nhỏ JPEG (xám) của trang"""
+    import fitz
+
+    rect = page.rect
+    scale = THUMB_WIDTH / rect.width if rect.width else 1.0
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY)
+    return pix.tobytes("jpeg", jpg_quality=THUMB_QUALITY)
+
+
+def page_features(page, thumbnails=False):
+    import fitz
+
+    rect = page.rect
+    area = rect.width * rect.height or 1.0
+    text = page.get_text("text")
+    chars = len(text.strip())
+
+    covered = 0.0
+    for info in page.get_image_info():
+        box = fitz.Rect(info["bbox"]) & rect
+        if not box.is_empty:
+            covered += box.width * box.height
+    image_ratio = min(1.0, covered / area)
+
+    return {
+        "text": text,
+        "headings": heading_candidates(page),
+        "thumb": render_thumbnail(page) if thumbnails else b"",
+        "chars": chars,
+        "image_ratio": image_ratio,
+        "width": rect.width,
+        "height": rect.height,
+        "kind": classify(chars, image_ratio),
+    }
+
+
+def extract_pages(file_path, pages, thumbnails=False):
+    """Đặc trưng của các trang (đánh số từ 0): [(trang, features)]"""
+    import fitz
+
+    doc = fitz.open(file_path)
+    try:
+        return [(i, page_features(doc[i], thumbnails)) for i in pages]
+    finally:
+        doc.close()
+
+
+# ===============================
+#  DỰNG CACHE
+# ===============================
+def _extract_all(file_path, page_count, workers=None, lock=None, thumbnails=False):
+    pages = list(range(page_count))
+    workers = min(workers or os.cpu_count() or 1, PAGE_CACHE_WORKERS)
+    if page_count <= INLINE_PAGE_LIMIT or workers == 1:
+        # Chạy fitz ngay trong process này: cần lock nếu có luồng khác cũng dùng fitz
+        with lock or contextlib.nullcontext():
+            return dict(extract_pages(file_path, pages, thumbnails))
+
+    chunks = [pages[i:i + PAGES_PER_TASK] for i in range(0, page_count, PAGES_PER_TASK)]
+    # spawn: an toàn khi process cha có nhiều luồng (gunicorn, Tk, executor)
+    context = multiprocessing.get_context("spawn")
+    features = {}
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as pool:
+        for result in pool.map(extract_pages, [file_path] * len(chunks), chunks, [thumbnails] * len(chunks)):
+            features.update(result)
+    return features
+
+
+def write_cache(path, features):
+    """Ghi danh sách đặc trưng (theo thứ tự trang) ra file .pgc, thay thế nguyên tử"""
+    n = len(features)
+    blobs = {name: bytearray() for name in BLOBS}
+    columns = {name: [] for name, _ in COLUMNS}
+
+    def put(name, data):
+        columns[name + "_off"].append(len(blobs[name]))
+        columns[name + "_len"].append(len(data))
+        blobs[name] += data
+
+    for page in features:
+        put("text", page["text"].encode("utf-8"))
+        put("head", "\n".join(page["headings"]).encode("utf-8"))
+        put("thumb", page["thumb"])
+        columns["chars"].append(page["chars"])
+        columns["image_ratio"].append(page["image_ratio"])
+        columns["width"].append(page["width"])
+        columns["height"].append(page["height"])
+        columns["kind"].append(KINDS.index(page["kind"]))
+
+    sections = []
+    offset = _align(HEADER.size)
+    column_offsets = []
+    for name, fmt in COLUMNS:
+        data = struct.pack(f"<{n}{fmt}", *columns[name])
+        column_offsets.append(offset)
+        sections.append((offset, data))
+        offset = _align(offset + len(data))
+    blob_fields = []
+    for name in BLOBS:
+        data = bytes(blobs[name])
+        blob_fields += [offset, len(data)]
+        sections.append((offset, data))
+        offset = _align(offset + len(data))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # Mỗi luồng một file tạm: batch có thể dựng cùng một cache từ hai luồng
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n, *column_offsets, *blob_fields))
+        for section_offset, data in sections:
+            f.seek(section_offset)
+            f.write(data)
+        f.truncate(offset)
+    os.replace(tmp_path, path)
+    return path
+
+
+def is_valid(path, thumbnails=False):
+    """File cache đọc được: đúng magic / phiên bản, không bị cắt cụt (và có ảnh nhỏ nếu cần)"""
+    try:
+        with PageCache(path) as cache:
+            return cache.has_thumbnails or not thumbnails
+    except (OSError, ValueError):
+        return False
+
+
+def build(file_path, source_hash=None, cache_dir=None, workers=None, lock=None, thumbnails=None):
+    """Dựng cache cho file gốc (bỏ qua nếu đã có và còn hợp lệ). Trả về đường dẫn file cache
+
+    lock (vd. pdf_core.FITZ_LOCK) chỉ được giữ khi fitz chạy trong process này;
+    phần dựng song song trong process con không cần lock.
+    thumbnails: lưu cả ảnh nhỏ (mặc định PAGE_CACHE_THUMBNAILS).
+    """
+    import fitz
+
+    thumbnails = PAGE_CACHE_THUMBNAILS if thumbnails is None else thumbnails
+    source_hash = source_hash or file_hash(file_path)
+    path = cache_path(source_hash, cache_dir)
+    if os.path.exists(path):
+        if is_valid(path, thumbnails):
+            return path
+        if is_valid(path):
+            print(f"Cache trang chưa có ảnh nhỏ, dựng lại ({path})")
+        else:
+            print(f"Warning: cache trang hỏng hoặc khác phiên bản, dựng lại ({path})")
+
+    with lock or contextlib.nullcontext():
+        doc = fitz.open(file_path)
+        page_count = doc.page_count
+        doc.close()
+
+    features = _extract_all(file_path, page_count, workers, lock, thumbnails)
+    return write_cache(path, [features[i] for i in range(page_count)])
+
+
+# ===============================
+#  ĐỌC CACHE
+# ===============================
+class PageCache:
+    """Đọc file .pgc qua mmap; mọi truy cập theo trang là O(1)"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            try:
+                fields = HEADER.unpack_from(self._mm, 0)
+            except struct.error:
+                raise ValueError(f"File cache không hợp lệ: {path}") from None
+            magic, version, self.page_count = fields[:3]
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"File cache không hợp lệ: {path}")
+
+            self._view = memoryview(self._mm)
+            self._views = []
+            self._columns = {}
+            for (name, fmt), offset in zip(COLUMNS, fields[3:3 + len(COLUMNS)]):
+                size = struct.calcsize(fmt) * self.page_count
+                self._columns[name] = self._slice(offset, size, fmt)
+            self._blobs = {}
+            blob_fields = fields[3 + len(COLUMNS):]
+            for i, name in enumerate(BLOBS):
+                self._blobs[name] = self._slice(blob_fields[2 * i], blob_fields[2 * i + 1])
+        except Exception:
+            self.close()
+            raise
+
+    def _slice(self, offset, size, fmt=None):
+        if offset + size > len(self._mm):
+            raise ValueError(f"File cache bị cắt cụt: {self.path}")
+        view = self._view[offset:offset + size]
+        if fmt:
+            view = view.cast(fmt)
+        self._views.append(view)
+        return view
+
+    def _blob(self, name, index):
+        offset = self._columns[name + "_off"][index]
+        length = self._columns[name + "_len"][index]
+        return self._blobs[name][offset:offset + length]
+
+    def __len__(self):
+        return self.page_count
+
+    def text(self, index):
+        """Chữ của trang (đánh số từ 0)"""
+        return str(self._blob("text", index), "utf-8")
+
+    def headings(self, index):
+        data = str(self._blob("head", index), "utf-8")
+        return data.split("\n") if data else []
+
+    @property
+    def has_thumbnails(self):
+        return len(self._blobs["thumb"]) > 0
+
+    def thumbnail(self, index):
+        """Ảnh nhỏ JPEG (xám) của trang; b"" nếu cache dựng không kèm ảnh nhỏ"""
+        return bytes(self._blob("thumb", index))
+
+    def kind(self, index):
+        return KINDS[self._columns["kind"][index]]
+
+    def text_chars(self, index):
+        return self._columns["chars"][index]
+
+    def image_ratio(self, index):
+        return self._columns["image_ratio"][index]
+
+    def size(self, index):
+        return self._columns["width"][index], self._columns["height"][index]
+
+    def page(self, index):
+        """Mọi đặc trưng của một trang (trừ ảnh nhỏ), dạng dict"""
+        return {
+            "trang": index + 1,
+            "kind": self.kind(index),
+            "chars": self.text_chars(index),
+            "image_ratio": round(self.image_ratio(index), 3),
+            "size": self.size(index),
+            "headings": self.headings(index),
+            "text": self.text(index),
+        }
+
+    def close(self):
+        for view in getattr(self, "_views", []):
+            view.release()
+        self._views = []
+        if getattr(self, "_view", None) is not None:
+            self._view.release()
+            self._view = None
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_cache(file_path=None, source_hash=None, cache_dir=None, build_missing=True, lock=None):
+    """PageCache của file gốc; None nếu không có / lỗi
+
+    build_missing: dựng nếu chưa có, hoặc dựng lại nếu file cache hỏng / khác phiên bản.
+    """
+    source_hash = source_hash or file_hash(file_path)
+    path = cache_path(source_hash, cache_dir)
+    try:
+        if build_missing and file_path is not None:
+            build(file_path, source_hash, cache_dir, lock=lock)
+        elif not os.path.exists(path):
+            return None
+        cache = PageCache(path)
+        # mtime = lần dùng gần nhất, để prune xoá file lâu không dùng trước
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return cache
+    except Exception as e:
+        print(f"Warning: không dùng được cache trang ({e})")
+        return None
+
+
+def prune(cache_dir=None, max_age_days=None, max_mb=None):
+    """Xoá file cache không dùng quá max_age_days ngày, rồi file cũ nhất cho đến khi
+    tổng dung lượng không quá max_mb. Mặc định theo PAGE_CACHE_MAX_AGE_DAYS /
+    PAGE_CACHE_MAX_MB; 0 = không giới hạn. Trả về (số file đã xoá, số byte còn lại)
+    """
+    cache_dir = cache_dir or PAGE_CACHE_DIR
+    max_age_days = PAGE_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    max_mb = PAGE_CACHE_MAX_MB if max_mb is None else max_mb
+    now = time.time()
+
+    entries = []
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return 0, 0
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        # File .tmp bỏ dở (process bị giết khi đang ghi) sau một giờ
+        if name.endswith(".tmp") and now - stat.st_mtime > 3600:
+            entries.append((0, stat.st_size, path))
+        elif name.endswith(CACHE_SUFFIX):
+            entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    removed = 0
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in entries:
+        too_old = max_age_days and now - mtime > max_age_days * 86400
+        too_big = max_mb and total > max_mb * 1024 * 1024
+        if not (too_old or too_big or mtime == 0):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        removed += 1
+        total -= size
+    return removed, total
+
+
+def document_profile(cache):
+    """DocumentProfile cho model_router, lấy từ cache thay vì mở lại PDF"""
+    from model_router import DocumentProfile, MIN_TEXT_CHARS as ROUTER_MIN_CHARS
+
+    text_pages = sum(1 for i in range(cache.page_count) if cache.text_chars(i) >= ROUTER_MIN_CHARS)
+    return DocumentProfile(cache.page_count, cache.page_count, text_pages)
+
+
+# ===============================
+#  DÒNG LỆNH
+# ===============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache đặc trưng từng trang của file PDF")
+    parser.add_argument("--dir", help=f"Thư mục cache (mặc định: PAGE_CACHE_DIR hoặc {PAGE_CACHE_DIR})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="Dựng cache cho các file PDF")
+    p_build.add_argument("files", nargs="+")
+    p_build.add_argument("--workers", type=int,
+                         help=f"Số process (mặc định: số CPU, tối đa PAGE_CACHE_WORKERS={PAGE_CACHE_WORKERS})")
+    p_build.add_argument("--thumbnails", action="store_true", default=None,
+                         help="Lưu cả ảnh nhỏ từng trang (mặc định: PAGE_CACHE_THUMBNAILS)")
+
+    p_show = sub.add_parser("show", help="Xem đặc trưng các trang")
+    p_show.add_argument("file")
+    p_show.add_argument("--page", type=int, help="Chỉ một trang (đánh số từ 1)")
+
+    p_thumb = sub.add_parser("thumb", help="Xuất ảnh nhỏ của một trang")
+    p_thumb.add_argument("file")
+    p_thumb.add_argument("page", type=int)
+    p_thumb.add_argument("output")
+
+    p_prune = sub.add_parser("prune", help="Xoá file cache lâu không dùng")
+    p_prune.add_argument("--max-age-days", type=int,
+                         help=f"Mặc định: PAGE_CACHE_MAX_AGE_DAYS hoặc {PAGE_CACHE_MAX_AGE_DAYS} (0 = không giới hạn)")
+    p_prune.add_argument("--max-mb", type=int,
+                         help=f"Mặc định: PAGE_CACHE_MAX_MB hoặc {PAGE_CACHE_MAX_MB} (0 = không giới hạn)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "prune":
+        removed, remaining = prune(args.dir, args.max_age_days, args.max_mb)
+        print(f"🧹 Đã xoá {removed} file, còn {remaining / 1024 / 1024:.1f} MB")
+        return 0
+
+    if args.command == "build":
+        for file_path in args.files:
+            path = build(file_path, cache_dir=args.dir, workers=args.workers, thumbnails=args.thumbnails)
+            print(f"✅ {file_path} -> {path}")
+        return 0
+
+    cache = open_cache(args.file, cache_dir=args.dir)
+    if cache is None:
+        return 1
+    with cache:
+        if args.command == "show":
+            pages = [args.page - 1] if args.page else range(cache.page_count)
+            for i in pages:
+                info = cache.page(i)
+                print(f"Trang {info['trang']}: {info['kind']}, {info['chars']} ký tự, "
+                      f"ảnh {info['image_ratio']:.0%}")
+                for heading in info["headings"]:
+                    print(f"    # {heading}")
+        elif args.command == "thumb":
+            data = cache.thumbnail(args.page - 1)
+            if not data:
+                # Cache không kèm ảnh nhỏ: render riêng trang này từ PDF
+                import fitz
+
+                with fitz.open(args.file) as doc:
+                    data = render_thumbnail(doc[args.page - 1])
+            with open(args.output, "wb") as f:
+                f.write(data)
+            print(f"✅ {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""
+Phần lõi dùng chung: phân tích PDF bằng AI và tách file
+
+Không phụ thuộc giao diện (Tk, Flask, Quart). pdf_splitter.py, pdfv3.py và
+webapp.py (cùng webapp_async.py, batch.py, spool.py) đều dùng module này.
+
+PyMuPDF và google-genai chỉ được import ở lần dùng đầu tiên, nên import
+module này (và khởi động worker gunicorn / CLI) không phải chờ chúng.
+importbench.py kiểm tra thời gian import không vượt ngân sách.
+"""
+
+import os
+import shutil
+import threading
+import subprocess
+import importlib.util
+
+from model_router import router, profile_pdf, AnalysisValidationError
+from text_sidecar import open_sidecar
+from image_recompress import apply_profile, size_report, save_options
+from incremental import reused_analysis, tail_pdf_bytes, tail_prompt, merge
+from page_cache import document_profile
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+# Trỏ client Gemini sang chỗ khác (ví dụ server giả của loadtest.py)
+GEMINI_BASE_URL = os.environ.get('GEMINI_BASE_URL', '')
+MAX_INLINE_PDF_BYTES = 20 * 1024 * 1024
+
+# PyMuPDF không an toàn khi dùng đồng thời từ nhiều luồng:
+# nơi gọi chạy nhiều luồng thì bọc phần fitz bằng khóa này.
+FITZ_LOCK = threading.Lock()
+
+AI_PROMPT = """
+Phân tích file PDF này chứa nhiều văn bản tố tụng hình sự.
+
+Xác định CHÍNH XÁC:
+- Ranh giới từng văn bản (trang bắt đầu, trang kết thúc)
+- Loại văn bản (Quyết định, Lệnh, Cáo trạng, Bản án...)
+- Số hiệu và năm văn bản
+
+Tên file: {filename}
+
+Trả về JSON array:
+[
+  {{"ten_file_goc": "{filename}", "ten_file_output": "Loai_So.pdf", "trang_bat_dau": 1, "trang_ket_thuc": 2, "nam_van_ban": 2024}}
+]
+
+CHỈ TRẢ VỀ JSON, KHÔNG GIẢI THÍCH.
+"""
+
+
+def module_available(name):
+    """Có cài module không, mà không import nó"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+FITZ_AVAILABLE = module_available("fitz")
+GOOGLE_AI_AVAILABLE = module_available("google.genai")
+# MuPDF mới không còn ghi được PDF linearized: dùng pikepdf hoặc lệnh qpdf nếu có
+LINEARIZE_TOOL = "pikepdf" if module_available("pikepdf") else ("qpdf" if shutil.which("qpdf") else None)
+
+
+# ===============================
+#  ĐIỀU KHIỂN CÔNG VIỆC
+# ===============================
+class JobCancelled(Exception):
+    """Công việc bị người dùng hủy"""
+
+
+class JobControl:
+    """Điều khiển tạm dừng / hủy cho các luồng xử lý"""
+
+    def __init__(self):
+        self._cancel = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        self._running.set()  # Đánh thức các luồng đang tạm dừng
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def checkpoint(self):
+        """Chờ nếu đang tạm dừng, báo JobCancelled nếu đã hủy"""
+        self._running.wait()
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    def sleep(self, seconds):
+        """Chờ có thể ngắt bằng cancel()"""
+        if self._cancel.wait(seconds):
+            raise JobCancelled()
+        self.checkpoint()
+
+
+# ===============================
+#  PHÂN TÍCH VỚI AI
+# ===============================
+def make_genai_client(api_key, timeout=None):
+    """Client google-genai; timeout tính bằng giây"""
+    from google import genai
+
+    http_options = {}
+    if GEMINI_BASE_URL:
+        http_options['base_url'] = GEMINI_BASE_URL
+    if timeout:
+        http_options['timeout'] = int(timeout * 1000)
+    if http_options:
+        return genai.Client(api_key=api_key, http_options=http_options)
+    return genai.Client(api_key=api_key)
+
+
+def pdf_part(pdf_bytes):
+    from google import genai
+
+    return genai.types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")
+
+
+def is_quota_error(e):
+    error_msg = str(e)
+    return "429" in error_msg or "quota" in error_msg.lower() or "RESOURCE_EXHAUSTED" in error_msg
+
+
+def format_ai_error(e):
+    """Thông báo lỗi thân thiện cho lỗi gọi AI"""
+    if is_quota_error(e):
+        return "Quota API đã hết. Đợi 1 phút hoặc tạo key mới."
+    return f"Lỗi: {e}"
+
+
+def page_counts_for(filename, profile):
+    """Số trang dùng để kiểm tra phản hồi AI (None nếu không đọc được file)"""
+    return {filename: profile.page_count} if profile else None
+
+
+def analyze_contents(client, contents, profile=None, page_counts=None, on_route=None, after_call=None):
+    """Gửi contents cho AI, model do model_router chọn. Trả về dữ liệu đã kiểm tra.
+
+    Lỗi gọi API và AnalysisValidationError được ném ra để nơi gọi tự quyết
+    (thử lại khi hết quota, báo lỗi...). after_call() chạy sau mỗi lần gọi,
+    ví dụ control.checkpoint để hủy giữa chừng.
+    """
+    def generate(model):
+        response = client.models.generate_content(model=model, contents=contents)
+        if after_call:
+            after_call()
+        return response.text
+
+    data, _ = router.analyze(generate, profile, page_counts, on_route=on_route)
+    return data
+
+
+def analysis_request(filename, file_path, prompt=AI_PROMPT, plan=None, pdf_bytes=None, page_cache=None):
+    """Chuẩn bị yêu cầu phân tích: (contents, profile, page_counts, finish)
+
+    Không có plan: gửi cả file với prompt. Có plan (incremental.ReusePlan):
+    chỉ gửi phần cuối từ văn bản cuối đã biết; finish(data) ghép kết quả với
+    phần dùng lại và trả về analysis_data của cả file.
+    page_cache (page_cache.PageCache) cho profile mà không phải mở lại PDF.
+    """
+    profile = document_profile(page_cache) if page_cache is not None else profile_pdf(file_path)
+    if plan is None:
+        if pdf_bytes is None:
+            with open(file_path, 'rb') as f:
+                pdf_bytes = f.read()
+        contents = [prompt.format(filename=filename), pdf_part(pdf_bytes)]
+        return contents, profile, page_counts_for(filename, profile), lambda data: data
+
+    tail_pages = plan.page_count - plan.tail_start + 1
+    if profile:
+        profile = profile._replace(page_count=tail_pages)
+    contents = [tail_prompt(plan, filename), pdf_part(tail_pdf_bytes(file_path, plan.tail_start))]
+    return contents, profile, {filename: tail_pages}, lambda data: merge(plan, data, filename)
+
+
+def analyze_pdf(api_key, filename, file_path, prompt=AI_PROMPT, plan=None, page_cache=None):
+    """Phân tích một file PDF. Trả về (error, data)
+
+    plan (incremental.prepare) cho phép dùng lại kết quả của bản trước của bộ hồ sơ.
+    """
+    if plan is not None and plan.tail_start is None:
+        return None, reused_analysis(plan, filename)
+    if not GOOGLE_AI_AVAILABLE:
+        return "Google AI chưa được cài đặt", None
+
+    try:
+        client = make_genai_client(api_key)
+        with FITZ_LOCK:
+            contents, profile, page_counts, finish = analysis_request(filename, file_path, prompt, plan, page_cache=page_cache)
+        return None, finish(analyze_contents(client, contents, profile, page_counts))
+
+    except AnalysisValidationError as e:
+        return str(e), None
+    except Exception as e:
+        return format_ai_error(e), None
+
+
+# ===============================
+#  TÁCH FILE
+# ===============================
+def output_filename(item):
+    """Tên file output: <ten_file_output>_<năm>.pdf, bỏ ký tự không hợp lệ"""
+    name = item.get("ten_file_output", "output.pdf").replace(".pdf", "")
+    year = item.get("nam_van_ban")
+    filename = f"{name}_{year}.pdf" if year else f"{name}.pdf"
+    return "".join(c for c in filename if c.isalnum() or c in "._- ")
+
+
+def linearize_pdf(path):
+    """Ghi lại file PDF dạng linearized ("fast web view") tại chỗ. False nếu không có công cụ
+
+    Trình xem PDF của trình duyệt hiện được trang đầu khi mới tải vài KB đầu file.
+    """
+    if LINEARIZE_TOOL is None:
+        return False
+    tmp_path = f"{path}.linear"
+    try:
+        if LINEARIZE_TOOL == "pikepdf":
+            import pikepdf
+
+            with pikepdf.open(path) as pdf:
+                pdf.save(tmp_path, linearize=True)
+        else:
+            # qpdf: mã 3 là thành công kèm cảnh báo
+            proc = subprocess.run(["qpdf", "--linearize", path, tmp_path], capture_output=True, text=True)
+            if proc.returncode not in (0, 3):
+                raise RuntimeError(proc.stderr.strip() or f"qpdf exit {proc.returncode}")
+        os.replace(tmp_path, path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def split_pdf(file_path, analysis_data, output_dir, text_sidecar=False, image_profile=None,
+              progress_callback=None, checkpoint=None, page_cache=None, linearize=False):
+    """Tách file PDF theo dữ liệu phân tích. Trả về (số file tách được, danh sách kết quả)
+
+    text_sidecar=True ghi thêm van_ban.jsonl (thông tin + chữ từng trang) vào output_dir;
+    có page_cache thì chữ lấy từ cache thay vì trích lại từ PDF.
+    image_profile (gray / bilevel / color) nén lại ảnh trang scan trước khi tách, giữ lớp chữ.
+    linearize=True ghi file output dạng linearized để xem nhanh trên web (cần pikepdf hoặc qpdf).
+    progress_callback(i, total, item) được gọi trước mỗi văn bản; checkpoint() để tạm dừng / hủy.
+    """
+    if not FITZ_AVAILABLE:
+        return 0, ["PyMuPDF chưa được cài đặt"]
+    import fitz
+
+    results = []
+    success = 0
+    os.makedirs(output_dir, exist_ok=True)
+    if linearize and LINEARIZE_TOOL is None:
+        results.append("⚠️ Không tối ưu được cho xem trên web: cần cài pikepdf hoặc qpdf")
+        linearize = False
+
+    try:
+        doc = fitz.open(file_path)
+    except Exception as e:
+        results.append(f"❌ Lỗi: {e}")
+        return success, results
+
+    # Hủy giữa chừng hay lỗi cũng phải đóng file gốc và van_ban.jsonl
+    # (trên Windows file đang mở thì không xóa / chạy lại được)
+    try:
+        page_count = doc.page_count
+        with open_sidecar(doc, output_dir, text_sidecar, page_cache) as sidecar:
+            replaced_images = apply_profile(doc, file_path, analysis_data, image_profile)
+            report_at = len(results)
+            output_paths = []
+
+            for i, item in enumerate(analysis_data):
+                if checkpoint:
+                    checkpoint()
+                if progress_callback:
+                    progress_callback(i, len(analysis_data), item)
+
+                start = item.get("trang_bat_dau", 0)
+                end = item.get("trang_ket_thuc", 0)
+                if not (isinstance(start, int) and isinstance(end, int) and 1 <= start <= end <= page_count):
+                    results.append(f"❌ {item.get('ten_file_output', '?')}: Trang không hợp lệ ({start}-{end})")
+                    continue
+
+                name = output_filename(item)
+                new_doc = fitz.open()
+                try:
+                    new_doc.insert_pdf(doc, from_page=start - 1, to_page=end - 1)
+                    output_path = os.path.join(output_dir, name)
+                    new_doc.save(output_path, **save_options(image_profile))
+                finally:
+                    new_doc.close()
+                output_paths.append(output_path)
+                if linearize:
+                    try:
+                        linearize_pdf(output_path)
+                    except Exception as e:
+                        # File vẫn dùng được, chỉ không xem nhanh được trên web
+                        results.append(f"⚠️ {name}: không linearize được ({e})")
+                sidecar.add(item, name)
+
+                success += 1
+                results.append(f"✅ {name} (Trang {start}-{end})")
+
+            if replaced_images is not None:
+                results.insert(report_at, size_report(image_profile, replaced_images, file_path, output_paths))
+    except JobCancelled:
+        raise
+    except Exception as e:
+        results.append(f"❌ Lỗi: {e}")
+    finally:
+        doc.close()
+
+    return success, results
@@ -3,31 +3,37 @@ PDF Splitter với Google Gemini AI
 Phiên bản Desktop - Chỉ cần chạy file này
 """
 
-import fitz
 import os
 import sys
 import json
 import datetime
-import base64
 import platform
 import tkinter as tk
-from tkinter import filedialog, messagebox, Listbox, Scrollbar, ttk, Text, simpledialog
-import threading
+from tkinter import filedialog, messagebox, Scrollbar, ttk, Text
+import multiprocessing
+import queue
 import subprocess
 import webbrowser
-
-# Google GenAI
-try:
-    from google import genai
-    GOOGLE_AI_AVAILABLE = True
-except ImportError:
-    GOOGLE_AI_AVAILABLE = False
+from concurrent.futures import ThreadPoolExecutor
+
+from model_router import AnalysisValidationError
+from doc_index import file_hash, lookup_safely, record_safely
+from incremental import prepare as prepare_reuse, reused_analysis
+from image_recompress import PROFILE_LABELS
+from profiling import maybe_profile, PROFILES_DIR
+# Phân tích / tách dùng chung với webapp; fitz và genai chỉ nạp khi dùng đến
+from pdf_core import (
+    GOOGLE_AI_AVAILABLE, MAX_INLINE_PDF_BYTES, FITZ_LOCK, JobCancelled, JobControl,
+    make_genai_client, analysis_request, is_quota_error, analyze_contents,
+    split_pdf as split_to_dir,
+)
 
 # ===============================
 #  CẤU HÌNH
 # ===============================
 API_KEY_FILE = "google_api_key.txt"
-GEMINI_MODEL = "gemini-2.5-flash"
+MAX_WORKERS = 3          # Số file xử lý song song
+QUOTA_RETRY_DELAY = 30   # Giây chờ khi hết quota
 
 AI_PROMPT = """
 Phân tích KỸ LƯỠNG file PDF này. File chứa nhiều văn bản tố tụng hình sự.
@@ -52,78 +58,60 @@ Chỉ trả về JSON array, không giải thích.
 """
 
 
-def analyze_pdf_with_gemini(api_key, filename, file_path, progress_callback):
-    """Phân tích PDF với Google Gemini"""
+def analyze_pdf_with_gemini(api_key, filename, file_path, progress_callback, control=None, plan=None):
+    """Phân tích PDF với Google Gemini
+
+    progress_callback(message, percent) nhận tiến độ 0-100 (hoặc None).
+    Nếu có control, công việc có thể tạm dừng / hủy giữa các bước.
+    plan (incremental.prepare): bộ hồ sơ là bản trước thêm trang ở cuối, chỉ gửi phần mới.
+    """
+    control = control or JobControl()
+    if plan is not None and plan.tail_start is None:
+        return None, reused_analysis(plan, filename)
+
     try:
-        client = genai.Client(api_key=api_key)
+        client = make_genai_client(api_key)
     except Exception as e:
         return f"Lỗi cấu hình API: {e}", None
 
-    progress_callback("Đang đọc file PDF...")
+    progress_callback("Đang đọc file PDF...", 5)
     
     try:
-        with open(file_path, 'rb') as f:
-            pdf_bytes = f.read()
-        
-        file_size = len(pdf_bytes)
-        if file_size > 20 * 1024 * 1024:
+        if plan is None and os.path.getsize(file_path) > MAX_INLINE_PDF_BYTES:
             return "File vượt quá 20MB", None
-            
-        pdf_part = genai.types.Part.from_bytes(
-            data=pdf_bytes,
-            mime_type="application/pdf"
-        )
+        with FITZ_LOCK:
+            contents, profile, page_counts, finish = analysis_request(filename, file_path, AI_PROMPT, plan)
     except Exception as e:
         return f"Lỗi đọc file: {e}", None
 
-    progress_callback("Đang gửi yêu cầu phân tích đến AI...")
-    
-    prompt = AI_PROMPT.format(filename=filename)
-    contents = [prompt, pdf_part]
+    control.checkpoint()
+    if plan is not None:
+        progress_callback(f"Dùng lại {len(plan.kept)} văn bản, chỉ gửi từ trang {plan.tail_start} đến AI...", 10)
+    else:
+        progress_callback("Đang gửi yêu cầu phân tích đến AI...", 10)
 
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            progress_callback(f"Đang phân tích... (lần {attempt + 1})")
-            
-            response = client.models.generate_content(
-                model=GEMINI_MODEL,
-                contents=contents
+            control.checkpoint()
+            progress_callback(f"Đang phân tích... (lần {attempt + 1})", 15 + attempt * 10)
+
+            analysis_data = analyze_contents(
+                client, contents, profile, page_counts,
+                on_route=lambda model: progress_callback(f"Đang phân tích với {model}...", None),
+                after_call=control.checkpoint,
             )
-            
-            json_string = response.text.strip()
-            if "```json" in json_string:
-                json_string = json_string.split("```json")[1].split("```")[0]
-            elif "```" in json_string:
-                json_string = json_string.split("```")[1].split("```")[0]
-            json_string = json_string.strip()
-            
-            analysis_data = json.loads(json_string)
-
-            if not isinstance(analysis_data, list):
-                return "AI trả về dữ liệu không hợp lệ", None
-
-            if len(analysis_data) == 0:
-                return "AI không tìm thấy văn bản nào. Vui lòng thử lại.", None
-
-            for item in analysis_data:
-                required_keys = ["ten_file_goc", "ten_file_output", "trang_bat_dau", "trang_ket_thuc", "nam_van_ban"]
-                if not all(key in item for key in required_keys):
-                    return f"Dữ liệu thiếu trường: {item}", None
-
-            return None, analysis_data
-
-        except json.JSONDecodeError as e:
-            if attempt < max_retries - 1:
-                continue
-            return f"Lỗi parse JSON: {e}", None
+            return None, finish(analysis_data)
+
+        except JobCancelled:
+            raise
+        except AnalysisValidationError as e:
+            return str(e), None
         except Exception as e:
-            error_str = str(e)
-            if "429" in error_str or "quota" in error_str.lower() or "RESOURCE_EXHAUSTED" in error_str:
+            if is_quota_error(e):
                 if attempt < max_retries - 1:
-                    progress_callback(f"Quota tạm hết, đợi 30 giây...")
-                    import time
-                    time.sleep(30)
+                    progress_callback(f"Quota tạm hết, đợi {QUOTA_RETRY_DELAY} giây...", None)
+                    control.sleep(QUOTA_RETRY_DELAY)
                     continue
                 return "Quota API đã hết. Vui lòng đợi 1 phút hoặc tạo API key mới.", None
             return f"Lỗi: {e}", None
@@ -131,80 +119,98 @@ def analyze_pdf_with_gemini(api_key, filename, file_path, progress_callback):
     return "Không thể phân tích sau nhiều lần thử", None
 
 
-def split_pdf(file_path, analysis_data, progress_callback):
-    """Tách file PDF theo dữ liệu phân tích"""
+def split_pdf(file_path, analysis_data, progress_callback, control=None, text_sidecar=False,
+              image_profile=None):
+    """Tách file PDF theo dữ liệu phân tích vào thư mục ket_qua_<tên>_<thời gian>
+
+    text_sidecar=True ghi thêm van_ban.jsonl (thông tin + chữ từng trang) ngay trong lượt tách.
+    image_profile (gray / bilevel / color) nén lại ảnh trang scan trước khi tách, giữ lớp chữ.
+    """
+    control = control or JobControl()
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     base_name = os.path.splitext(os.path.basename(file_path))[0]
     output_dir = os.path.join(os.path.dirname(file_path), f"ket_qua_{base_name}_{timestamp}")
-    os.makedirs(output_dir, exist_ok=True)
 
-    total_success = 0
-    results = []
+    def progress(i, total, rule):
+        progress_callback(f"Đang tách văn bản {i+1}/{total}...", 60 + 40 * i // total)
+
+    if image_profile:
+        progress_callback("Đang nén ảnh trang scan...", 60)
+    total_success, results = split_to_dir(
+        file_path, analysis_data, output_dir, text_sidecar, image_profile,
+        progress_callback=progress, checkpoint=control.checkpoint,
+    )
 
+    # Lưu analysis data
     try:
-        doc = fitz.open(file_path)
-        page_count = doc.page_count
-
-        for i, rule in enumerate(analysis_data):
-            progress_callback(f"Đang tách văn bản {i+1}/{len(analysis_data)}...")
-            
-            start_page = rule["trang_bat_dau"]
-            end_page = rule["trang_ket_thuc"]
-
-            if not (1 <= start_page <= end_page <= page_count):
-                results.append(f"❌ {rule['ten_file_output']}: Trang không hợp lệ ({start_page}-{end_page})")
-                continue
-
-            base_name = rule["ten_file_output"].replace(".pdf", "")
-            year = rule.get("nam_van_ban")
-            output_filename = f"{base_name}_{year}.pdf" if year else f"{base_name}.pdf"
-            
-            # Làm sạch tên file
-            output_filename = "".join(c for c in output_filename if c.isalnum() or c in "._- ")
-
-            output_path = os.path.join(output_dir, output_filename)
-            new_doc = fitz.open()
-            new_doc.insert_pdf(doc, from_page=start_page - 1, to_page=end_page - 1)
-            new_doc.save(output_path)
-            new_doc.close()
-
-            total_success += 1
-            results.append(f"✅ {output_filename} (Trang {start_page}-{end_page})")
-
-        doc.close()
-        
-        # Lưu analysis data
-        analysis_file = os.path.join(output_dir, "phan_tich.json")
-        with open(analysis_file, "w", encoding="utf-8") as f:
+        with open(os.path.join(output_dir, "phan_tich.json"), "w", encoding="utf-8") as f:
             json.dump(analysis_data, f, ensure_ascii=False, indent=2)
-
-    except Exception as e:
+    except OSError as e:
         results.append(f"❌ Lỗi: {e}")
 
     return output_dir, total_success, results
 
 
+
+def process_file(api_key, file_path, progress_callback, control, text_sidecar=False, image_profile=None,
+                 force=False):
+    """Phân tích và tách một file - chạy trong luồng worker
+
+    force=True: phân tích lại bằng AI dù đã có trong chỉ mục, ghi đè kết quả cũ.
+    """
+    filename = os.path.basename(file_path)
+    source_hash = file_hash(file_path)
+    analysis_data = None if force else lookup_safely(source_hash=source_hash)
+    if analysis_data is not None:
+        progress_callback("Đã có kết quả phân tích trong chỉ mục, bỏ qua AI", 55)
+    else:
+        with FITZ_LOCK:
+            page_hashes, plan = prepare_reuse(file_path, reuse=not force)
+        error, analysis_data = analyze_pdf_with_gemini(
+            api_key, filename, file_path, progress_callback, control, plan
+        )
+        if error:
+            return error, None, 0, []
+        record_safely(file_path, analysis_data, source_hash=source_hash, page_hashes=page_hashes)
+
+    progress_callback(f"Tìm thấy {len(analysis_data)} văn bản, đang chờ tách...", 60)
+    with FITZ_LOCK:
+        output_dir, total_success, results = split_pdf(
+            file_path, analysis_data, progress_callback, control, text_sidecar, image_profile
+        )
+    return None, output_dir, total_success, results
+
+
 class PDFSplitterApp:
     def __init__(self, root):
         self.root = root
         self.root.title("📄 Tách File PDF Với AI")
-        self.root.geometry("700x650")
+        self.root.geometry("700x750")
         self.root.configure(bg="#f5f5f5")
         
         # Căn giữa cửa sổ
         self.center_window()
         
         self.api_key = None
-        self.pdf_file = None
+        self.pdf_files = []
         self.output_dir = None
 
+        # Hàng đợi sự kiện từ các worker -> luồng Tk (không bao giờ chặn mainloop)
+        self.events = queue.Queue()
+        self.executor = None
+        self.control = None
+        self.file_progress = {}
+        self.pending = 0
+        self.total_success = 0
+
         self.create_widgets()
         self.load_api_key()
+        self.root.after(100, self.poll_events)
 
     def center_window(self):
         self.root.update_idletasks()
         w = 700
-        h = 650
+        h = 750
         x = (self.root.winfo_screenwidth() // 2) - (w // 2)
         y = (self.root.winfo_screenheight() // 2) - (h // 2)
         self.root.geometry(f'{w}x{h}+{x}+{y}')
@@ -240,27 +246,75 @@ class PDFSplitterApp:
                                    bg="#f5f5f5", padx=10, pady=10)
         file_frame.pack(fill="x", pady=(0, 10))
 
-        self.file_label = tk.Label(file_frame, text="Chưa chọn file", font=("Arial", 10),
+        top = tk.Frame(file_frame, bg="#f5f5f5")
+        top.pack(fill="x")
+
+        self.file_label = tk.Label(top, text="Chưa chọn file", font=("Arial", 10),
                                    bg="#f5f5f5", fg="#666")
         self.file_label.pack(side="left", fill="x", expand=True)
 
-        btn_select = tk.Button(file_frame, text="Chọn File", command=self.select_file,
+        btn_select = tk.Button(top, text="Chọn File", command=self.select_file,
                               bg="#3b82f6", fg="white", font=("Arial", 10))
         btn_select.pack(side="right")
 
+        self.text_sidecar = tk.BooleanVar(value=False)
+        tk.Checkbutton(file_frame, text="Xuất kèm nội dung chữ (van_ban.jsonl)",
+                       variable=self.text_sidecar, bg="#f5f5f5",
+                       font=("Arial", 9)).pack(anchor="w", pady=(6, 0))
+
+        self.profile_jobs = tk.BooleanVar(value=False)
+        tk.Checkbutton(file_frame, text=f"Ghi profile hiệu năng cho lần chạy này ({PROFILES_DIR}/)",
+                       variable=self.profile_jobs, bg="#f5f5f5",
+                       font=("Arial", 9)).pack(anchor="w")
+
+        self.force_analysis = tk.BooleanVar(value=False)
+        tk.Checkbutton(file_frame, text="Phân tích lại (bỏ qua kết quả đã lưu trong chỉ mục)",
+                       variable=self.force_analysis, bg="#f5f5f5",
+                       font=("Arial", 9)).pack(anchor="w")
+
+        image_row = tk.Frame(file_frame, bg="#f5f5f5")
+        image_row.pack(anchor="w", pady=(2, 0))
+        tk.Label(image_row, text="Nén ảnh trang scan:", bg="#f5f5f5",
+                 font=("Arial", 9)).pack(side="left")
+        self.image_profile = tk.StringVar(value=PROFILE_LABELS[""])
+        tk.OptionMenu(image_row, self.image_profile, *PROFILE_LABELS.values()).pack(side="left", padx=5)
+
+        # Danh sách file trong hàng đợi với tiến độ từng file
+        self.file_tree = ttk.Treeview(file_frame, columns=("status", "progress"), height=5)
+        self.file_tree.heading("#0", text="File")
+        self.file_tree.heading("status", text="Trạng thái")
+        self.file_tree.heading("progress", text="Tiến độ")
+        self.file_tree.column("#0", width=280)
+        self.file_tree.column("status", width=220)
+        self.file_tree.column("progress", width=70, anchor="e")
+        self.file_tree.pack(fill="x", pady=(8, 0))
+
         # Progress
-        self.progress = ttk.Progressbar(main, mode="indeterminate", length=400)
+        self.progress = ttk.Progressbar(main, mode="determinate", length=400, maximum=100)
         self.progress.pack(pady=10)
 
         self.status_label = tk.Label(main, text="", font=("Arial", 10), bg="#f5f5f5", fg="#4f46e5")
         self.status_label.pack()
 
-        # Start button
-        self.btn_start = tk.Button(main, text="🚀 Bắt Đầu Phân Tích & Tách", 
+        # Start / Pause / Cancel buttons
+        controls = tk.Frame(main, bg="#f5f5f5")
+        controls.pack(pady=15)
+
+        self.btn_start = tk.Button(controls, text="🚀 Bắt Đầu Phân Tích & Tách", 
                                    command=self.start_processing,
                                    bg="#4f46e5", fg="white", font=("Arial", 12, "bold"),
-                                   state="disabled", width=30, height=2)
-        self.btn_start.pack(pady=15)
+                                   state="disabled", width=26, height=2)
+        self.btn_start.pack(side="left", padx=5)
+
+        self.btn_pause = tk.Button(controls, text="⏸ Tạm Dừng", command=self.toggle_pause,
+                                   bg="#64748b", fg="white", font=("Arial", 10),
+                                   state="disabled", width=12, height=2)
+        self.btn_pause.pack(side="left", padx=5)
+
+        self.btn_cancel = tk.Button(controls, text="✖ Hủy", command=self.cancel_processing,
+                                    bg="#ef4444", fg="white", font=("Arial", 10),
+                                    state="disabled", width=10, height=2)
+        self.btn_cancel.pack(side="left", padx=5)
 
         # Results
         result_frame = tk.LabelFrame(main, text="📋 Kết Quả", font=("Arial", 10, "bold"),
@@ -299,20 +353,31 @@ class PDFSplitterApp:
         webbrowser.open("https://aistudio.google.com/app/apikey")
 
     def select_file(self):
-        file_path = filedialog.askopenfilename(
+        if self.executor:
+            return
+
+        file_paths = filedialog.askopenfilenames(
             title="Chọn File PDF",
             filetypes=[("PDF files", "*.pdf")]
         )
-        if file_path:
-            self.pdf_file = file_path
-            filename = os.path.basename(file_path)
-            size_mb = os.path.getsize(file_path) / (1024 * 1024)
-            self.file_label.config(text=f"{filename} ({size_mb:.1f} MB)", fg="#333")
+        if file_paths:
+            self.pdf_files = list(file_paths)
+            size_mb = sum(os.path.getsize(p) for p in self.pdf_files) / (1024 * 1024)
+            if len(self.pdf_files) == 1:
+                text = f"{os.path.basename(self.pdf_files[0])} ({size_mb:.1f} MB)"
+            else:
+                text = f"{len(self.pdf_files)} file ({size_mb:.1f} MB)"
+            self.file_label.config(text=text, fg="#333")
+
+            self.file_tree.delete(*self.file_tree.get_children())
+            for path in self.pdf_files:
+                self.file_tree.insert("", tk.END, iid=path, text=os.path.basename(path),
+                                      values=("Đang chờ", "0%"))
             self.update_start_button()
 
     def update_start_button(self):
         api_key = self.api_entry.get().strip()
-        if api_key and self.pdf_file:
+        if api_key and self.pdf_files and not self.executor:
             self.btn_start.config(state="normal")
         else:
             self.btn_start.config(state="disabled")
@@ -324,62 +389,145 @@ class PDFSplitterApp:
             messagebox.showerror("Lỗi", "Vui lòng nhập API Key")
             return
 
-        if not self.pdf_file:
+        if not self.pdf_files:
             messagebox.showerror("Lỗi", "Vui lòng chọn file PDF")
             return
 
-        self.progress.start()
         self.btn_start.config(state="disabled")
+        self.btn_pause.config(state="normal", text="⏸ Tạm Dừng")
+        self.btn_cancel.config(state="normal")
+        self.btn_open.config(state="disabled")
         self.result_text.delete(1.0, tk.END)
+        self.progress.config(value=0)
+        self.status_label.config(text=f"Đang xử lý {len(self.pdf_files)} file...")
+
+        self.control = JobControl()
+        self.file_progress = {path: 0 for path in self.pdf_files}
+        self.pending = len(self.pdf_files)
+        self.total_success = 0
+
+        self.executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        for path in self.pdf_files:
+            self.file_tree.item(path, values=("Đang chờ", "0%"))
+            self.executor.submit(self.process_worker, self.api_key, path, self.control,
+                                 self.text_sidecar.get(), self.profile_jobs.get(),
+                                 self.selected_image_profile(), self.force_analysis.get())
+        self.executor.shutdown(wait=False)
+
+    def selected_image_profile(self):
+        label = self.image_profile.get()
+        return next((key for key, text in PROFILE_LABELS.items() if text == label), "") or None
+
+    def process_worker(self, api_key, file_path, control, text_sidecar, profile=False, image_profile=None,
+                       force=False):
+        """Chạy trong luồng worker - chỉ giao tiếp với giao diện qua self.events"""
+        def progress(message, percent=None):
+            self.events.put(("progress", file_path, message, percent))
+
+        job_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_") + os.path.basename(file_path)
+        try:
+            control.checkpoint()
+            with maybe_profile(job_id, profile, label=file_path):
+                error, output_dir, total_success, results = process_file(
+                    api_key, file_path, progress, control, text_sidecar, image_profile, force
+                )
+            if error:
+                self.events.put(("error", file_path, error))
+            else:
+                self.events.put(("done", file_path, output_dir, total_success, results))
+        except JobCancelled:
+            self.events.put(("cancelled", file_path))
+        except Exception as e:
+            self.events.put(("error", file_path, f"Lỗi: {e}"))
 
-        threading.Thread(target=self.process_thread, daemon=True).start()
-
-    def process_thread(self):
-        filename = os.path.basename(self.pdf_file)
-        
-        # Phân tích với AI
-        error, analysis_data = analyze_pdf_with_gemini(
-            self.api_key, filename, self.pdf_file, self.update_status
-        )
-
-        if error:
-            self.root.after(0, lambda: self.show_error(error))
+    def poll_events(self):
+        """Lấy sự kiện từ hàng đợi mà không chặn mainloop"""
+        try:
+            while True:
+                self.handle_event(self.events.get_nowait())
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_events)
+
+    def handle_event(self, event):
+        kind, file_path = event[0], event[1]
+        name = os.path.basename(file_path)
+
+        if kind == "progress":
+            _, _, message, percent = event
+            if percent is not None:
+                self.file_progress[file_path] = percent
+            progress = self.file_progress.get(file_path, 0)
+            self.file_tree.item(file_path, values=(message, f"{progress}%"))
+            self.update_overall_progress()
             return
 
-        # Hiển thị kết quả phân tích
-        self.root.after(0, lambda: self.show_analysis(analysis_data))
-
-        # Tách file
-        self.update_status("Đang tách file PDF...")
-        self.output_dir, total_success, results = split_pdf(
-            self.pdf_file, analysis_data, self.update_status
-        )
-
-        # Hiển thị kết quả
-        self.root.after(0, lambda: self.show_results(total_success, results))
-
-    def update_status(self, message):
-        self.root.after(0, lambda: self.status_label.config(text=message))
-
-    def show_error(self, error):
-        self.progress.stop()
-        self.btn_start.config(state="normal")
-        self.status_label.config(text="")
-        messagebox.showerror("Lỗi", error)
+        if kind == "done":
+            _, _, output_dir, total_success, results = event
+            self.output_dir = output_dir
+            self.total_success += total_success
+            self.file_tree.item(file_path, values=(f"✅ Đã tách {total_success} văn bản", "100%"))
+            self.result_text.insert(tk.END, f"📄 {name}: {total_success} văn bản\n")
+            for result in results:
+                self.result_text.insert(tk.END, "   " + result + "\n")
+            self.btn_open.config(state="normal")
+        elif kind == "error":
+            self.file_tree.item(file_path, values=("❌ Lỗi", "100%"))
+            self.result_text.insert(tk.END, f"❌ {name}: {event[2]}\n")
+        elif kind == "cancelled":
+            self.file_tree.item(file_path, values=("Đã hủy", f"{self.file_progress.get(file_path, 0)}%"))
+
+        self.result_text.see(tk.END)
+        self.file_progress[file_path] = 100
+        self.update_overall_progress()
+        self.pending -= 1
+        if self.pending == 0:
+            self.finish_processing()
+
+    def update_overall_progress(self):
+        if self.file_progress:
+            value = sum(self.file_progress.values()) / len(self.file_progress)
+            self.progress.config(value=value)
+
+    def toggle_pause(self):
+        if not self.control:
+            return
+        if self.control.paused:
+            self.control.resume()
+            self.btn_pause.config(text="⏸ Tạm Dừng")
+            self.status_label.config(text="Đang tiếp tục xử lý...")
+        else:
+            self.control.pause()
+            self.btn_pause.config(text="▶ Tiếp Tục")
+            self.status_label.config(text="Đã tạm dừng (các yêu cầu AI đang chạy sẽ hoàn tất)")
+
+    def cancel_processing(self):
+        if self.control:
+            self.control.cancel()
+            self.btn_pause.config(state="disabled")
+            self.btn_cancel.config(state="disabled")
+            self.status_label.config(text="Đang hủy...")
+
+    def finish_processing(self):
+        cancelled = self.control.cancelled
+        self.executor = None
+        self.control = None
+        self.btn_pause.config(state="disabled", text="⏸ Tạm Dừng")
+        self.btn_cancel.config(state="disabled")
+        self.update_start_button()
+
+        if cancelled:
+            self.status_label.config(text=f"Đã hủy. Đã tách {self.total_success} văn bản")
+            return
 
-    def show_analysis(self, data):
-        self.result_text.insert(tk.END, f"📊 Phân tích: Tìm thấy {len(data)} văn bản\n\n")
+        self.progress.config(value=100)
+        self.status_label.config(text=f"✅ Hoàn tất! Đã tách {self.total_success} văn bản")
+        messagebox.showinfo("Hoàn Tất", f"Đã tách thành công {self.total_success} văn bản!")
 
-    def show_results(self, total_success, results):
-        self.progress.stop()
-        self.btn_start.config(state="normal")
-        self.btn_open.config(state="normal")
-        self.status_label.config(text=f"✅ Hoàn tất! Đã tách {total_success} văn bản")
-        
-        for result in results:
-            self.result_text.insert(tk.END, result + "\n")
-        
-        messagebox.showinfo("Hoàn Tất", f"Đã tách thành công {total_success} văn bản!")
+    def on_close(self):
+        if self.control:
+            self.control.cancel()
+        self.root.destroy()
 
     def open_output_folder(self):
         if self.output_dir and os.path.exists(self.output_dir):
@@ -408,9 +556,12 @@ def main():
     
     # Bind API key change
     app.api_entry.bind("<KeyRelease>", lambda e: app.update_start_button())
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     
     root.mainloop()
 
 
 if __name__ == "__main__":
+    # Nén ảnh dùng process pool: cần cho bản đóng gói (PyInstaller) trên Windows
+    multiprocessing.freeze_support()
     main()
@@ -1,32 +1,32 @@
-import fitz
 import os
 import sys
 import json
-import pandas as pd
 import datetime
 from collections import defaultdict
-import base64
 import platform
 import tkinter as tk
 from tkinter import filedialog, messagebox, Listbox, Scrollbar, ttk, Text, simpledialog
 import threading
+import multiprocessing
 import subprocess
 
-# ===============================
-#  KIỂM TRA & NẠP THƯ VIỆN GOOGLE
-# ===============================
-try:
-    import google.generativeai as genai
-    GOOGLE_AI_AVAILABLE = True
-except Exception as e:
-    print(f"⚠️ Không thể import Google AI ({e})")
-    GOOGLE_AI_AVAILABLE = False
+from model_router import profile_pdf, combine_profiles, AnalysisValidationError
+from doc_index import lookup_safely, record_safely
+from incremental import page_hashes
+from image_recompress import PROFILE_LABELS
+from profiling import maybe_profile, PROFILES_DIR
+from pdf_core import (
+    GOOGLE_AI_AVAILABLE, MAX_INLINE_PDF_BYTES, make_genai_client, pdf_part, analyze_contents, split_pdf,
+)
+
+if not GOOGLE_AI_AVAILABLE:
+    print("⚠️ Không tìm thấy thư viện google-genai")
 
 # ===============================
 #  CẤU HÌNH CHƯƠNG TRÌNH
 # ===============================
 API_KEY_FILE = "google_api_key.txt"
-MODEL_NAME = "gemini-2.0-flash"
+AI_TIMEOUT = 1200  # Giây, cho một yêu cầu gồm nhiều file
 
 AI_PROMPT_BASE = """
 Phân tích các file PDF sau đây. Mỗi file chứa nhiều văn bản tố tụng hình sự.
@@ -47,11 +47,11 @@ Chỉ trả về khối code JSON duy nhất, không có lời giải thích hay
 """
 
 # ===============================
-#  PHÂN TÍCH PDF VỚI AI (SỬ DỤNG BASE64 INLINE)
+#  PHÂN TÍCH PDF VỚI AI (GỬI INLINE)
 # ===============================
 def analyze_pdfs_with_ai(api_key, pdf_file_paths, progress_callback):
     try:
-        genai.configure(api_key=api_key)
+        client = make_genai_client(api_key, timeout=AI_TIMEOUT)
     except Exception as e:
         return f"Lỗi cấu hình API: {e}", None, []
 
@@ -65,22 +65,14 @@ def analyze_pdfs_with_ai(api_key, pdf_file_paths, progress_callback):
     for i, (filename, file_path) in enumerate(pdf_file_paths.items()):
         try:
             file_size = os.path.getsize(file_path)
-            if file_size > 20 * 1024 * 1024:
+            if file_size > MAX_INLINE_PDF_BYTES:
                 raise ValueError("File vượt quá 20MB, không hỗ trợ inline.")
             total_size += file_size
             if total_size > 50 * 1024 * 1024:
                 raise ValueError("Tổng kích thước file vượt quá giới hạn 50MB.")
             
             with open(file_path, 'rb') as f:
-                pdf_bytes = f.read()
-            encoded_pdf = base64.b64encode(pdf_bytes).decode('utf-8')
-            pdf_part = {
-                "inline_data": {
-                    "mime_type": "application/pdf",
-                    "data": encoded_pdf
-                }
-            }
-            pdf_parts.append(pdf_part)
+                pdf_parts.append(pdf_part(f.read()))
         except Exception as e:
             error_files[filename] = str(e)
         progress_callback(f"Đang xử lý file {i+1}/{total_files}: {filename}")
@@ -91,34 +83,27 @@ def analyze_pdfs_with_ai(api_key, pdf_file_paths, progress_callback):
     ai_prompt = AI_PROMPT_BASE.format(file_list=', '.join(file_list))
 
     progress_callback("BƯỚC 2: GỬI YÊU CẦU PHÂN TÍCH")
-    model = genai.GenerativeModel(model_name=MODEL_NAME)
-    request_content = [{"text": ai_prompt}] + pdf_parts
+    request_content = [ai_prompt] + pdf_parts
+
+    profiles = {name: profile_pdf(pdf_file_paths[name]) for name in file_list if name not in error_files}
+    profile = combine_profiles(profiles.values())
+    page_counts = {name: p.page_count for name, p in profiles.items() if p is not None}
 
     try:
-        response = model.generate_content(request_content, request_options={'timeout': 1200})
-        json_string = response.text.strip().replace("```json", "").replace("```", "").strip()
-        analysis_data = json.loads(json_string)
-        
-        # Validate analysis_data
-        if not isinstance(analysis_data, list):
-            raise ValueError("Dữ liệu từ AI không phải là list JSON.")
-        for item in analysis_data:
-            required_keys = ["ten_file_goc", "ten_file_output", "trang_bat_dau", "trang_ket_thuc", "nam_van_ban"]
-            if not all(key in item for key in required_keys):
-                raise ValueError(f"Item thiếu key: {item}")
-            if not (isinstance(item["trang_bat_dau"], int) and isinstance(item["trang_ket_thuc"], int) and item["trang_bat_dau"] <= item["trang_ket_thuc"]):
-                raise ValueError(f"Phạm vi trang không hợp lệ: {item}")
-        
+        analysis_data = analyze_contents(
+            client, request_content, profile, page_counts or None,
+            on_route=lambda model_name: progress_callback(f"Đang phân tích với {model_name}...")
+        )
         return None, analysis_data, []
-    except json.JSONDecodeError as e:
-        return f"Lỗi parse JSON từ AI: {e}", None, []
+    except AnalysisValidationError as e:
+        return f"Dữ liệu từ AI không hợp lệ: {e}", None, []
     except Exception as e:
         return f"Lỗi khi gọi AI: {e}", None, []
 
 # ===============================
 #  TÁCH FILE THEO DỮ LIỆU AI
 # ===============================
-def run_multi_file_splitter(pdf_file_paths, analysis_data, progress_callback):
+def run_multi_file_splitter(pdf_file_paths, analysis_data, progress_callback, text_sidecar=False, image_profile=None):
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     base_output_dir = f"ket_qua_da_tach_{timestamp}"
     os.makedirs(base_output_dir, exist_ok=True)
@@ -137,32 +122,19 @@ def run_multi_file_splitter(pdf_file_paths, analysis_data, progress_callback):
             continue
 
         sub_folder = os.path.join(base_output_dir, os.path.splitext(filename)[0])
-        os.makedirs(sub_folder, exist_ok=True)
 
-        try:
-            doc = fitz.open(pdf_file_paths[filename])
-            page_count = doc.page_count
-            for rule in rules:
-                current += 1
-                progress_callback(f"Đang tách {current}/{total_tasks}: {rule['ten_file_output']}")
-                start_page = rule["trang_bat_dau"]
-                end_page = rule["trang_ket_thuc"]
-                if not (1 <= start_page <= end_page <= page_count):
-                    continue
-                
-                base_name = rule["ten_file_output"].replace(".pdf", "")
-                year = rule.get("nam_van_ban")
-                output_filename = f"{base_name}_{year}.pdf" if year else f"{base_name}.pdf"
-
-                output_path = os.path.join(sub_folder, output_filename)
-                new_doc = fitz.open()
-                new_doc.insert_pdf(doc, from_page=start_page - 1, to_page=end_page - 1)
-                new_doc.save(output_path)
-                new_doc.close()
-                total_success += 1
-            doc.close()
-        except Exception as e:
-            pass
+        def progress(i, total, rule):
+            progress_callback(f"Đang tách {current + i + 1}/{total_tasks}: {rule['ten_file_output']}")
+
+        if image_profile:
+            progress_callback(f"Đang nén ảnh {filename}...")
+        success, results = split_pdf(pdf_file_paths[filename], rules, sub_folder, text_sidecar, image_profile,
+                                     progress_callback=progress)
+        for line in results:
+            if line.startswith("🗜️"):
+                progress_callback(line)
+        current += len(rules)
+        total_success += success
 
     # Export analysis to file
     analysis_file = os.path.join(base_output_dir, "analysis_data.json")
@@ -208,6 +180,21 @@ class PDFSplitterApp:
         self.progress = ttk.Progressbar(root, orient="horizontal", length=500, mode="indeterminate")
         self.progress.pack(pady=10)
 
+        # Tùy chọn xuất nội dung chữ
+        self.text_sidecar = tk.BooleanVar(value=False)
+        self.chk_sidecar = tk.Checkbutton(root, text="Xuất kèm nội dung chữ (van_ban.jsonl)", variable=self.text_sidecar, bg="#f0f0f0", font=("Arial", 10))
+        self.chk_sidecar.pack()
+
+        self.profile_run = tk.BooleanVar(value=False)
+        self.chk_profile = tk.Checkbutton(root, text=f"Ghi profile hiệu năng cho lần chạy này ({PROFILES_DIR}/)", variable=self.profile_run, bg="#f0f0f0", font=("Arial", 10))
+        self.chk_profile.pack()
+
+        # Nén ảnh trang scan khi tách
+        self.image_profile = tk.StringVar(value=PROFILE_LABELS[""])
+        self.opt_image = tk.OptionMenu(root, self.image_profile, *PROFILE_LABELS.values())
+        self.opt_image.config(font=("Arial", 10))
+        self.opt_image.pack()
+
         # Button bắt đầu xử lý
         self.btn_start = tk.Button(root, text="Bắt Đầu Phân Tích & Tách", command=self.start_processing, state="disabled", bg="#2196F3", fg="white", font=("Arial", 12))
         self.btn_start.pack(pady=10)
@@ -269,19 +256,46 @@ class PDFSplitterApp:
         self.btn_start.config(state="disabled")
         self.status_label.config(text="Đang xử lý...", fg="blue")
 
-        threading.Thread(target=self.process_thread).start()
+        # Đọc tùy chọn trên luồng giao diện trước khi chạy nền
+        image_label = self.image_profile.get()
+        image_profile = next((key for key, text in PROFILE_LABELS.items() if text == image_label), "") or None
+        threading.Thread(target=self.process_thread, args=(self.text_sidecar.get(), self.profile_run.get(), image_profile)).start()
+
+    def process_thread(self, text_sidecar=False, profile=False, image_profile=None):
+        job_id = "pdfv3_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        with maybe_profile(job_id, profile, label=f"{len(self.pdf_files)} file"):
+            self.run_job(text_sidecar, image_profile)
+
+    def run_job(self, text_sidecar, image_profile=None):
+        # File đã có trong chỉ mục thì không gửi lại cho AI
+        cached_data = []
+        pending_files = {}
+        for name, path in self.pdf_files.items():
+            records = lookup_safely(path)
+            if records is None:
+                pending_files[name] = path
+            else:
+                cached_data.extend(dict(item, ten_file_goc=name) for item in records)
 
-    def process_thread(self):
-        error, analysis_data, file_names = analyze_pdfs_with_ai(self.api_key, self.pdf_files, self.update_status)
+        analysis_data = []
+        if pending_files:
+            error, analysis_data, file_names = analyze_pdfs_with_ai(self.api_key, pending_files, self.update_status)
 
-        if error:
-            self.root.after(0, lambda: messagebox.showerror("Lỗi", error))
-            self.root.after(0, self.reset_ui)
-            return
+            if error:
+                self.root.after(0, lambda: messagebox.showerror("Lỗi", error))
+                self.root.after(0, self.reset_ui)
+                return
+
+            for name, path in pending_files.items():
+                records = [item for item in analysis_data if item["ten_file_goc"] == name]
+                if records:
+                    record_safely(path, records, page_hashes=page_hashes(path))
+
+        analysis_data = cached_data + analysis_data
 
         self.root.after(0, lambda: self.display_analysis(analysis_data))
 
-        self.output_dir, total_success = run_multi_file_splitter(self.pdf_files, analysis_data, self.update_status)
+        self.output_dir, total_success = run_multi_file_splitter(self.pdf_files, analysis_data, self.update_status, text_sidecar, image_profile)
 
         self.root.after(0, lambda: messagebox.showinfo("Hoàn Tất", f"Đã tách thành công {total_success} văn bản."))
         self.root.after(0, self.enable_open_button)
@@ -316,8 +330,9 @@ class PDFSplitterApp:
                 subprocess.Popen(["xdg-open", path])
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     if not GOOGLE_AI_AVAILABLE:
-        print("❌ Thư viện google-generativeai chưa được cài.")
+        print("❌ Thư viện google-genai chưa được cài.")
         sys.exit()
 
     root = tk.Tk()
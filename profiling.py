@@ -0,0 +1,103 @@
+"""
+Profile theo từng job (bật khi cần)
+
+    with maybe_profile(job_id, enabled):
+        ... tách / phân tích ...
+
+Khi enabled=False chỉ là nullcontext, không tốn gì thêm. Khi bật, cProfile
+ghi lại luồng hiện tại và lưu vào PROFILES_DIR:
+    <job_id>.prof  - xem bằng snakeviz / pstats
+    <job_id>.txt   - 40 hàm tốn thời gian nhất (cumulative)
+"""
+
+import os
+import io
+import time
+import pstats
+import cProfile
+import datetime
+import contextlib
+
+PROFILES_DIR = os.environ.get("PROFILES_DIR", "profiles")
+PROFILE_TOP_FUNCTIONS = 40
+
+
+def safe_job_id(job_id):
+    return "".join(c if c.isalnum() or c in "._-" else "_" for c in str(job_id))
+
+
+@contextlib.contextmanager
+def profile_job(job_id, label="", profiles_dir=None):
+    """Profile đoạn code trong khối with và lưu kết quả theo job_id"""
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        # Python 3.12+: chỉ một profiler được chạy tại một thời điểm
+        print(f"Warning: không bật được profile cho {job_id} ({e})")
+        yield None
+        return
+
+    started = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        try:
+            save_profile(profiler, job_id, elapsed, label, profiles_dir)
+        except OSError as e:
+            print(f"Warning: không lưu được profile {job_id} ({e})")
+
+
+def maybe_profile(job_id, enabled, label="", profiles_dir=None):
+    if not enabled:
+        return contextlib.nullcontext()
+    return profile_job(job_id, label, profiles_dir)
+
+
+def save_profile(profiler, job_id, elapsed, label="", profiles_dir=None):
+    profiles_dir = profiles_dir or PROFILES_DIR
+    os.makedirs(profiles_dir, exist_ok=True)
+    base = os.path.join(profiles_dir, safe_job_id(job_id))
+
+    profiler.dump_stats(base + ".prof")
+
+    summary = io.StringIO()
+    summary.write(f"job: {job_id}\n")
+    if label:
+        summary.write(f"label: {label}\n")
+    summary.write(f"elapsed: {elapsed:.3f}s\n\n")
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write(summary.getvalue())
+    return base + ".prof"
+
+
+def list_profiles(limit=20, profiles_dir=None):
+    """Các profile gần nhất, mới nhất trước"""
+    profiles_dir = profiles_dir or PROFILES_DIR
+    if not os.path.isdir(profiles_dir):
+        return []
+
+    entries = []
+    for name in os.listdir(profiles_dir):
+        if not name.endswith(".prof"):
+            continue
+        path = os.path.join(profiles_dir, name)
+        stat = os.stat(path)
+        job_id = name[:-len(".prof")]
+        entries.append({
+            "job_id": job_id,
+            "profile": name,
+            "summary": job_id + ".txt",
+            "size": stat.st_size,
+            "created": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(timespec="seconds"),
+            "_mtime": stat.st_mtime,
+        })
+
+    entries.sort(key=lambda e: e["_mtime"], reverse=True)
+    for entry in entries:
+        del entry["_mtime"]
+    return entries[:limit]
@@ -0,0 +1,683 @@
+"""
+Xử lý hàng loạt trên nhiều máy qua một spool dùng chung
+
+Coordinator ghi danh sách job vào spool trên ổ dùng chung (thư mục hoặc
+file SQLite). Bao nhiêu worker, trên bao nhiêu máy cũng được, cùng nhận job
+bằng lease có thời hạn, phân tích + tách rồi ghi kết quả về spool. Worker
+chết thì lease hết hạn và job được worker khác nhận lại.
+
+    python spool.py submit /mnt/chung/spool /mnt/chung/ho_so /mnt/chung/ket_qua
+    python spool.py work /mnt/chung/spool --threads 4          # trên mỗi máy
+    python spool.py status /mnt/chung/spool
+    python spool.py requeue-failed /mnt/chung/spool
+
+Spool là thư mục, hoặc file .db/.sqlite/.sqlite3 (SQLite chỉ an toàn trên ổ mạng
+có khóa file đúng chuẩn; với NFS nên dùng spool thư mục).
+Job được xử lý ít nhất một lần: một worker quá chậm có thể làm trùng một job
+với worker nhận lại, kết quả ghi đè cùng thư mục nên vẫn nhất quán.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import threading
+from collections import Counter
+
+from pdf_core import FITZ_LOCK, analyze_pdf, split_pdf
+from incremental import prepare as prepare_reuse
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+API_KEY_FILE = "google_api_key.txt"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 5
+
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+
+def now_ts():
+    return time.time()
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def job_id_for(source_path):
+    """Mã job cố định theo đường dẫn: gửi lại cùng thư mục không tạo job trùng"""
+    return hashlib.sha1(os.path.abspath(source_path).encode("utf-8")).hexdigest()[:16]
+
+
+def make_jobs(input_dir, output_root, recursive=True):
+    """Tạo job cho mọi file PDF trong input_dir
+
+    output_root nằm trong input_dir thì được bỏ qua khi duyệt, để lần chạy sau
+    không coi các file đã tách là file gốc mới. Trùng hẳn input_dir thì báo ValueError.
+    """
+    input_abs, output_abs = os.path.abspath(input_dir), os.path.abspath(output_root)
+    if input_abs == output_abs:
+        raise ValueError("Thư mục kết quả phải khác thư mục hồ sơ")
+    jobs = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != output_abs)
+        for name in sorted(files):
+            if not name.lower().endswith(".pdf"):
+                continue
+            source = os.path.abspath(os.path.join(root, name))
+            relative = os.path.splitext(os.path.relpath(source, input_dir))[0]
+            jobs.append({
+                "id": job_id_for(source),
+                "source": source,
+                "name": name,
+                "output_dir": os.path.abspath(os.path.join(output_root, relative)),
+            })
+        if not recursive:
+            break
+    return jobs
+
+
+# ===============================
+#  SPOOL SQLITE
+# ===============================
+class SQLiteSpool:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        source TEXT NOT NULL,
+        name TEXT NOT NULL,
+        output_dir TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        owner TEXT,
+        lease_expires REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        result TEXT,
+        submitted_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, lease_expires);
+    """
+
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        conn = self._connect()
+        try:
+            conn.executescript(self.SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, jobs):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            before = conn.total_changes
+            ts = now_ts()
+            conn.executemany(
+                "INSERT OR IGNORE INTO jobs (id, source, name, output_dir, submitted_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(j["id"], j["source"], j["name"], j["output_dir"], ts, ts) for j in jobs],
+            )
+            conn.execute("COMMIT")
+            return conn.total_changes - before
+        finally:
+            conn.close()
+
+    def claim(self, owner, lease_seconds=LEASE_SECONDS):
+        """Nhận một job đang chờ (hoặc có lease đã hết hạn); None nếu không còn"""
+        conn = self._connect()
+        try:
+            while True:
+                ts = now_ts()
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = 'pending' "
+                    "OR (status = 'leased' AND lease_expires < ?) "
+                    "ORDER BY submitted_at, id LIMIT 1",
+                    (ts,),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                if row["attempts"] >= self.max_attempts:
+                    # Lease hết hạn quá nhiều lần (worker chết giữa chừng)
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', owner = NULL, error = ?, updated_at = ? WHERE id = ?",
+                        (row["error"] or "Lease hết hạn quá số lần cho phép", ts, row["id"]),
+                    )
+                    conn.execute("COMMIT")
+                    continue
+
+                conn.execute(
+                    "UPDATE jobs SET status = 'leased', owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (owner, ts + lease_seconds, ts, row["id"]),
+                )
+                conn.execute("COMMIT")
+                job = dict(row)
+                job["attempts"] += 1
+                return job
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, job_id, owner, lease_seconds=LEASE_SECONDS):
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = 'leased'",
+                (now_ts() + lease_seconds, now_ts(), job_id, owner),
+            )
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def complete(self, job_id, owner, result):
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'done', owner = NULL, lease_expires = NULL, error = NULL, "
+                "result = ?, updated_at = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+                (json.dumps(result, ensure_ascii=False), now_ts(), job_id, owner),
+            )
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def fail(self, job_id, owner, error):
+        """Trả job về hàng đợi, hoặc đánh dấu thất bại khi đã hết số lần thử"""
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "owner = NULL, lease_expires = NULL, error = ?, updated_at = ? "
+                "WHERE id = ? AND owner = ? AND status = 'leased'",
+                (self.max_attempts, error, now_ts(), job_id, owner),
+            )
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def requeue_failed(self):
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "UPDATE jobs SET status = 'pending', attempts = 0, updated_at = ? WHERE status = 'failed'",
+                (now_ts(),),
+            )
+            return cur.rowcount
+        finally:
+            conn.close()
+
+    def status(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+            failed = conn.execute(
+                "SELECT source, error FROM jobs WHERE status = 'failed' ORDER BY updated_at DESC LIMIT 20"
+            ).fetchall()
+        finally:
+            conn.close()
+        return Counter({row["status"]: row["n"] for row in rows}), [dict(row) for row in failed]
+
+
+# ===============================
+#  SPOOL THƯ MỤC
+# ===============================
+class DirectorySpool:
+    """Spool bằng thư mục: mỗi job một file JSON, chuyển trạng thái bằng os.rename
+
+    pending/<id>.json -> leased/<id>.<token>.json (+ .lease) -> done/ hoặc failed/
+    Phép rename trên cùng một thư mục gốc là nguyên tử, nên chỉ một worker nhận được job.
+    Mỗi lần nhận có token riêng: worker thu hồi lease hết hạn chỉ động đến đúng
+    lần nhận mà nó đã đọc, không bao giờ xóa lease của worker nhận lại sau đó.
+    Khi kết thúc, job được rename sang leased/<id>.<token>.finishing trước khi ghi:
+    worker kết thúc và worker thu hồi tranh nhau bằng cùng một phép rename.
+    """
+
+    STATES = ("pending", "leased", "done", "failed")
+
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        for state in self.STATES:
+            os.makedirs(os.path.join(path, state), exist_ok=True)
+
+    def _file(self, state, job_id, suffix=".json"):
+        return os.path.join(self.path, state, job_id + suffix)
+
+    def _leased(self, job_id, token, suffix=".json"):
+        # token rỗng: job nhận bởi bản cũ (leased/<id>.json), vẫn thu hồi / hoàn tất được
+        return self._file("leased", f"{job_id}.{token}" if token else job_id, suffix)
+
+    def _read(self, path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, path, data):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)
+
+    def _claims(self, job_id=None):
+        """[(job_id, token)] của các lần nhận đang giữ"""
+        claims = []
+        for name in os.listdir(os.path.join(self.path, "leased")):
+            if name.endswith(".json"):
+                claim_id, _, token = name[:-5].partition(".")
+                if job_id is None or claim_id == job_id:
+                    claims.append((claim_id, token))
+        return sorted(claims)
+
+    def _ids(self, state):
+        if state == "leased":
+            return sorted({job_id for job_id, _ in self._claims()})
+        names = os.listdir(os.path.join(self.path, state))
+        return sorted(name[:-5] for name in names if name.endswith(".json"))
+
+    def _exists_anywhere(self, job_id):
+        if self._claims(job_id):
+            return True
+        return any(os.path.exists(self._file(state, job_id)) for state in ("pending", "done", "failed"))
+
+    def submit(self, jobs):
+        added = 0
+        for job in jobs:
+            if self._exists_anywhere(job["id"]):
+                continue
+            data = dict(job, attempts=0, error=None, submitted_at=now_ts())
+            self._write(self._file("pending", job["id"]), data)
+            added += 1
+        return added
+
+    def _read_lease(self, job_id, token):
+        try:
+            return self._read(self._leased(job_id, token, ".lease"))
+        except (OSError, ValueError):
+            return None
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _reap_expired(self, lease_seconds):
+        """Đưa các job có lease hết hạn về pending"""
+        ts = now_ts()
+        for job_id, token in self._claims():
+            lease = self._read_lease(job_id, token)
+            if lease is not None:
+                expires = lease.get("expires", 0)
+            else:
+                # Worker chết ngay sau khi rename, chưa kịp ghi lease (rename cập nhật ctime)
+                try:
+                    stat = os.stat(self._leased(job_id, token))
+                except OSError:
+                    continue
+                expires = max(stat.st_mtime, stat.st_ctime) + lease_seconds
+            if expires >= ts:
+                continue
+            try:
+                os.rename(self._leased(job_id, token), self._file("pending", job_id))
+            except OSError:
+                continue  # Worker khác đã thu hồi trước
+            # Lease này chỉ thuộc lần nhận vừa thu hồi: lần nhận sau có token khác
+            self._remove(self._leased(job_id, token, ".lease"))
+
+        # Lease mồ côi: worker gia hạn đúng lúc job của nó bị thu hồi
+        for name in os.listdir(os.path.join(self.path, "leased")):
+            path = os.path.join(self.path, "leased", name)
+            if name.endswith(".lease"):
+                if not os.path.exists(path[:-len(".lease")] + ".json"):
+                    self._remove(path)
+            elif name.endswith(".finishing"):
+                # Worker chết giữa lúc kết thúc job: đưa job về pending
+                try:
+                    if os.stat(path).st_mtime + lease_seconds < ts:
+                        os.rename(path, self._file("pending", name.partition(".")[0]))
+                except OSError:
+                    continue
+
+    def claim(self, owner, lease_seconds=LEASE_SECONDS):
+        self._reap_expired(lease_seconds)
+        for job_id in self._ids("pending"):
+            token = uuid.uuid4().hex[:12]
+            leased_path = self._leased(job_id, token)
+            try:
+                os.rename(self._file("pending", job_id), leased_path)
+            except OSError:
+                continue  # Worker khác nhanh hơn
+            os.utime(leased_path)
+            self._write(self._leased(job_id, token, ".lease"),
+                        {"owner": owner, "expires": now_ts() + lease_seconds})
+
+            job = self._read(leased_path)
+            if job.get("attempts", 0) >= self.max_attempts:
+                def expired(job):
+                    job["error"] = job.get("error") or "Lease hết hạn quá số lần cho phép"
+                    return "failed"
+                self._finish(job_id, token, expired)
+                continue
+            job["attempts"] = job.get("attempts", 0) + 1
+            self._write(leased_path, job)
+            return job
+        return None
+
+    def _token(self, job_id, owner):
+        """Token lần nhận job_id của owner; None nếu đã mất lease"""
+        for claim_id, token in self._claims(job_id):
+            lease = self._read_lease(claim_id, token)
+            if lease is not None and lease.get("owner") == owner:
+                return token
+        return None
+
+    def renew(self, job_id, owner, lease_seconds=LEASE_SECONDS):
+        token = self._token(job_id, owner)
+        if token is None:
+            return False
+        lease_path = self._leased(job_id, token, ".lease")
+        self._write(lease_path, {"owner": owner, "expires": now_ts() + lease_seconds})
+        if not os.path.exists(self._leased(job_id, token)):
+            # Bị thu hồi giữa lúc đọc và ghi: bỏ lease vừa ghi
+            self._remove(lease_path)
+            return False
+        return True
+
+    def _finish(self, job_id, token, update):
+        """Kết thúc lần nhận: update(job) sửa job và trả về trạng thái mới.
+
+        False nếu lần nhận đã bị thu hồi (worker khác đã rename file đi).
+        """
+        finishing = self._leased(job_id, token, ".finishing")
+        try:
+            os.rename(self._leased(job_id, token), finishing)
+        except FileNotFoundError:
+            return False
+        self._remove(self._leased(job_id, token, ".lease"))
+        job = self._read(finishing)
+        state = update(job)
+        self._write(finishing, job)
+        os.rename(finishing, self._file(state, job_id))
+        return True
+
+    def complete(self, job_id, owner, result):
+        token = self._token(job_id, owner)
+        if token is None:
+            return False
+
+        def done(job):
+            job.update(result=result, error=None, finished_at=now_ts())
+            return "done"
+        return self._finish(job_id, token, done)
+
+    def fail(self, job_id, owner, error):
+        token = self._token(job_id, owner)
+        if token is None:
+            return False
+
+        def failed(job):
+            job["error"] = error
+            return "failed" if job.get("attempts", 0) >= self.max_attempts else "pending"
+        return self._finish(job_id, token, failed)
+
+    def requeue_failed(self):
+        count = 0
+        for job_id in self._ids("failed"):
+            path = self._file("failed", job_id)
+            job = self._read(path)
+            job["attempts"] = 0
+            self._write(path, job)
+            try:
+                os.rename(path, self._file("pending", job_id))
+                count += 1
+            except OSError:
+                pass
+        return count
+
+    def status(self):
+        counts = Counter({state: len(self._ids(state)) for state in self.STATES})
+        failed = []
+        for job_id in self._ids("failed")[:20]:
+            try:
+                job = self._read(self._file("failed", job_id))
+                failed.append({"source": job.get("source"), "error": job.get("error")})
+            except (OSError, ValueError):
+                continue
+        return counts, failed
+
+
+def open_spool(location, max_attempts=MAX_ATTEMPTS):
+    if location.lower().endswith(SQLITE_SUFFIXES):
+        return SQLiteSpool(location, max_attempts)
+    return DirectorySpool(location, max_attempts)
+
+
+# ===============================
+#  WORKER
+# ===============================
+class LeaseHeartbeat:
+    """Gia hạn lease định kỳ trong lúc xử lý job"""
+
+    def __init__(self, spool, job_id, owner, lease_seconds):
+        self.spool = spool
+        self.job_id = job_id
+        self.owner = owner
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                if not self.spool.renew(self.job_id, self.owner, self.lease_seconds):
+                    self.lost = True
+                    return
+            except Exception as e:
+                print(f"Warning: không gia hạn được lease {self.job_id} ({e})")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def process_job(job, api_key):
+    """Phân tích (hoặc lấy từ chỉ mục) rồi tách một file. Trả về (error, result)"""
+    from doc_index import file_hash, lookup_safely, record_safely
+
+    source = job["source"]
+    if not os.path.exists(source):
+        return f"Không tìm thấy file: {source}", None
+
+    source_hash = file_hash(source)
+    analysis = lookup_safely(source_hash=source_hash)
+    cached = analysis is not None
+    if not cached:
+        with FITZ_LOCK:
+            page_hashes, plan = prepare_reuse(source)
+        error, analysis = analyze_pdf(api_key, job["name"], source, plan=plan)
+        if error:
+            return error, None
+        record_safely(source, analysis, source_hash=source_hash, page_hashes=page_hashes)
+
+    output_dir = job["output_dir"]
+    os.makedirs(output_dir, exist_ok=True)
+    with FITZ_LOCK:
+        success, results = split_pdf(source, analysis, output_dir)
+    with open(os.path.join(output_dir, "analysis.json"), "w", encoding="utf-8") as f:
+        json.dump(analysis, f, ensure_ascii=False, indent=2)
+
+    # Như batch.py: file không mở được / ghi lỗi giữa chừng là job lỗi, không phải "xong 0 văn bản"
+    errors = [line for line in results if line.startswith("❌ Lỗi")]
+    if errors:
+        return errors[0], None
+    return None, {"total_split": success, "results": results, "cached": cached, "source_hash": source_hash}
+
+
+def log(owner, message):
+    stamp = datetime.datetime.now().strftime("%H:%M:%S")
+    print(f"[{stamp}] {owner} {message}", flush=True)
+
+
+def work_loop(spool, api_key, owner, lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS,
+              exit_when_empty=False):
+    """Nhận và xử lý job cho đến khi bị dừng (hoặc hết job nếu exit_when_empty)
+
+    Lỗi của spool (ổ mạng, SQLite bị khóa quá lâu...) chỉ được ghi log: luồng
+    worker chờ poll_seconds rồi thử lại, job dở dang được nhận lại khi lease hết hạn.
+    """
+    processed = 0
+    while True:
+        try:
+            job = spool.claim(owner, lease_seconds)
+            if job is None and exit_when_empty:
+                counts, _ = spool.status()
+                if not counts.get("pending") and not counts.get("leased"):
+                    return processed
+        except Exception as e:
+            log(owner, f"⚠️ lỗi spool khi nhận job: {e}")
+            job = None
+        if job is None:
+            time.sleep(poll_seconds)
+            continue
+
+        log(owner, f"nhận {job['name']} (lần {job['attempts']})")
+        with LeaseHeartbeat(spool, job["id"], owner, lease_seconds) as heartbeat:
+            try:
+                error, result = process_job(job, api_key)
+            except Exception as e:
+                error, result = f"Lỗi: {e}", None
+
+        processed += 1
+        if heartbeat.lost:
+            log(owner, f"mất lease {job['name']}, bỏ kết quả")
+            continue
+        try:
+            if error:
+                recorded = spool.fail(job["id"], owner, error)
+            else:
+                recorded = spool.complete(job["id"], owner, result)
+        except Exception as e:
+            log(owner, f"⚠️ lỗi spool khi ghi kết quả {job['name']}: {e}")
+            time.sleep(poll_seconds)
+            continue
+        if not recorded:
+            log(owner, f"mất lease {job['name']}, bỏ kết quả")
+        elif error:
+            log(owner, f"❌ {job['name']}: {error}")
+        else:
+            log(owner, f"✅ {job['name']}: {result['total_split']} văn bản")
+
+
+def load_api_key(value=None):
+    if value:
+        return value
+    if os.environ.get("GOOGLE_API_KEY"):
+        return os.environ["GOOGLE_API_KEY"]
+    if os.path.exists(API_KEY_FILE):
+        with open(API_KEY_FILE) as f:
+            return f.read().strip()
+    return None
+
+
+# ===============================
+#  DÒNG LỆNH
+# ===============================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Xử lý hàng loạt qua spool dùng chung")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_submit = sub.add_parser("submit", help="Ghi job cho mọi PDF trong thư mục")
+    p_submit.add_argument("spool")
+    p_submit.add_argument("input_dir")
+    p_submit.add_argument("output_dir")
+    p_submit.add_argument("--no-recursive", action="store_true")
+
+    p_work = sub.add_parser("work", help="Chạy worker")
+    p_work.add_argument("spool")
+    p_work.add_argument("--api-key", help="Mặc định: GOOGLE_API_KEY hoặc google_api_key.txt")
+    p_work.add_argument("--threads", type=int, default=1, help="Số job xử lý song song trong process")
+    p_work.add_argument("--lease", type=int, default=LEASE_SECONDS, help="Thời hạn lease (giây)")
+    p_work.add_argument("--poll", type=int, default=POLL_SECONDS)
+    p_work.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS)
+    p_work.add_argument("--exit-when-empty", action="store_true", help="Thoát khi không còn job")
+
+    p_status = sub.add_parser("status", help="Thống kê spool")
+    p_status.add_argument("spool")
+
+    p_requeue = sub.add_parser("requeue-failed", help="Đưa các job thất bại về hàng đợi")
+    p_requeue.add_argument("spool")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "submit":
+        try:
+            jobs = make_jobs(args.input_dir, args.output_dir, not args.no_recursive)
+        except ValueError as e:
+            print(e)
+            return 2
+        spool = open_spool(args.spool)
+        added = spool.submit(jobs)
+        print(f"Đã thêm {added} job mới ({len(jobs) - added} đã có trong spool)")
+    elif args.command == "work":
+        api_key = load_api_key(args.api_key)
+        if not api_key:
+            print("Cần API key (--api-key, GOOGLE_API_KEY hoặc google_api_key.txt)")
+            return 1
+        spool = open_spool(args.spool, args.max_attempts)
+        base_owner = default_owner()
+        threads = [
+            threading.Thread(
+                target=work_loop,
+                args=(spool, api_key, f"{base_owner}:{i}", args.lease, args.poll, args.exit_when_empty),
+                daemon=True,
+            )
+            for i in range(max(1, args.threads))
+        ]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                while t.is_alive():
+                    t.join(1)
+        except KeyboardInterrupt:
+            print("Dừng worker; các job đang chạy sẽ được nhận lại khi lease hết hạn")
+            return 130
+    elif args.command == "status":
+        counts, failed = open_spool(args.spool).status()
+        for state in ("pending", "leased", "done", "failed"):
+            print(f"{state:<8} {counts.get(state, 0)}")
+        for item in failed:
+            print(f"  ❌ {item['source']}: {item['error']}")
+    elif args.command == "requeue-failed":
+        print(f"Đã đưa {open_spool(args.spool).requeue_failed()} job về hàng đợi")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+"""
+Kiểm thử doc_index.py: lệnh add nạp kết quả phân tích cũ vào chỉ mục
+"""
+
+import json
+
+import doc_index
+from doc_index import DocumentIndex
+
+
+def write_json(path, data):
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    return str(path)
+
+
+def test_add_fills_missing_source_name(tmp_path, capsys):
+    db, pdf = str(tmp_path / "index.db"), tmp_path / "ho_so.pdf"
+    pdf.write_bytes(b"%PDF-1.4 ho so")
+    analysis = write_json(tmp_path / "cu.json", [
+        {"ten_file_output": "Lenh_01.pdf", "trang_bat_dau": 1, "trang_ket_thuc": 2, "nam_van_ban": 2024},
+        {"ten_file_goc": "khac.pdf", "ten_file_output": "Ban_an_02.pdf", "trang_bat_dau": 1,
+         "trang_ket_thuc": 4, "nam_van_ban": 2023},
+    ])
+
+    assert doc_index.main(["--db", db, "add", str(pdf), analysis]) == 0
+    assert "Đã nạp 1 văn bản" in capsys.readouterr().out
+    records = DocumentIndex(db).lookup(str(pdf))
+    assert records == [{"ten_file_goc": "ho_so.pdf", "ten_file_output": "Lenh_01.pdf",
+                        "trang_bat_dau": 1, "trang_ket_thuc": 2, "nam_van_ban": 2024}]
+
+
+def test_add_rejects_invalid_records(tmp_path, capsys):
+    db, pdf = str(tmp_path / "index.db"), tmp_path / "ho_so.pdf"
+    pdf.write_bytes(b"%PDF-1.4 ho so")
+
+    missing = write_json(tmp_path / "thieu.json", [{"ten_file_output": "Lenh_01.pdf", "trang_bat_dau": 1}])
+    assert doc_index.main(["--db", db, "add", str(pdf), missing]) == 1
+    assert "thiếu trường" in capsys.readouterr().out
+
+    not_list = write_json(tmp_path / "sai.json", {"ten_file_output": "Lenh_01.pdf"})
+    assert doc_index.main(["--db", db, "add", str(pdf), not_list]) == 1
+    assert "JSON array" in capsys.readouterr().out
+    assert DocumentIndex(db).lookup(str(pdf)) is None
@@ -0,0 +1,156 @@
+"""
+Kiểm thử incremental.py: nhận ra bản sau của bộ hồ sơ và chỉ phân tích phần mới
+
+Các file PDF được dựng bằng fitz ngay trong test: mỗi trang một dòng chữ riêng,
+nên hai file có cùng phần đầu khi và chỉ khi các trang đầu cùng nội dung.
+"""
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+import doc_index
+from doc_index import DocumentIndex
+from incremental import make_plan, merge, page_hashes, prepare, reused_analysis
+
+
+def make_pdf(path, texts, title=None):
+    doc = fitz.open()
+    for text in texts:
+        page = doc.new_page(width=300, height=400)
+        page.insert_text((40, 60), text)
+    if title:
+        doc.set_metadata({"title": title})
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def item(name, first, last, filename="ho_so.pdf"):
+    return {"ten_file_goc": filename, "ten_file_output": name,
+            "trang_bat_dau": first, "trang_ket_thuc": last, "nam_van_ban": 2024}
+
+
+PAGES = [f"Trang {i}" for i in range(1, 7)]
+ANALYSIS = [
+    item("Quyet_dinh_01.pdf", 1, 2),
+    item("Lenh_02.pdf", 3, 4),
+    item("Cao_trang_03.pdf", 5, 6),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DocumentIndex(str(tmp_path / "index.db"))
+
+
+def record(index, path, analysis):
+    hashes = page_hashes(path)
+    index.record(path, analysis, page_hashes=hashes)
+    return doc_index.file_hash(path)
+
+
+# ===============================
+#  PHẦN ĐẦU TRÙNG
+# ===============================
+def test_page_hashes_match_same_content(tmp_path):
+    old = make_pdf(tmp_path / "old.pdf", PAGES)
+    new = make_pdf(tmp_path / "new.pdf", PAGES + ["Trang 7"], title="khac metadata")
+    assert page_hashes(new)[:6] == page_hashes(old)
+    assert page_hashes(new)[6] not in page_hashes(old)
+
+
+def test_find_prefix_picks_longest_match(tmp_path, index):
+    short = make_pdf(tmp_path / "short.pdf", PAGES[:2] + ["Khac 3", "Khac 4"])
+    full = make_pdf(tmp_path / "full.pdf", PAGES)
+    record(index, short, ANALYSIS[:2])
+    full_hash = record(index, full, ANALYSIS)
+
+    grown = page_hashes(make_pdf(tmp_path / "grown.pdf", PAGES + ["Trang 7", "Trang 8"]))
+    assert index.find_prefix(grown) == (full_hash, 6)
+
+    changed = page_hashes(make_pdf(tmp_path / "changed.pdf", PAGES[:4] + ["Sua 5", "Trang 6"]))
+    assert index.find_prefix(changed) == (full_hash, 4)
+
+    other = page_hashes(make_pdf(tmp_path / "other.pdf", ["Bia khac"] + PAGES[1:]))
+    assert index.find_prefix(other) is None
+
+
+@pytest.mark.parametrize("chunk", [1, 2, 4, 256])
+def test_find_prefix_across_chunks(tmp_path, index, monkeypatch, chunk):
+    monkeypatch.setattr(doc_index, "PREFIX_CHUNK", chunk)
+    full_hash = record(index, make_pdf(tmp_path / "full.pdf", PAGES), ANALYSIS)
+    for length in (1, 3, 5, 6):
+        hashes = page_hashes(make_pdf(tmp_path / f"p{length}.pdf", PAGES[:length] + ["Moi"]))
+        assert index.find_prefix(hashes) == (full_hash, length)
+
+
+# ===============================
+#  KẾ HOẠCH DÙNG LẠI
+# ===============================
+def test_prepare_reuses_prefix_documents(tmp_path, index):
+    source_hash = record(index, make_pdf(tmp_path / "old.pdf", PAGES), ANALYSIS)
+    grown = make_pdf(tmp_path / "grown.pdf", PAGES + ["Trang 7", "Trang 8", "Trang 9"])
+
+    hashes, plan = prepare(grown, index)
+    assert len(hashes) == 9
+    assert plan.source_hash == source_hash
+    assert (plan.prefix_pages, plan.page_count) == (6, 9)
+    assert [r["ten_file_output"] for r in plan.kept] == ["Quyet_dinh_01.pdf", "Lenh_02.pdf"]
+    # Văn bản cuối đã biết được gửi lại cho AI cùng các trang mới
+    assert plan.known["ten_file_output"] == "Cao_trang_03.pdf"
+    assert plan.tail_start == 5
+
+
+def test_prepare_without_reuse_only_hashes(tmp_path, index):
+    record(index, make_pdf(tmp_path / "old.pdf", PAGES), ANALYSIS)
+    grown = make_pdf(tmp_path / "grown.pdf", PAGES + ["Trang 7"])
+    hashes, plan = prepare(grown, index, reuse=False)
+    assert len(hashes) == 7 and plan is None
+
+
+def test_single_document_from_page_one_is_not_reused(tmp_path, index):
+    # Văn bản cuối đã biết bắt đầu từ trang 1: gửi lại nó là gửi cả file, không tiết kiệm gì
+    record(index, make_pdf(tmp_path / "old.pdf", PAGES), [item("Ban_an_01.pdf", 1, 6)])
+    grown = make_pdf(tmp_path / "grown.pdf", PAGES + ["Trang 7"])
+    assert prepare(grown, index)[1] is None
+    assert make_plan([item("Ban_an_01.pdf", 1, 6)], "x", 6, 7) is None
+
+
+def test_full_match_needs_no_ai(tmp_path, index):
+    record(index, make_pdf(tmp_path / "old.pdf", PAGES), ANALYSIS)
+    same = make_pdf(tmp_path / "same.pdf", PAGES, title="chi khac metadata")
+
+    _, plan = prepare(same, index)
+    assert plan.tail_start is None and plan.known is None
+    assert len(plan.kept) == 3
+    reused = reused_analysis(plan, "ban_moi.pdf")
+    assert [(r["trang_bat_dau"], r["trang_ket_thuc"]) for r in reused] == [(1, 2), (3, 4), (5, 6)]
+    assert {r["ten_file_goc"] for r in reused} == {"ban_moi.pdf"}
+
+
+def test_documents_past_prefix_are_dropped():
+    # Trang 5 đã đổi: văn bản 5-6 không còn nằm trọn trong phần trùng
+    plan = make_plan(ANALYSIS, "x", 4, 8)
+    assert [r["ten_file_output"] for r in plan.kept] == ["Quyet_dinh_01.pdf"]
+    assert plan.known["ten_file_output"] == "Lenh_02.pdf"
+    assert plan.tail_start == 3
+
+
+# ===============================
+#  GHÉP KẾT QUẢ
+# ===============================
+def test_merge_shifts_tail_pages():
+    plan = make_plan(ANALYSIS, "x", 6, 9)
+    # AI đánh số theo file đính kèm: trang 1 của phần cuối là trang 5 của file đầy đủ
+    tail = [item("Cao_trang_03.pdf", 1, 3, "tail.pdf"), item("Ban_an_04.pdf", 4, 5, "tail.pdf")]
+
+    merged = merge(plan, tail, "ho_so_moi.pdf")
+    assert [(r["ten_file_output"], r["trang_bat_dau"], r["trang_ket_thuc"]) for r in merged] == [
+        ("Quyet_dinh_01.pdf", 1, 2),
+        ("Lenh_02.pdf", 3, 4),
+        ("Cao_trang_03.pdf", 5, 7),
+        ("Ban_an_04.pdf", 8, 9),
+    ]
+    assert {r["ten_file_goc"] for r in merged} == {"ho_so_moi.pdf"}
+    assert tail[0]["trang_bat_dau"] == 1
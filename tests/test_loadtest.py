@@ -0,0 +1,32 @@
+"""
+Kiểm thử loadtest.py: mỗi upload của load test phải thật sự tới AI
+
+Nếu các file upload chỉ khác nhau ngoài nội dung trang, chỉ mục (incremental)
+sẽ dùng lại kết quả của upload đầu và load test chỉ còn đo tra cứu SQLite.
+"""
+
+import pytest
+
+pytest.importorskip("fitz")
+pytest.importorskip("requests")
+
+from doc_index import DocumentIndex
+from incremental import page_hashes, prepare
+from loadtest import fake_analysis, unique_bundles
+
+
+def test_unique_bundles_are_never_reused(tmp_path):
+    index = DocumentIndex(str(tmp_path / "index.db"))
+    paths = []
+    for i, data in enumerate(unique_bundles(6, 3)):
+        path = tmp_path / f"bundle_{i}.pdf"
+        path.write_bytes(data)
+        paths.append(str(path))
+
+    first = paths[0]
+    index.record(first, fake_analysis(6, 3), page_hashes=page_hashes(first))
+    for path in paths[1:]:
+        hashes, plan = prepare(path, index)
+        assert len(hashes) == 6
+        assert plan is None
+        assert index.find_prefix(hashes) is None
@@ -0,0 +1,124 @@
+"""
+Kiểm thử model_router.py: nâng model khi phản hồi không hợp lệ và thống kê theo tuyến
+
+generate giả trả lời theo từng model, không gọi mạng. Mỗi kịch bản chạy với cả
+analyze và analyze_async (cùng logic _escalation).
+"""
+
+import json
+import asyncio
+
+import pytest
+
+from model_router import AnalysisValidationError, DocumentProfile, ModelRouter, RouteStats
+
+TIERS = [("fast", "m-fast"), ("default", "m-default"), ("strong", "m-strong")]
+SHORT_TEXT = DocumentProfile(page_count=5, sampled_pages=5, text_pages=5)   # -> fast
+LONG_SCAN = DocumentProfile(page_count=200, sampled_pages=30, text_pages=0)  # -> strong
+VALID = json.dumps([{"ten_file_goc": "a.pdf", "ten_file_output": "Lenh_01.pdf", "trang_bat_dau": 1,
+                     "trang_ket_thuc": 5, "nam_van_ban": 2024}])
+
+
+def make_generate(replies, calls):
+    """replies: {model: text hoặc Exception}"""
+    def generate(model):
+        calls.append(model)
+        reply = replies[model]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+    return generate
+
+
+def run_analyze(mode, router, generate, profile):
+    if mode == "sync":
+        return router.analyze(generate, profile, {"a.pdf": 5})
+
+    async def agenerate(model):
+        await asyncio.sleep(0)
+        return generate(model)
+    return asyncio.run(router.analyze_async(agenerate, profile, {"a.pdf": 5}))
+
+
+def counts(snapshot):
+    """Các bộ đếm (bỏ thời gian, vốn phụ thuộc máy)"""
+    keys = ("jobs", "escalation_rate", "escalations", "failed_jobs", "calls", "failed_calls")
+    return {route: {key: stats[key] for key in keys} for route, stats in snapshot.items()}
+
+
+@pytest.fixture(params=["sync", "async"])
+def mode(request):
+    return request.param
+
+
+@pytest.fixture
+def router():
+    return ModelRouter(TIERS, RouteStats())
+
+
+def test_valid_on_first_tier(mode, router):
+    calls = []
+    generate = make_generate({"m-fast": VALID}, calls)
+    data, model = run_analyze(mode, router, generate, SHORT_TEXT)
+
+    assert model == "m-fast" and calls == ["m-fast"]
+    assert data[0]["ten_file_output"] == "Lenh_01.pdf"
+    assert counts(router.stats.snapshot()) == {
+        "fast": {"jobs": 1, "escalation_rate": 0.0, "escalations": 0, "failed_jobs": 0,
+                 "calls": 1, "failed_calls": 0},
+    }
+
+
+def test_invalid_json_escalates_to_next_tier(mode, router):
+    calls = []
+    generate = make_generate({"m-fast": '[{"ten_file_goc": "a.pdf",', "m-default": VALID}, calls)
+    data, model = run_analyze(mode, router, generate, SHORT_TEXT)
+
+    assert model == "m-default" and calls == ["m-fast", "m-default"]
+    # Job tính cho tuyến ban đầu; mỗi lần gọi tính cho tuyến thực sự được gọi
+    assert counts(router.stats.snapshot()) == {
+        "fast": {"jobs": 1, "escalation_rate": 1.0, "escalations": 1, "failed_jobs": 0,
+                 "calls": 1, "failed_calls": 0},
+        "default": {"jobs": 0, "escalation_rate": 0.0, "escalations": 0, "failed_jobs": 0,
+                    "calls": 1, "failed_calls": 0},
+    }
+
+
+def test_last_tier_invalid_raises_validation_error(mode, router):
+    calls = []
+    out_of_range = VALID.replace('"trang_ket_thuc": 5', '"trang_ket_thuc": 9')
+    generate = make_generate({"m-fast": "không phải JSON", "m-default": "[]", "m-strong": out_of_range}, calls)
+
+    with pytest.raises(AnalysisValidationError, match="Trang vượt quá 5"):
+        run_analyze(mode, router, generate, SHORT_TEXT)
+    assert calls == ["m-fast", "m-default", "m-strong"]
+    snapshot = counts(router.stats.snapshot())
+    assert snapshot["fast"] == {"jobs": 1, "escalation_rate": 1.0, "escalations": 2, "failed_jobs": 1,
+                                "calls": 1, "failed_calls": 0}
+    assert snapshot["default"]["calls"] == 1 and snapshot["strong"]["calls"] == 1
+    assert snapshot["default"]["jobs"] == 0 and snapshot["strong"]["jobs"] == 0
+
+
+def test_api_error_propagates_unchanged(mode, router):
+    calls = []
+    quota = RuntimeError("429 RESOURCE_EXHAUSTED")
+    generate = make_generate({"m-fast": "không phải JSON", "m-default": quota}, calls)
+
+    with pytest.raises(RuntimeError) as raised:
+        run_analyze(mode, router, generate, SHORT_TEXT)
+    assert raised.value is quota
+    assert calls == ["m-fast", "m-default"]  # Lỗi API không làm nâng tiếp lên strong
+    assert counts(router.stats.snapshot()) == {
+        "fast": {"jobs": 1, "escalation_rate": 1.0, "escalations": 1, "failed_jobs": 1,
+                 "calls": 1, "failed_calls": 0},
+        "default": {"jobs": 0, "escalation_rate": 0.0, "escalations": 0, "failed_jobs": 0,
+                    "calls": 1, "failed_calls": 1},
+    }
+
+
+def test_long_scan_starts_on_strong_tier(mode, router):
+    calls = []
+    generate = make_generate({"m-strong": VALID}, calls)
+    _, model = run_analyze(mode, router, generate, LONG_SCAN)
+    assert model == "m-strong" and calls == ["m-strong"]
+    assert list(router.stats.snapshot()) == ["strong"]
@@ -0,0 +1,94 @@
+"""
+Kiểm thử page_cache.py: dựng, kiểm tra lại và dọn cache trang
+"""
+
+import os
+import struct
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+import page_cache
+from page_cache import build, is_valid, open_cache, prune
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    doc = fitz.open()
+    for i in range(3):
+        doc.new_page(width=300, height=400).insert_text((40, 60), f"QUYET DINH so {i + 1}")
+    path = str(tmp_path / "ho_so.pdf")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def test_thumbnails_are_optional(tmp_path, pdf):
+    cache_dir = str(tmp_path / "cache")
+    path = build(pdf, cache_dir=cache_dir, thumbnails=False)
+    with open_cache(pdf, cache_dir=cache_dir) as cache:
+        assert not cache.has_thumbnails and cache.thumbnail(0) == b""
+        assert "QUYET DINH so 2" in cache.text(1)
+
+    # Cần ảnh nhỏ thì cache cũ (không có ảnh) được dựng lại
+    assert not is_valid(path, thumbnails=True)
+    build(pdf, cache_dir=cache_dir, thumbnails=True)
+    with open_cache(pdf, cache_dir=cache_dir) as cache:
+        assert cache.thumbnail(0).startswith(b"\xff\xd8")
+
+
+def test_corrupt_or_old_cache_is_rebuilt(tmp_path, pdf):
+    cache_dir = str(tmp_path / "cache")
+    path = build(pdf, cache_dir=cache_dir)
+
+    with open(path, "r+b") as f:
+        f.truncate(100)
+    assert not is_valid(path)
+    with open_cache(pdf, cache_dir=cache_dir) as cache:
+        assert cache.page_count == 3
+
+    with open(path, "r+b") as f:
+        f.seek(4)
+        f.write(struct.pack("<I", page_cache.VERSION + 1))
+    assert open_cache(pdf, cache_dir=cache_dir, build_missing=False) is None
+    with open_cache(pdf, cache_dir=cache_dir) as cache:
+        assert cache.page_count == 3
+
+
+def test_workers_are_capped(monkeypatch, pdf):
+    seen = {}
+
+    class Pool:
+        def __init__(self, max_workers, mp_context):
+            seen["workers"] = max_workers
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            pass
+
+        def map(self, func, *iterables):
+            return map(func, *iterables)
+
+    monkeypatch.setattr(page_cache, "ProcessPoolExecutor", Pool)
+    monkeypatch.setattr(page_cache, "INLINE_PAGE_LIMIT", 0)
+    monkeypatch.setattr(page_cache, "PAGES_PER_TASK", 1)
+    monkeypatch.setattr(page_cache, "PAGE_CACHE_WORKERS", 2)
+    features = page_cache._extract_all(pdf, 3, workers=64)
+    assert seen["workers"] == 2 and sorted(features) == [0, 1, 2]
+
+
+def test_prune_removes_old_then_oldest(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    now = 1_000_000_000
+    for name, age_days in (("a", 200), ("b", 10), ("c", 1)):
+        path = cache_dir / f"{name}.pgc"
+        path.write_bytes(b"x" * 1024 * 1024)
+        os.utime(path, (now - age_days * 86400,) * 2)
+    monkeypatch.setattr(page_cache.time, "time", lambda: now)
+    assert prune(str(cache_dir), max_age_days=90, max_mb=0) == (1, 2 * 1024 * 1024)
+    assert prune(str(cache_dir), max_age_days=0, max_mb=1) == (1, 1024 * 1024)
+    assert sorted(os.listdir(cache_dir)) == ["c.pgc"]
@@ -0,0 +1,179 @@
+"""
+Kiểm thử máy trạng thái lease của spool.py (spool thư mục và SQLite)
+
+Đồng hồ được thay bằng một biến trong test: lease "hết hạn" mà không phải chờ.
+"""
+
+import os
+
+import pytest
+
+pytest.importorskip("fitz")
+
+import spool
+from spool import DirectorySpool, SQLiteSpool
+
+LEASE = 60
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(spool, "now_ts", clock)
+    return clock
+
+
+@pytest.fixture(params=["directory", "sqlite"])
+def make_spool(request, tmp_path, clock):
+    def make(max_attempts=3):
+        if request.param == "directory":
+            return DirectorySpool(str(tmp_path / "spool"), max_attempts)
+        return SQLiteSpool(str(tmp_path / "spool.db"), max_attempts)
+    return make
+
+
+def submit_one(s, job_id="a"):
+    assert s.submit([{"id": job_id, "source": f"/ho_so/{job_id}.pdf", "name": f"{job_id}.pdf",
+                      "output_dir": f"/ket_qua/{job_id}"}]) == 1
+
+
+def counts(s):
+    return {state: n for state, n in s.status()[0].items() if n}
+
+
+# ===============================
+#  LEASE
+# ===============================
+def test_expired_lease_is_reclaimed(make_spool, clock):
+    s = make_spool()
+    submit_one(s)
+    job = s.claim("w1", LEASE)
+    assert job["id"] == "a" and job["attempts"] == 1
+    assert s.claim("w2", LEASE) is None  # Lease còn hạn
+
+    clock.advance(LEASE + 1)
+    job = s.claim("w2", LEASE)
+    assert job["id"] == "a" and job["attempts"] == 2
+    assert counts(s) == {"leased": 1}
+
+
+def test_stale_owner_cannot_finish(make_spool, clock):
+    s = make_spool()
+    submit_one(s)
+    s.claim("w1", LEASE)
+    clock.advance(LEASE + 1)
+    s.claim("w2", LEASE)
+
+    assert s.renew("a", "w1", LEASE) is False
+    assert s.complete("a", "w1", {"total_split": 1}) is False
+    assert s.fail("a", "w1", "lỗi") is False
+    assert counts(s) == {"leased": 1}
+
+    assert s.complete("a", "w2", {"total_split": 1}) is True
+    assert counts(s) == {"done": 1}
+
+
+def test_fails_after_max_attempts(make_spool, clock):
+    s = make_spool(max_attempts=2)
+    submit_one(s)
+    s.claim("w1", LEASE)
+    assert s.fail("a", "w1", "lỗi lần 1") is True
+    assert counts(s) == {"pending": 1}
+
+    s.claim("w2", LEASE)
+    clock.advance(LEASE + 1)  # w2 chết giữa chừng
+    assert s.claim("w3", LEASE) is None
+    assert counts(s) == {"failed": 1}
+    failed = s.status()[1]
+    assert failed[0]["source"] == "/ho_so/a.pdf" and failed[0]["error"] == "lỗi lần 1"
+
+
+def test_fail_on_last_attempt_marks_failed(make_spool):
+    s = make_spool(max_attempts=1)
+    submit_one(s)
+    s.claim("w1", LEASE)
+    assert s.fail("a", "w1", "hỏng") is True
+    assert counts(s) == {"failed": 1}
+
+
+def test_requeue_failed(make_spool):
+    s = make_spool(max_attempts=1)
+    submit_one(s)
+    s.claim("w1", LEASE)
+    s.fail("a", "w1", "hỏng")
+
+    assert s.requeue_failed() == 1
+    assert counts(s) == {"pending": 1}
+    job = s.claim("w2", LEASE)
+    assert job["attempts"] == 1
+    assert s.complete("a", "w2", {"total_split": 2}) is True
+    assert counts(s) == {"done": 1}
+
+
+def test_complete_after_reap_race_returns_false(tmp_path, clock, monkeypatch):
+    # Worker chậm: lease bị thu hồi ngay sau khi complete đã tìm thấy token
+    s = DirectorySpool(str(tmp_path / "spool"))
+    submit_one(s)
+    s.claim("w1", LEASE)
+    find_token = s._token
+
+    def token_then_reap(job_id, owner):
+        token = find_token(job_id, owner)
+        clock.advance(LEASE + 1)
+        s._reap_expired(LEASE)
+        return token
+
+    monkeypatch.setattr(s, "_token", token_then_reap)
+    assert s.complete("a", "w1", {"total_split": 1}) is False
+    assert counts(s) == {"pending": 1}
+    assert os.listdir(os.path.join(s.path, "leased")) == []
+
+
+# ===============================
+#  WORKER
+# ===============================
+def test_process_job_reports_split_errors(tmp_path, monkeypatch):
+    import doc_index
+
+    source = tmp_path / "a.pdf"
+    source.write_bytes(b"%PDF-1.4")
+    analysis = [{"ten_file_goc": "a.pdf", "ten_file_output": "A_1.pdf", "trang_bat_dau": 1,
+                 "trang_ket_thuc": 1, "nam_van_ban": 2024}]
+    monkeypatch.setattr(doc_index, "lookup_safely", lambda **kwargs: analysis)
+    monkeypatch.setattr(spool, "split_pdf", lambda *args, **kwargs: (0, ["❌ Lỗi: không mở được file"]))
+
+    job = {"source": str(source), "name": "a.pdf", "output_dir": str(tmp_path / "out")}
+    error, result = spool.process_job(job, "key")
+    assert error == "❌ Lỗi: không mở được file" and result is None
+
+
+def test_work_loop_survives_spool_errors(monkeypatch):
+    monkeypatch.setattr(spool, "log", lambda owner, message: None)
+
+    class FlakySpool:
+        def __init__(self):
+            self.claims = 0
+
+        def claim(self, owner, lease_seconds):
+            self.claims += 1
+            if self.claims == 1:
+                raise OSError("database is locked")
+            return None
+
+        def status(self):
+            return {}, []
+
+    flaky = FlakySpool()
+    assert spool.work_loop(flaky, "key", "w1", poll_seconds=0, exit_when_empty=True) == 0
+    assert flaky.claims == 2
@@ -0,0 +1,45 @@
+"""
+Kiểm thử web_common.py: dọn kết quả cũ trong thư mục tạm
+"""
+
+import os
+import time
+
+import web_common
+from web_common import new_session_id, sweep_due, sweep_expired
+
+
+def test_sweep_removes_only_expired_sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(web_common, "UPLOAD_FOLDER", str(tmp_path))
+    old, fresh = "20200101_000000_deadbeef", new_session_id()
+    for session_id in (old, fresh):
+        (tmp_path / f"upload_{session_id}").mkdir()
+        (tmp_path / f"output_{session_id}").mkdir()
+        (tmp_path / f"output_{session_id}" / "A_1.pdf").write_bytes(b"%PDF")
+        (tmp_path / f"result_{session_id}.zip").write_bytes(b"PK")
+    (tmp_path / "output_khac").mkdir()  # Không đúng dạng mã phiên: không đụng tới
+
+    two_days_ago = time.time() - 48 * 3600
+    for name in os.listdir(tmp_path):
+        if old in name or name == "output_khac":
+            os.utime(tmp_path / name, (two_days_ago, two_days_ago))
+
+    assert sweep_expired(ttl_hours=24) == 3
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [f"upload_{fresh}", f"output_{fresh}", f"result_{fresh}.zip", "output_khac"]
+    )
+    assert sweep_expired(ttl_hours=0) == 0
+
+
+def test_sweep_is_throttled(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(web_common.time, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(web_common, "_last_sweep", 0.0)
+    monkeypatch.setattr(web_common, "SWEEP_INTERVAL", 300)
+
+    assert sweep_due() is True
+    clock[0] += 299
+    assert sweep_due() is False
+    clock[0] += 2
+    assert sweep_due() is True
+    assert sweep_due() is False
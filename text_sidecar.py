@@ -0,0 +1,87 @@
+"""
+File JSONL chứa nội dung chữ của các văn bản đã tách
+
+Ghi cùng lượt tách (trên file gốc đang mở), để hệ thống tìm kiếm không phải
+mở lại từng file output chỉ để lấy chữ. Mỗi dòng là một văn bản:
+
+{"file_output": "Cao_trang_79-CT-VKS_2024.pdf", "ten_file_goc": ..., "ten_file_output": ...,
+ "loai_van_ban": "Cao_trang", "so_hieu": "79-CT-VKS", "nam_van_ban": 2024,
+ "trang_bat_dau": 3, "trang_ket_thuc": 7,
+ "trang": [{"trang_goc": 3, "trang_van_ban": 1, "noi_dung": "..."}, ...]}
+"""
+
+import os
+import json
+
+from doc_index import split_document_name
+
+SIDECAR_NAME = "van_ban.jsonl"
+
+
+class TextSidecar:
+    """Ghi từng văn bản khi tách, đọc chữ mỗi trang gốc đúng một lần"""
+
+    def __init__(self, doc, output_dir, name=SIDECAR_NAME, page_cache=None):
+        self.doc = doc
+        self.page_cache = page_cache
+        self.path = os.path.join(output_dir, name)
+        self._texts = {}
+        self._file = open(self.path, "w", encoding="utf-8")
+
+    def page_text(self, index):
+        """Chữ của trang gốc (đánh số từ 0), có cache cho các văn bản chồng trang"""
+        if index not in self._texts:
+            if self.page_cache is not None:
+                self._texts[index] = self.page_cache.text(index)
+            else:
+                self._texts[index] = self.doc[index].get_text("text")
+        return self._texts[index]
+
+    def add(self, rule, output_filename):
+        start, end = rule["trang_bat_dau"], rule["trang_ket_thuc"]
+        ten_file_output = rule.get("ten_file_output", output_filename)
+        loai, so_hieu = split_document_name(ten_file_output)
+        record = {
+            "file_output": output_filename,
+            "ten_file_goc": rule.get("ten_file_goc"),
+            "ten_file_output": ten_file_output,
+            "loai_van_ban": loai,
+            "so_hieu": so_hieu,
+            "nam_van_ban": rule.get("nam_van_ban"),
+            "trang_bat_dau": start,
+            "trang_ket_thuc": end,
+            "trang": [
+                {"trang_goc": page, "trang_van_ban": page - start + 1, "noi_dung": self.page_text(page - 1)}
+                for page in range(start, end + 1)
+            ],
+        }
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NullSidecar:
+    """Dùng khi không bật sidecar, để vòng tách không phải rẽ nhánh"""
+
+    def add(self, rule, output_filename):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def open_sidecar(doc, output_dir, enabled, page_cache=None):
+    return TextSidecar(doc, output_dir, page_cache=page_cache) if enabled else NullSidecar()
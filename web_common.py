@@ -0,0 +1,158 @@
+"""
+Phần dùng chung của webapp.py (Flask) và webapp_async.py (Quart)
+
+Cấu hình, đọc form, đặt tên phiên, đường dẫn kết quả. Không import Flask hay
+Quart: request chỉ cần có .headers, nên bản ASGI không phải dựng app Flask
+chỉ để dùng lại các hàm này.
+"""
+
+import os
+import re
+import time
+import uuid
+import shutil
+import zipfile
+import datetime
+import tempfile
+import threading
+from urllib.parse import quote
+
+from image_recompress import OUTPUT_PROFILES
+from pdf_core import output_filename
+
+# ===============================
+#  CẤU HÌNH
+# ===============================
+UPLOAD_FOLDER = tempfile.gettempdir()
+TEXT_SIDECAR_DEFAULT = os.environ.get('TEXT_SIDECAR', '').lower() in ('1', 'true', 'yes')
+# Recompress scanned page images on split: gray / bilevel / color (empty = off)
+IMAGE_PROFILE_DEFAULT = os.environ.get('IMAGE_PROFILE', '').lower()
+# Save split outputs linearized ("fast web view") for /view streaming
+LINEARIZE_DEFAULT = os.environ.get('LINEARIZE_OUTPUTS', '').lower() in ('1', 'true', 'yes')
+PROFILE_JOBS = os.environ.get('PROFILE_JOBS', '').lower() in ('1', 'true', 'yes')
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+ALLOWED_EXTENSIONS = {'pdf'}
+# Kết quả (output_<mã phiên>, result_<mã phiên>.zip) được giữ bao lâu; 0 = không xoá
+RESULT_TTL_HOURS = float(os.environ.get('RESULT_TTL_HOURS', 24))
+# Quét thư mục tạm nhiều nhất một lần mỗi SWEEP_INTERVAL giây (mỗi process)
+SWEEP_INTERVAL = float(os.environ.get('SWEEP_INTERVAL', 300))
+
+SESSION_ID_RE = re.compile(r"^\d{8}_\d{6}_[0-9a-f]{8}$")
+SESSION_ENTRY_RE = re.compile(r"^(upload|output|result)_(\d{8}_\d{6}_[0-9a-f]{8})(\.zip)?$")
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def form_flag(value, default=False):
+    """'1' / 'true' / 'on' từ form -> True"""
+    if value is None:
+        return default
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def new_session_id():
+    """Mã phiên duy nhất, kể cả khi nhiều request đến trong cùng một giây"""
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{timestamp}_{uuid.uuid4().hex[:8]}"
+
+
+def image_profile_from(value):
+    """Image profile name from a form field, falling back to IMAGE_PROFILE"""
+    value = (value if value is not None else IMAGE_PROFILE_DEFAULT).strip().lower()
+    return value if value in OUTPUT_PROFILES else None
+
+
+def output_documents(session_id, output_dir, analysis):
+    """Các văn bản đã tách (theo thứ tự phân tích) kèm link xem trực tiếp"""
+    documents = []
+    for item in analysis or []:
+        name = output_filename(item)
+        if os.path.exists(os.path.join(output_dir, name)) and name not in [d['name'] for d in documents]:
+            documents.append({'name': name, 'url': f"/view/{session_id}/{quote(name)}"})
+    return documents
+
+
+def document_path(session_id, name):
+    """Đường dẫn một văn bản đã tách, None nếu không có"""
+    # Tên output giữ chữ có dấu nên không qua secure_filename: chỉ chặn đường dẫn
+    if not SESSION_ID_RE.match(session_id or '') or name != os.path.basename(name) \
+            or name.startswith('.') or '\\' in name or not name.lower().endswith('.pdf'):
+        return None
+    path = os.path.join(UPLOAD_FOLDER, f"output_{session_id}", name)
+    return path if os.path.isfile(path) else None
+
+
+_last_sweep = 0.0
+_sweep_lock = threading.Lock()
+
+
+def sweep_due():
+    """Đã đến lượt quét chưa (mỗi SWEEP_INTERVAL giây); True thì ghi nhận lượt quét này
+
+    Gọi ở mỗi request, kể cả các request Range của /view: phần lớn lần gọi chỉ
+    so sánh một mốc thời gian, không listdir thư mục tạm.
+    """
+    global _last_sweep
+    now = time.monotonic()
+    with _sweep_lock:
+        if _last_sweep and now - _last_sweep < SWEEP_INTERVAL:
+            return False
+        _last_sweep = now
+        return True
+
+
+def maybe_sweep_expired():
+    """sweep_expired nếu đã đến lượt quét"""
+    return sweep_expired() if sweep_due() else 0
+
+
+def sweep_expired(ttl_hours=None, now=None):
+    """Xoá upload_* / output_* / result_*.zip quá ttl_hours (mặc định RESULT_TTL_HOURS).
+
+    Chỉ đụng đến tên đúng dạng mã phiên trong UPLOAD_FOLDER. Trả về số mục đã xoá.
+    """
+    ttl_hours = RESULT_TTL_HOURS if ttl_hours is None else ttl_hours
+    if ttl_hours <= 0:
+        return 0
+    cutoff = (now or time.time()) - ttl_hours * 3600
+    removed = 0
+    try:
+        names = os.listdir(UPLOAD_FOLDER)
+    except OSError:
+        return 0
+    for name in names:
+        if not SESSION_ENTRY_RE.match(name):
+            continue
+        path = os.path.join(UPLOAD_FOLDER, name)
+        try:
+            if os.stat(path).st_mtime > cutoff:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            continue  # Request khác vừa xoá, hoặc không có quyền
+        removed += 1
+    return removed
+
+
+def make_zip(output_dir, zip_path):
+    """Nén toàn bộ file trong output_dir"""
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        for root, dirs, files in os.walk(output_dir):
+            for fname in files:
+                fpath = os.path.join(root, fname)
+                zf.write(fpath, fname)
+
+
+def is_admin(req):
+    """Admin features are off unless ADMIN_TOKEN is set and matches X-Admin-Token"""
+    return bool(ADMIN_TOKEN) and req.headers.get('X-Admin-Token', '') == ADMIN_TOKEN
+
+
+def profiling_requested(req):
+    """Profile this job? PROFILE_JOBS=1 for all jobs, or X-Profile: 1 from an admin"""
+    return PROFILE_JOBS or (form_flag(req.headers.get('X-Profile')) and is_admin(req))
@@ -4,31 +4,27 @@ Simple version for deployment
 """
 
 import os
-import sys
 import json
-import datetime
-import zipfile
-import tempfile
 import shutil
-from collections import defaultdict
 from flask import Flask, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
 
-# ===============================
-#  IMPORTS
-# ===============================
-try:
-    import fitz
-    FITZ_AVAILABLE = True
-except ImportError:
-    FITZ_AVAILABLE = False
+from model_router import router
+from doc_index import file_hash, lookup_safely, record_safely
+from incremental import prepare as prepare_reuse
+from profiling import maybe_profile, list_profiles, PROFILES_DIR
+# Analysis and splitting live in pdf_core; fitz / genai load on first use
+from pdf_core import FITZ_AVAILABLE, GOOGLE_AI_AVAILABLE, analyze_pdf, split_pdf
+# Config and request helpers shared with webapp_async (no Flask import there)
+from web_common import (
+    UPLOAD_FOLDER, TEXT_SIDECAR_DEFAULT, IMAGE_PROFILE_DEFAULT, LINEARIZE_DEFAULT,
+    allowed_file, form_flag, image_profile_from, new_session_id, is_admin, profiling_requested, make_zip,
+    output_documents, document_path, maybe_sweep_expired,
+)
+
+if not FITZ_AVAILABLE:
     print("Warning: PyMuPDF not available")
-
-try:
-    from google import genai
-    GOOGLE_AI_AVAILABLE = True
-except ImportError:
-    GOOGLE_AI_AVAILABLE = False
+if not GOOGLE_AI_AVAILABLE:
     print("Warning: google-genai not available")
 
 # ===============================
@@ -38,112 +34,11 @@ app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'pdf-splitter-2024')
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max for free tier
 
-UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'pdf'}
-GEMINI_MODEL = "gemini-2.5-flash"
-
-AI_PROMPT = """
-Phân tích file PDF này chứa nhiều văn bản tố tụng hình sự.
-
-Xác định CHÍNH XÁC:
-- Ranh giới từng văn bản (trang bắt đầu, trang kết thúc)
-- Loại văn bản (Quyết định, Lệnh, Cáo trạng, Bản án...)
-- Số hiệu và năm văn bản
 
-Tên file: {filename}
-
-Trả về JSON array:
-[
-  {{"ten_file_goc": "{filename}", "ten_file_output": "Loai_So.pdf", "trang_bat_dau": 1, "trang_ket_thuc": 2, "nam_van_ban": 2024}}
-]
-
-CHỈ TRẢ VỀ JSON, KHÔNG GIẢI THÍCH.
-"""
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-
-def analyze_pdf(api_key, filename, file_path):
-    """Analyze PDF with Google Gemini"""
-    if not GOOGLE_AI_AVAILABLE:
-        return "Google AI chưa được cài đặt", None
-    
-    try:
-        client = genai.Client(api_key=api_key)
-        
-        with open(file_path, 'rb') as f:
-            pdf_bytes = f.read()
-        
-        pdf_part = genai.types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf")
-        prompt = AI_PROMPT.format(filename=filename)
-        
-        response = client.models.generate_content(
-            model=GEMINI_MODEL,
-            contents=[prompt, pdf_part]
-        )
-        
-        text = response.text.strip()
-        if "```json" in text:
-            text = text.split("```json")[1].split("```")[0]
-        elif "```" in text:
-            text = text.split("```")[1].split("```")[0]
-        
-        data = json.loads(text.strip())
-        
-        if not isinstance(data, list) or len(data) == 0:
-            return "AI không tìm thấy văn bản nào", None
-            
-        return None, data
-        
-    except json.JSONDecodeError as e:
-        return f"Lỗi phân tích JSON: {e}", None
-    except Exception as e:
-        error_msg = str(e)
-        if "429" in error_msg or "quota" in error_msg.lower():
-            return "Quota API đã hết. Đợi 1 phút hoặc tạo key mới.", None
-        return f"Lỗi: {error_msg}", None
-
-
-def split_pdf(file_path, analysis_data, output_dir):
-    """Split PDF based on analysis"""
-    if not FITZ_AVAILABLE:
-        return 0, ["PyMuPDF chưa được cài đặt"]
-    
-    results = []
-    success = 0
-    
-    try:
-        doc = fitz.open(file_path)
-        page_count = doc.page_count
-        
-        for item in analysis_data:
-            start = item.get("trang_bat_dau", 0)
-            end = item.get("trang_ket_thuc", 0)
-            
-            if not (1 <= start <= end <= page_count):
-                results.append(f"❌ Trang không hợp lệ: {start}-{end}")
-                continue
-            
-            name = item.get("ten_file_output", "output.pdf").replace(".pdf", "")
-            year = item.get("nam_van_ban", "")
-            output_name = f"{name}_{year}.pdf" if year else f"{name}.pdf"
-            output_name = "".join(c for c in output_name if c.isalnum() or c in "._- ")
-            
-            output_path = os.path.join(output_dir, output_name)
-            new_doc = fitz.open()
-            new_doc.insert_pdf(doc, from_page=start-1, to_page=end-1)
-            new_doc.save(output_path)
-            new_doc.close()
-            
-            success += 1
-            results.append(f"✅ {output_name} (Trang {start}-{end})")
-        
-        doc.close()
-    except Exception as e:
-        results.append(f"❌ Lỗi: {e}")
-    
-    return success, results
+@app.before_request
+def cleanup_expired():
+    # Kết quả quá RESULT_TTL_HOURS bị xoá, kể cả thư mục của request lỗi giữa chừng
+    maybe_sweep_expired()
 
 
 # ===============================
@@ -151,7 +46,8 @@ def split_pdf(file_path, analysis_data, output_dir):
 # ===============================
 @app.route('/')
 def index():
-    return render_template('index.html')
+    return render_template('index.html', text_sidecar_default=TEXT_SIDECAR_DEFAULT,
+                           image_profile_default=IMAGE_PROFILE_DEFAULT, linearize_default=LINEARIZE_DEFAULT)
 
 
 @app.route('/health')
@@ -159,12 +55,15 @@ def health():
     return jsonify({
         'status': 'ok',
         'fitz': FITZ_AVAILABLE,
-        'google_ai': GOOGLE_AI_AVAILABLE
+        'google_ai': GOOGLE_AI_AVAILABLE,
+        'routing': router.stats.snapshot()
     })
 
 
 @app.route('/upload', methods=['POST'])
 def upload():
+    upload_dir = output_dir = None
+    keep_output = False
     try:
         if 'files[]' not in request.files:
             return jsonify({'error': 'Không có file'}), 400
@@ -178,7 +77,7 @@ def upload():
             return jsonify({'error': 'File không hợp lệ'}), 400
         
         # Create temp directories
-        session_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        session_id = new_session_id()
         upload_dir = os.path.join(UPLOAD_FOLDER, f"upload_{session_id}")
         output_dir = os.path.join(UPLOAD_FOLDER, f"output_{session_id}")
         os.makedirs(upload_dir, exist_ok=True)
@@ -189,31 +88,43 @@ def upload():
         file_path = os.path.join(upload_dir, filename)
         file.save(file_path)
         
-        # Analyze with AI
-        error, analysis = analyze_pdf(api_key, filename, file_path)
-        if error:
-            shutil.rmtree(upload_dir, ignore_errors=True)
-            shutil.rmtree(output_dir, ignore_errors=True)
-            return jsonify({'error': error}), 400
-        
-        # Split PDF
-        success, results = split_pdf(file_path, analysis, output_dir)
-        
-        # Save analysis
-        with open(os.path.join(output_dir, "analysis.json"), "w", encoding="utf-8") as f:
-            json.dump(analysis, f, ensure_ascii=False, indent=2)
-        
-        # Create ZIP
-        zip_path = os.path.join(UPLOAD_FOLDER, f"result_{session_id}.zip")
-        with zipfile.ZipFile(zip_path, 'w') as zf:
-            for root, dirs, files in os.walk(output_dir):
-                for fname in files:
-                    fpath = os.path.join(root, fname)
-                    zf.write(fpath, fname)
-        
-        # Cleanup
-        shutil.rmtree(upload_dir, ignore_errors=True)
-        shutil.rmtree(output_dir, ignore_errors=True)
+        # Analyze + split, profiled when requested (X-Profile header / PROFILE_JOBS)
+        profiled = profiling_requested(request)
+        with maybe_profile(session_id, profiled, label=filename):
+            # Reuse a previous analysis of the same file, otherwise analyze with AI.
+            # force (phân tích lại) skips the index and overwrites the stored result.
+            force = form_flag(request.form.get('force'))
+            source_hash = file_hash(file_path)
+            analysis = None if force else lookup_safely(source_hash=source_hash)
+            cached = analysis is not None
+            reused = 0
+            if not cached:
+                # A grown bundle reuses the unchanged prefix; only the tail goes to AI
+                page_hashes, plan = prepare_reuse(file_path, reuse=not force)
+                reused = len(plan.kept) if plan else 0
+                error, analysis = analyze_pdf(api_key, filename, file_path, plan=plan)
+                if error:
+                    return jsonify({'error': error}), 400
+                record_safely(file_path, analysis, source_hash=source_hash, page_hashes=page_hashes,
+                              store_path=False)
+        
+            # Split PDF
+            text_sidecar = form_flag(request.form.get('text_sidecar'), TEXT_SIDECAR_DEFAULT)
+            image_profile = image_profile_from(request.form.get('image_profile'))
+            linearize = form_flag(request.form.get('linearize'), LINEARIZE_DEFAULT)
+            success, results = split_pdf(file_path, analysis, output_dir, text_sidecar, image_profile,
+                                         linearize=linearize)
+        
+            # Save analysis
+            with open(os.path.join(output_dir, "analysis.json"), "w", encoding="utf-8") as f:
+                json.dump(analysis, f, ensure_ascii=False, indent=2)
+        
+            # Create ZIP
+            zip_path = os.path.join(UPLOAD_FOLDER, f"result_{session_id}.zip")
+            make_zip(output_dir, zip_path)
+        
+        # output_dir is kept, like the zip, so /view can serve single documents
+        keep_output = True
         
         return jsonify({
             'success': True,
@@ -221,12 +132,22 @@ def upload():
             'total_split': success,
             'analysis': analysis,
             'results': results,
-            'download_id': session_id
+            'cached': cached,
+            'reused_documents': reused,
+            'profile_id': session_id if profiled else None,
+            'download_id': session_id,
+            'documents': output_documents(session_id, output_dir, analysis)
         })
         
     except Exception as e:
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
+    finally:
+        # Cleanup
+        for path in (upload_dir, None if keep_output else output_dir):
+            if path:
+                shutil.rmtree(path, ignore_errors=True)
+
 
 @app.route('/download/<session_id>')
 def download(session_id):
@@ -236,6 +157,34 @@ def download(session_id):
     return send_file(zip_path, as_attachment=True, download_name=f"ket_qua_{session_id}.zip")
 
 
+@app.route('/view/<session_id>/<name>')
+def view_document(session_id, name):
+    """Một văn bản đã tách, mở thẳng trên trình duyệt; hỗ trợ HTTP Range để
+    trình xem PDF hiện trang đầu trước khi tải hết file"""
+    path = document_path(session_id, name)
+    if not path:
+        return jsonify({'error': 'File không tồn tại'}), 404
+    return send_file(path, mimetype='application/pdf', conditional=True, max_age=3600)
+
+
+@app.route('/admin/profiles')
+def admin_profiles():
+    if not is_admin(request):
+        return jsonify({'error': 'Not found'}), 404
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({'profiles': list_profiles(limit)})
+
+
+@app.route('/admin/profiles/<name>')
+def admin_profile_file(name):
+    if not is_admin(request):
+        return jsonify({'error': 'Not found'}), 404
+    path = os.path.join(PROFILES_DIR, secure_filename(name))
+    if not name.endswith(('.prof', '.txt')) or not os.path.exists(path):
+        return jsonify({'error': 'File không tồn tại'}), 404
+    return send_file(os.path.abspath(path), as_attachment=name.endswith('.prof'))
+
+
 # ===============================
 #  MAIN
 # ===============================
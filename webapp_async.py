@@ -0,0 +1,283 @@
+"""
+PDF Splitter - Web App (ASGI)
+Async version of webapp.py: the same routes, but each in-flight Gemini call
+only holds a coroutine instead of a whole gunicorn worker.
+
+Run:
+    uvicorn webapp_async:app --host 0.0.0.0 --port 8080
+or:
+    gunicorn webapp_async:app -k uvicorn.workers.UvicornWorker --workers 1 --timeout 300
+"""
+
+import os
+import json
+import asyncio
+import shutil
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, render_template, request, jsonify, send_file
+from werkzeug.utils import secure_filename
+
+from model_router import router, AnalysisValidationError
+from doc_index import file_hash, lookup_safely, record_safely
+from incremental import prepare as prepare_reuse, reused_analysis
+from profiling import maybe_profile, list_profiles, PROFILES_DIR
+from pdf_core import (
+    FITZ_AVAILABLE, GOOGLE_AI_AVAILABLE, AI_PROMPT,
+    make_genai_client, analysis_request, format_ai_error, split_pdf,
+)
+from web_common import (
+    UPLOAD_FOLDER, TEXT_SIDECAR_DEFAULT, IMAGE_PROFILE_DEFAULT, LINEARIZE_DEFAULT,
+    allowed_file, form_flag, image_profile_from, new_session_id, is_admin, profiling_requested, make_zip,
+    output_documents, document_path, sweep_due, sweep_expired,
+)
+
+# ===============================
+#  APP CONFIG
+# ===============================
+app = Quart(__name__)
+app.secret_key = os.environ.get('SECRET_KEY', 'pdf-splitter-2024')
+app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max for free tier
+
+# Số request AI đồng thời tối đa trong một process
+AI_CONCURRENCY = int(os.environ.get('AI_CONCURRENCY', 50))
+
+# PyMuPDF không an toàn khi chạy đồng thời trên nhiều luồng, nên mọi việc
+# fitz đi qua một luồng riêng: không chặn event loop, không tăng bộ nhớ.
+FITZ_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fitz")
+
+_ai_semaphore = None
+
+
+def ai_semaphore():
+    """Semaphore tạo lười để gắn đúng event loop của server"""
+    global _ai_semaphore
+    if _ai_semaphore is None:
+        _ai_semaphore = asyncio.Semaphore(AI_CONCURRENCY)
+    return _ai_semaphore
+
+
+async def run_in_fitz(func, *args):
+    """Chạy công việc CPU (fitz, zip) ngoài event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(FITZ_EXECUTOR, func, *args)
+
+
+def profiled_call(job_id, enabled, label, func, *args):
+    """Profile func trong luồng executor.
+
+    Ở chế độ async chỉ profile phần CPU (fitz) chạy trên executor: cProfile
+    trên event loop sẽ lẫn cả coroutine của các request khác.
+    """
+    with maybe_profile(job_id, enabled, label):
+        return func(*args)
+
+
+def _write_bytes(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+async def analyze_pdf_async(api_key, filename, file_path, pdf_bytes, plan=None):
+    """Analyze PDF with the async Gemini client, model chosen by model_router
+
+    With a reuse plan (incremental.prepare) only the tail pages are sent.
+    """
+    if plan is not None and plan.tail_start is None:
+        return None, reused_analysis(plan, filename)
+    if not GOOGLE_AI_AVAILABLE:
+        return "Google AI chưa được cài đặt", None
+
+    try:
+        client = make_genai_client(api_key)
+        contents, profile, page_counts, finish = await run_in_fitz(
+            analysis_request, filename, file_path, AI_PROMPT, plan, pdf_bytes
+        )
+
+        async def agenerate(model):
+            async with ai_semaphore():
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=contents
+                )
+            return response.text
+
+        data, _ = await router.analyze_async(agenerate, profile, page_counts)
+        return None, finish(data)
+
+    except AnalysisValidationError as e:
+        return str(e), None
+    except Exception as e:
+        return format_ai_error(e), None
+
+
+@app.before_request
+async def cleanup_expired():
+    # Kết quả quá RESULT_TTL_HOURS bị xoá, kể cả thư mục của request lỗi giữa chừng
+    if sweep_due():
+        await asyncio.to_thread(sweep_expired)
+
+
+# ===============================
+#  ROUTES
+# ===============================
+@app.route('/')
+async def index():
+    return await render_template(
+        'index.html', text_sidecar_default=TEXT_SIDECAR_DEFAULT, image_profile_default=IMAGE_PROFILE_DEFAULT,
+        linearize_default=LINEARIZE_DEFAULT
+    )
+
+
+@app.route('/health')
+async def health():
+    return jsonify({
+        'status': 'ok',
+        'fitz': FITZ_AVAILABLE,
+        'google_ai': GOOGLE_AI_AVAILABLE,
+        'mode': 'asgi',
+        'routing': router.stats.snapshot()
+    })
+
+
+@app.route('/upload', methods=['POST'])
+async def upload():
+    upload_dir = output_dir = None
+    keep_output = False
+    try:
+        files = await request.files
+        form = await request.form
+
+        if 'files[]' not in files:
+            return jsonify({'error': 'Không có file'}), 400
+
+        api_key = form.get('api_key', '').strip()
+        if not api_key:
+            return jsonify({'error': 'Cần API Key'}), 400
+
+        file = files.getlist('files[]')[0]
+        if not file or not allowed_file(file.filename):
+            return jsonify({'error': 'File không hợp lệ'}), 400
+
+        # Create temp directories
+        session_id = new_session_id()
+        upload_dir = os.path.join(UPLOAD_FOLDER, f"upload_{session_id}")
+        output_dir = os.path.join(UPLOAD_FOLDER, f"output_{session_id}")
+        os.makedirs(upload_dir, exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+        # Save file (upload đã nằm trong bộ nhớ, chỉ ghi đĩa ngoài event loop)
+        filename = secure_filename(file.filename)
+        file_path = os.path.join(upload_dir, filename)
+        pdf_bytes = file.stream.read()
+        await asyncio.to_thread(_write_bytes, file_path, pdf_bytes)
+
+        # Reuse a previous analysis of the same file, otherwise analyze with AI.
+        # force (phân tích lại) skips the index and overwrites the stored result.
+        force = form_flag(form.get('force'))
+        source_hash = await asyncio.to_thread(file_hash, file_path)
+        analysis = None if force else await asyncio.to_thread(lookup_safely, None, source_hash)
+        cached = analysis is not None
+        reused = 0
+        if not cached:
+            page_hashes, plan = await run_in_fitz(prepare_reuse, file_path, None, not force)
+            reused = len(plan.kept) if plan else 0
+            error, analysis = await analyze_pdf_async(api_key, filename, file_path, pdf_bytes, plan)
+            if error:
+                return jsonify({'error': error}), 400
+            await asyncio.to_thread(
+                record_safely, file_path, analysis, source_hash=source_hash, page_hashes=page_hashes,
+                store_path=False
+            )
+        del pdf_bytes
+
+        # Split PDF
+        text_sidecar = form_flag(form.get('text_sidecar'), TEXT_SIDECAR_DEFAULT)
+        image_profile = image_profile_from(form.get('image_profile'))
+        linearize = form_flag(form.get('linearize'), LINEARIZE_DEFAULT)
+        profiled = profiling_requested(request)
+        success, results = await run_in_fitz(
+            profiled_call, session_id, profiled, filename,
+            partial(split_pdf, linearize=linearize), file_path, analysis, output_dir, text_sidecar, image_profile
+        )
+
+        # Save analysis
+        await asyncio.to_thread(_write_json, os.path.join(output_dir, "analysis.json"), analysis)
+
+        # Create ZIP
+        zip_path = os.path.join(UPLOAD_FOLDER, f"result_{session_id}.zip")
+        await asyncio.to_thread(make_zip, output_dir, zip_path)
+        # output_dir is kept, like the zip, so /view can serve single documents
+        keep_output = True
+        documents = await asyncio.to_thread(output_documents, session_id, output_dir, analysis)
+
+        return jsonify({
+            'success': True,
+            'total_files': 1,
+            'total_split': success,
+            'analysis': analysis,
+            'results': results,
+            'cached': cached,
+            'reused_documents': reused,
+            'profile_id': session_id if profiled else None,
+            'download_id': session_id,
+            'documents': documents
+        })
+
+    except Exception as e:
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+    finally:
+        # Cleanup
+        for path in (upload_dir, None if keep_output else output_dir):
+            if path:
+                await asyncio.to_thread(shutil.rmtree, path, True)
+
+
+@app.route('/download/<session_id>')
+async def download(session_id):
+    zip_path = os.path.join(UPLOAD_FOLDER, f"result_{session_id}.zip")
+    if not await asyncio.to_thread(os.path.exists, zip_path):
+        return jsonify({'error': 'File không tồn tại'}), 404
+    return await send_file(zip_path, as_attachment=True, download_name=f"ket_qua_{session_id}.zip")
+
+
+@app.route('/view/<session_id>/<name>')
+async def view_document(session_id, name):
+    """Một văn bản đã tách, mở thẳng trên trình duyệt; hỗ trợ HTTP Range"""
+    path = await asyncio.to_thread(document_path, session_id, name)
+    if not path:
+        return jsonify({'error': 'File không tồn tại'}), 404
+    return await send_file(path, mimetype='application/pdf', conditional=True, max_age=3600)
+
+
+@app.route('/admin/profiles')
+async def admin_profiles():
+    if not is_admin(request):
+        return jsonify({'error': 'Not found'}), 404
+    limit = request.args.get('limit', 20, type=int)
+    profiles = await asyncio.to_thread(list_profiles, limit)
+    return jsonify({'profiles': profiles})
+
+
+@app.route('/admin/profiles/<name>')
+async def admin_profile_file(name):
+    if not is_admin(request):
+        return jsonify({'error': 'Not found'}), 404
+    path = os.path.join(PROFILES_DIR, secure_filename(name))
+    if not name.endswith(('.prof', '.txt')) or not await asyncio.to_thread(os.path.exists, path):
+        return jsonify({'error': 'File không tồn tại'}), 404
+    return await send_file(os.path.abspath(path), as_attachment=name.endswith('.prof'))
+
+
+# ===============================
+#  MAIN
+# ===============================
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 8080))
+    app.run(host='0.0.0.0', port=port, debug=False)